@@ -0,0 +1,8 @@
+"""
+Benchmarks for the parsing engine.
+
+These aren't tests; they're small scripts for comparing implementation choices.
+Run them as modules from the repository root, e.g.
+
+    python -m parser.benchmarks.bench_tokens
+"""
@@ -0,0 +1,46 @@
+"""
+Benchmark of very ambiguous grammars.
+
+Generates from a sequence of k copies of a union that can match "a" three
+ways, reporting the time and the size (in states) of the biggest state the
+traversal gets to.
+"""
+
+from ..stateMachine import State, CounterStack, NaryState, Seq, Uni, Lit
+from .utils_for_benchmarks import printTable
+
+from typing import List
+import time
+
+
+def makeGrammar(k: int) -> State:
+    return Seq(*(Uni(Lit("text", "a"), Lit("text", "aa"), 
+                     Seq(Lit("text", "a"), Lit("text", "a"))) for _ in range(k)))
+
+def size(state: State) -> int:
+    if isinstance(state, NaryState):
+        return 1 + sum(size(child) for child in state.children)
+    return 1
+
+def maxStateSize(grammar: State) -> int:
+    tapes = grammar.compile()
+    states: List[State] = [grammar]
+    biggest: int = size(grammar)
+    while states:
+        states = [nextState for state in states 
+                  for _, _, _, nextState in state.dQuery(tapes, tapes.any(), CounterStack())]
+        biggest = max([biggest] + [size(state) for state in states])
+    return biggest
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for k in [2, 4, 6, 8, 10]:
+        grammar: State = makeGrammar(k)
+        start: float = time.perf_counter()
+        outputs = list(grammar.generate())
+        seconds: float = time.perf_counter() - start
+        rows.append([k, len(outputs), f"{seconds * 1e3:.1f}", maxStateSize(makeGrammar(k))])
+    printTable(["copies", "outputs", "generate (ms)", "biggest state"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Throughput benchmark of State.parseBatch().
+
+Makes a corpus from the synthetic lexicon of bench_frontier -- words of the
+lexicon, with Zipfian repetition, and some non-words -- and reports words
+per second parsing it word by word (joining, and with parse()) and in
+batches of various sizes.
+"""
+
+from ..stateMachine import State, Join, Lit
+from .bench_frontier import makeLexicon, makeStems, SUFFIXES
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List
+import random
+
+
+def makeCorpus(stems: List[str], numWords: int, seed: int = 0) -> List[str]:
+    rng: random.Random = random.Random(seed)
+    words: List[str] = [stem + suffix for stem in stems for suffix in SUFFIXES]
+    rng.shuffle(words)
+    weights: List[float] = [1 / (rank + 1) for rank in range(len(words))]
+    corpus: List[str] = rng.choices(words, weights, k=numWords)
+    for i in range(0, numWords, 10):
+        corpus[i] = corpus[i][::-1]   # mostly non-words
+    return corpus
+
+def main() -> None:
+    rows: List[List[object]] = []
+    numWords: int = 300
+    for numStems in [50, 200]:
+        grammar: State = makeLexicon(numStems)
+        grammar.compile()
+        corpus: List[str] = makeCorpus(makeStems(numStems), numWords)
+
+        def joinAll() -> None:
+            for word in corpus:
+                list(Join(Lit("text", word), grammar).generate())
+        def parseAll() -> None:
+            for word in corpus:
+                list(grammar.parse({"text": word}))
+        methods = [("join per word", joinAll), ("parse per word", parseAll)]
+        for chunkSize in [10, 100, 1000]:
+            def parseBatch(chunkSize: int = chunkSize) -> None:
+                list(grammar.parseBatch(corpus, chunkSize=chunkSize))
+            methods.append((f"parseBatch, chunkSize={chunkSize}", parseBatch))
+        
+        for method, function in methods:
+            seconds: float = bestOf(function, repeat=2)
+            rows.append([numStems, method, f"{numWords / seconds:.0f}"])
+    printTable(["stems", "method", "words/s"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+Benchmark of the transition cache (State.compile(cacheSize=...)).
+
+Generates the synthetic lexicon from bench_frontier several times over,
+with and without a cache, reporting the time of the first (cold) run, the
+best later (warm) run, and the cache's hit rate.
+"""
+
+from ..stateMachine import State
+from .bench_frontier import makeLexicon
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List
+import time
+
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for numStems in [50, 200, 500]:
+        for cacheSize in [0, 10000, 1000000]:
+            grammar: State = makeLexicon(numStems)
+            tapes = grammar.compile(cacheSize=cacheSize)
+            start: float = time.perf_counter()
+            numResults: int = len(list(grammar.generate(mergeStates=True)))
+            cold: float = time.perf_counter() - start
+            warm: float = bestOf(lambda: list(grammar.generate(mergeStates=True)), repeat=3)
+            hitRate: str = "-"
+            if tapes.transitions is not None:
+                lookups: int = tapes.transitions.hits + tapes.transitions.misses
+                hitRate = f"{tapes.transitions.hits / lookups:.0%}"
+            rows.append([numStems, cacheSize, numResults, f"{cold * 1e3:.1f}",
+                         f"{warm * 1e3:.1f}", hitRate])
+    printTable(["stems", "cache size", "results", "cold (ms)", "warm (ms)", 
+                "hit rate"], rows)
+
+if __name__ == "__main__":
+    main()
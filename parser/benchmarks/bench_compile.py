@@ -0,0 +1,33 @@
+"""
+Benchmark of per-query overhead on a big compiled grammar.
+
+Compiles the synthetic lexicon of bench_frontier, then times joining it with
+single-word queries -- words the grammar has all the symbols of, and words
+with a new symbol -- and, for scale, collecting the whole grammar's vocab.
+"""
+
+from ..stateMachine import State, Join, Lit
+from ..tapes import TapeCollection
+from .bench_frontier import makeLexicon, makeStems
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List
+
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for numStems in [500, 2000]:
+        grammar: State = makeLexicon(numStems)
+        grammar.compile()
+        collect: float = bestOf(lambda: grammar._collectVocab(TapeCollection(), []), repeat=3)
+        rows.append([numStems, "collect all vocab", f"{collect * 1e3:.2f}"])
+        word: str = makeStems(numStems)[7] + "an"
+        for label, query in [("join, known symbols", word), 
+                             ("join, new symbol", word + "z")]:
+            seconds: float = bestOf(lambda: list(Join(Lit("text", query), grammar).generate()), 
+                                    repeat=3)
+            rows.append([numStems, label, f"{seconds * 1e3:.2f}"])
+    printTable(["stems", "operation", "time (ms)"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Benchmark of dQuery on wide unions.
+
+Queries a union of N alternatives once with a free query, which is where
+dQuery has to make N results disjoint, for unions whose alternatives
+    - all start with different symbols (disjoint),
+    - all start with the same symbol (identical),
+    - start with a few different symbols, and some start with a dot (overlapping),
+    - are on N/10 different tapes (tapes).
+"""
+
+from ..stateMachine import State, CounterStack, Uni, Seq, Lit, Any
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import Callable, Dict, List
+
+
+def symbol(i: int) -> str:
+    return chr(0x4e00 + i)
+
+UNIONS: Dict[str, Callable[[int], State]] = {
+    "disjoint": lambda n: Uni(*(Lit("text", symbol(i) + "x") for i in range(n))),
+    "identical": lambda n: Uni(*(Lit("text", "a" + symbol(i)) for i in range(n))),
+    "overlapping": lambda n: Uni(*(Lit("text", symbol(i % 50) + symbol(i)) if i % 10
+                                   else Seq(Any("text"), Lit("text", symbol(i)))
+                                   for i in range(n))),
+    "tapes": lambda n: Uni(*(Lit(f"t{i % (n // 10)}", symbol(i)) for i in range(n))),
+}
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for name, makeUnion in UNIONS.items():
+        for n in [100, 1000, 5000]:
+            grammar: State = makeUnion(n)
+            tapes = grammar.compile()
+            query = lambda: list(grammar.dQuery(tapes, tapes.any(), CounterStack()))
+            numResults: int = len(query())
+            seconds: float = bestOf(query, repeat=3)
+            rows.append([name, n, numResults, f"{seconds * 1e3:.1f}"])
+    printTable(["union", "width", "results", "dQuery (ms)"], rows)
+
+if __name__ == "__main__":
+    main()
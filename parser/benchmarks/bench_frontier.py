@@ -0,0 +1,52 @@
+"""
+Benchmark of frontier merging in generate().
+
+Builds a synthetic lexicon -- a union of stems that share prefixes, followed
+by a union of suffixes, with a gloss for each -- and generates everything
+with and without mergeStates, reporting the largest frontier and wall time.
+"""
+
+from ..stateMachine import State, Seq, Uni, Lit
+from .utils_for_benchmarks import bestOf, printTable
+
+from itertools import product
+from typing import List
+
+ONSETS: List[str] = ["h", "q", "g", "kw", "tl", "x", "m", "n", "s", "l"]
+VOWELS: List[str] = ["a", "i", "u", "o", "e"]
+CODAS: List[str] = ["m", "x'", "d", "tl", "lh"]
+SUFFIXES: List[str] = ["an", "as", "ux", "i", "ida", "ala"]
+
+
+def makeStems(numStems: int) -> List[str]:
+    syllables: List[str] = ["".join(p) for p in product(ONSETS, VOWELS)]
+    stems: List[str] = []
+    for first, second, coda in product(syllables, syllables, CODAS):
+        stems.append(first + second + coda)
+        if len(stems) == numStems:
+            break
+    return stems
+
+def makeLexicon(numStems: int) -> State:
+    stems: State = Uni(*(Seq(Lit("text", s), Lit("gloss", f"S{i}"))
+                         for i, s in enumerate(makeStems(numStems))))
+    suffixes: State = Uni(*(Seq(Lit("text", s), Lit("gloss", f"-{s.upper()}"))
+                            for s in SUFFIXES))
+    return Seq(stems, suffixes)
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for numStems in [50, 200, 500]:
+        grammar: State = makeLexicon(numStems)
+        grammar.compile()
+        for merge in [False, True]:
+            sizes: List[int] = []
+            numResults: int = len(list(grammar.generate(mergeStates=merge, frontierSizes=sizes)))
+            seconds: float = bestOf(lambda: list(grammar.generate(mergeStates=merge)), repeat=3)
+            rows.append([numStems, merge, numResults, max(sizes), sum(sizes),
+                         f"{seconds * 1e3:.1f}"])
+    printTable(["stems", "mergeStates", "results", "max frontier", 
+                "total states", "time (ms)"], rows)
+
+if __name__ == "__main__":
+    main()
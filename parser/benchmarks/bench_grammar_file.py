@@ -0,0 +1,54 @@
+"""
+Benchmark of compiled grammar files.
+
+For lexicons of 10k and 100k rows (see bench_spreadsheets), compares a cold
+start -- loading the sheets, compiling the grammar, preparing it and saving it
+(loadGrammar() without a grammar file) -- with a warm start, which just loads
+the grammar file, and times the first parse after each.  Each start is made
+in a fresh process, as it would be for real; otherwise the grammars loaded
+earlier leave the heap in a state that slows the later ones down.
+"""
+
+from ..spreadsheets import loadGrammar
+from .bench_spreadsheets import writeLexicon
+from .utils_for_benchmarks import printTable
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import os
+import tempfile
+import time
+
+SIZES: List[int] = [10_000, 100_000]
+
+
+def timeStart(lexicon: str, word: str, cold: bool) -> Tuple[float, float]:
+    """ The time to get the grammar, and then to parse word with it """
+    grammarFile: str = os.path.splitext(lexicon)[0] + ".grammar"
+    if cold and os.path.exists(grammarFile):
+        os.remove(grammarFile)
+    start: float = time.perf_counter()
+    grammar, _ = loadGrammar([lexicon], "WORD")
+    loaded: float = time.perf_counter()
+    assert len(list(grammar.parse({"surf": word}))) == 1
+    return loaded - start, time.perf_counter() - loaded
+
+def main() -> None:
+    rows: List[List[object]] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for numRows in SIZES:
+            lexicon, word = writeLexicon(directory, numRows)
+            for cold in [True, False]:
+                timings: List[Tuple[float, float]] = []
+                for _ in range(3):
+                    with ProcessPoolExecutor(1) as executor:
+                        timings.append(executor.submit(timeStart, lexicon, word, cold).result())
+                loadSeconds, parseSeconds = min(timings)
+                fileSize: int = os.path.getsize(os.path.splitext(lexicon)[0] + ".grammar")
+                rows.append([numRows, "cold" if cold else "warm",
+                             f"{loadSeconds * 1e3:.0f}", f"{parseSeconds * 1e3:.0f}",
+                             f"{fileSize / 2**20:.1f}"])
+    printTable(["rows", "start", "get grammar (ms)", "first parse (ms)", "file (MiB)"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Benchmark of getting one result from an ambiguous grammar.
+
+A sequence of n unions of "a" and "b" has 2**n results, none of which are
+finished until step n.  Reports the time to get the first result with
+generate(maxResults=1), without and with a frontier limit, and with merging.
+"""
+
+from ..stateMachine import State, Seq, Uni, Lit
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List
+
+
+def makeGrammar(n: int) -> State:
+    return Seq(*(Uni(Lit("text", "a"), Lit("text", "b")) for _ in range(n)))
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for n in [8, 12, 16]:
+        grammar: State = makeGrammar(n)
+        grammar.compile()
+        unlimited: float = bestOf(lambda: list(grammar.generate(maxResults=1)), repeat=3)
+        limited: float = bestOf(lambda: list(grammar.generate(maxResults=1, maxFrontier=10)), 
+                                repeat=3)
+        merged: float = bestOf(lambda: list(grammar.generate(maxResults=1, mergeStates=True)), 
+                               repeat=3)
+        rows.append([n, f"{unlimited * 1e3:.1f}", f"{limited * 1e3:.1f}", f"{merged * 1e3:.1f}"])
+    printTable(["n", "maxResults=1 (ms)", "+ maxFrontier=10 (ms)", "+ mergeStates (ms)"], rows)
+
+if __name__ == "__main__":
+    main()
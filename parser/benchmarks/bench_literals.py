@@ -0,0 +1,34 @@
+"""
+Benchmark of long literals.
+
+Generates from, and parses with, a union of a few literals of lengths 5 to 500
+(the kind of thing lexicons with example sentences have), reporting the time
+per character.
+"""
+
+from ..stateMachine import State, Uni, Lit
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List
+import string
+
+
+def makeText(length: int, seed: int) -> str:
+    letters: str = string.ascii_lowercase + " "
+    return "".join(letters[(i * 7 + seed * 13) % len(letters)] for i in range(length))
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for length in [5, 20, 50, 100, 200, 500]:
+        texts: List[str] = [makeText(length, seed) for seed in range(4)]
+        grammar: State = Uni(*(Lit("text", t) for t in texts))
+        grammar.compile()
+        numChars: int = length * len(texts)
+        generate: float = bestOf(lambda: list(grammar.generate()), repeat=5)
+        parse: float = bestOf(lambda: list(grammar.parse({"text": texts[0]})), repeat=5)
+        rows.append([length, f"{generate / numChars * 1e6:.2f}", 
+                     f"{parse / length * 1e6:.2f}"])
+    printTable(["length", "generate (us/char)", "parse (us/char)"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark of minimized automata.
+
+For a single-tape lexicon -- a list of stems followed by a paradigm of
+suffixes -- compares the stems as a plain union, as a trie (whose nodes are
+shared where the stems end alike; see Trie()), and the whole lexicon as a
+minimal DFA (see Dfa()), for stems that share a lot (those of bench_frontier)
+and random ones (like those of bench_spreadsheets), reporting
+    - how many states the grammar has, as built: the union's literals, the
+      trie's nodes, or the DFA's states,
+    - the memory it takes (traced while building it),
+    - the time to build it, and
+    - the time to parse 100 words, and to generate everything.
+"""
+
+from ..stateMachine import State, DfaState, TrieState, Seq, Uni, Trie, Dfa, Lit
+from .bench_frontier import SUFFIXES, makeStems
+from .bench_spreadsheets import SYLLABLES
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import Callable, Dict, List, Set, Tuple
+import random
+import tracemalloc
+
+SIZES: List[int] = [2_000, 10_000]
+
+
+def randomStems(numStems: int) -> List[str]:
+    generator: random.Random = random.Random(numStems)
+    return sorted({"".join(generator.choices(SYLLABLES, k=3)) for _ in range(numStems)})
+
+def suffixes() -> State:
+    return Uni(*(Lit("text", s) for s in SUFFIXES))
+
+REPRESENTATIONS: Dict[str, Callable[[List[str]], State]] = {
+    "union": lambda stems: Seq(Uni(*(Lit("text", s) for s in stems)), suffixes()),
+    "trie": lambda stems: Seq(Trie(*(Lit("text", s) for s in stems)), suffixes()),
+    "dfa": lambda stems: Dfa(Seq(Trie(*(Lit("text", s) for s in stems)), suffixes())),
+}
+
+def numStates(grammar: State) -> int:
+    if isinstance(grammar, DfaState):
+        return grammar.table.numStates
+    stems: State = grammar.children[0]
+    if not isinstance(stems, TrieState):
+        return len(stems.children)
+    seen: Set[int] = set()
+    toVisit = [stems.node]
+    while toVisit:
+        node = toVisit.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        toVisit.extend(child for edges in node.edges.values() for _, child in edges.values())
+    return len(seen)
+
+def build(makeGrammar: Callable[[List[str]], State], stems: List[str]) -> Tuple[State, int]:
+    """ The grammar, and the memory it takes """
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    grammar: State = makeGrammar(stems)
+    size: int = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return grammar, size
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for kind, makeStemList in [("shared", makeStems), ("random", randomStems)]:
+        for size in SIZES:
+            stems: List[str] = makeStemList(size)
+            words: List[str] = [s + random.Random(i).choice(SUFFIXES)
+                                for i, s in enumerate(random.Random(size).sample(stems, 100))]
+            for name, makeGrammar in REPRESENTATIONS.items():
+                buildSeconds: float = bestOf(lambda: makeGrammar(stems), repeat=3)
+                grammar, memory = build(makeGrammar, stems)
+                grammar.compile()
+                parseSeconds: float = bestOf(
+                    lambda: [list(grammar.parse({"text": w})) for w in words], repeat=3)
+                generateSeconds: float = bestOf(lambda: list(grammar.generate()), repeat=3)
+                rows.append([kind, len(stems), name, numStates(grammar),
+                             f"{memory / 2**20:.2f}", f"{buildSeconds * 1e3:.0f}",
+                             f"{parseSeconds * 1e3:.1f}", f"{generateSeconds * 1e3:.0f}"])
+    printTable(["stems", "number", "as", "states", "memory (MiB)", "build (ms)",
+                "100 parses (ms)", "generate (ms)"], rows)
+
+if __name__ == "__main__":
+    main()
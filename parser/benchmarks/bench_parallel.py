@@ -0,0 +1,37 @@
+"""
+Throughput benchmark of parallelParse().
+
+Parses a corpus from the synthetic lexicon of bench_frontier with
+State.parseBatch() in this process, and with parallelParse() over a few
+numbers of workers, reporting words per second.
+"""
+
+from ..parallel import parallelParse
+from ..stateMachine import State
+from .bench_batch import makeCorpus
+from .bench_frontier import makeLexicon, makeStems
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List
+import os
+
+
+def main() -> None:
+    numStems: int = 200
+    numWords: int = 4000
+    chunkSize: int = 250
+    grammar: State = makeLexicon(numStems)
+    grammar.compile()
+    corpus: List[str] = makeCorpus(makeStems(numStems), numWords)
+    rows: List[List[object]] = []
+
+    seconds: float = bestOf(lambda: list(grammar.parseBatch(corpus, chunkSize=chunkSize)), repeat=1)
+    rows.append(["parseBatch", 1, f"{numWords / seconds:.0f}"])
+    for numWorkers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        seconds = bestOf(lambda: list(parallelParse(grammar, corpus, numWorkers=numWorkers,
+                                                    chunkSize=chunkSize)), repeat=1)
+        rows.append(["parallelParse", numWorkers, f"{numWords / seconds:.0f}"])
+    printTable(["method", "workers", "words/s"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark of State.parse() against joining with the input.
+
+Parses a handful of words from the synthetic lexicon of bench_frontier, of
+increasing size, both by joining each word with the lexicon and generating
+(the old way) and by parse(), with and without a transition cache, and
+reports the time per word.
+"""
+
+from ..stateMachine import State, Join, Lit
+from .bench_frontier import makeLexicon, makeStems, SUFFIXES
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List
+
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for numStems in [50, 200, 500]:
+        stems: List[str] = makeStems(numStems)
+        words: List[str] = [stems[i] + SUFFIXES[i % len(SUFFIXES)] 
+                            for i in range(0, numStems, numStems // 5)]
+        grammar: State = makeLexicon(numStems)
+        grammar.compile()
+        cachedGrammar: State = makeLexicon(numStems)
+        cachedGrammar.compile(cacheSize=100000)
+
+        def joinAll() -> None:
+            for word in words:
+                list(Join(Lit("text", word), grammar).generate())
+        def parseAll() -> None:
+            for word in words:
+                list(grammar.parse({"text": word}))
+        def parseFirst() -> None:
+            for word in words:
+                list(grammar.parse({"text": word}, maxResults=1))
+        def parseCached() -> None:
+            for word in words:
+                list(cachedGrammar.parse({"text": word}))
+        
+        for method, function in [("join", joinAll), ("parse", parseAll), 
+                                 ("parse, maxResults=1", parseFirst),
+                                 ("parse, cached", parseCached)]:
+            seconds: float = bestOf(function, repeat=3)
+            rows.append([numStems, method, f"{seconds / len(words) * 1e3:.2f}"])
+    printTable(["stems", "method", "time per word (ms)"], rows)
+
+if __name__ == "__main__":
+    main()
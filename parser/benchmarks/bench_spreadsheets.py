@@ -0,0 +1,88 @@
+"""
+Benchmark of loading lexicon sheets.
+
+Writes a lexicon CSV of N rows (stem, gloss and class columns, the stems made
+of random syllables and the glosses and classes repeating) and a stanza of
+suffixes, and for N = 1k, 10k and 100k reports
+    - the time to load the lexicon,
+    - the peak and retained memory of loading it (traced separately, since
+      tracing slows loading down),
+    - for comparison, the memory it takes just to hold every cell as a
+      (filename, row, col, header, text) tuple, as old/grable's Stanza.lines
+      did before compiling anything, and
+    - the time of the first parse of a word through the loaded grammar.
+"""
+
+from ..spreadsheets import SheetCompiler, SheetReport
+from ..stateMachine import State, Embed
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List, Tuple
+import csv
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+SIZES: List[int] = [1_000, 10_000, 100_000]
+SYLLABLES: List[str] = [c + v for c in "ptkbdgmnslwy" for v in "aeiou"]
+
+
+def writeLexicon(directory: str, numRows: int) -> Tuple[str, str]:
+    lexicon: str = os.path.join(directory, f"lexicon{numRows}.csv")
+    generator: random.Random = random.Random(numRows)
+    stems: List[str] = ["".join(generator.choices(SYLLABLES, k=3)) + str(i)
+                        for i in range(numRows)]
+    with open(lexicon, "w", newline="", encoding="utf-8") as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(["STEM", "surf", "gloss", "class"])
+        for i in range(numRows):
+            writer.writerow(["", stems[i], f"gloss{i % 500}", f"C{i % 7}"])
+        writer.writerow(["WORD", "var", "surf", "suffix"])
+        for suffix in ["an", "as", "ux", "i"]:
+            writer.writerow(["", "STEM", suffix, f"-{suffix.upper()}"])
+    return lexicon, stems[numRows // 2] + "an"
+
+def cellTupleBytes(filename: str) -> int:
+    """ The memory taken by every cell of filename, held as a tuple """
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    with open(filename, "r", newline="", encoding="utf-8") as csvFile:
+        headers: List[str] = []
+        lines: List[List[Tuple]] = []
+        for rowNum, cells in enumerate(csv.reader(csvFile)):
+            if cells[0]:
+                headers = cells
+                continue
+            lines.append([(filename, rowNum, col, headers[col], cells[col].strip())
+                          for col in range(1, len(cells)) if cells[col].strip()])
+    size: int = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size
+
+def main() -> None:
+    rows: List[List[object]] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for numRows in SIZES:
+            lexicon, word = writeLexicon(directory, numRows)
+            seconds: float = bestOf(lambda: SheetCompiler().loadFile(lexicon), repeat=3)
+            traced: SheetReport = SheetCompiler(traceMemory=True).loadFile(lexicon)
+            compiler: SheetCompiler = SheetCompiler()
+            compiler.loadFile(lexicon)
+            grammar: State = Embed("WORD", compiler.symbolTable)
+            start: float = time.perf_counter()
+            numParses: int = len(list(grammar.parse({"surf": word})))
+            parseSeconds: float = time.perf_counter() - start
+            assert numParses == 1
+            rows.append([numRows, f"{seconds * 1e3:.0f}",
+                         f"{numRows / seconds:,.0f}",
+                         f"{(traced.peakBytes or 0) / 2**20:.1f}",
+                         f"{(traced.retainedBytes or 0) / 2**20:.1f}",
+                         f"{cellTupleBytes(lexicon) / 2**20:.1f}",
+                         f"{parseSeconds * 1e3:.0f}"])
+    printTable(["rows", "load (ms)", "rows/s", "peak (MiB)", "retained (MiB)",
+                "cell tuples (MiB)", "first parse (ms)"], rows)
+
+if __name__ == "__main__":
+    main()
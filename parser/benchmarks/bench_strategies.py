@@ -0,0 +1,48 @@
+"""
+Benchmark of the generation strategies on a wide lexicon.
+
+Generates everything from the lexicon of bench_frontier (stems followed by
+suffixes) breadth-first, depth-first, and by iterative deepening, reporting
+the time to the first result, the total time, and how much the peak RSS grew
+while generating.  Each run is done in a fresh process, since the peak RSS
+of a process only ever goes up.
+"""
+
+from ..stateMachine import State
+from .bench_frontier import makeLexicon
+from .utils_for_benchmarks import printTable
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import resource
+import time
+
+
+def run(numStems: int, strategy: str) -> Tuple[float, float, int, int]:
+    grammar: State = makeLexicon(numStems)
+    grammar.compile()
+    baseline: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start: float = time.perf_counter()
+    first: float = 0.0
+    numResults: int = 0
+    for _ in grammar.generate(strategy=strategy):
+        if numResults == 0:
+            first = time.perf_counter() - start
+        numResults += 1
+    total: float = time.perf_counter() - start
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return first, total, peak - baseline, numResults
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for numStems in [200, 1000, 2500]:
+        for strategy in ["bfs", "dfs", "iddfs"]:
+            with ProcessPoolExecutor(1) as executor:
+                first, total, rss, numResults = executor.submit(run, numStems, strategy).result()
+            rows.append([numStems, strategy, numResults, f"{first * 1e3:.1f}", 
+                         f"{total * 1e3:.0f}", rss // 1024])
+    printTable(["stems", "strategy", "results", "first result (ms)", 
+                "total (ms)", "peak RSS growth (MB)"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark of skipping states by their tapes (see State.tapeMask).
+
+A lexicon with three tapes -- stems and suffixes with their text and gloss,
+as in bench_frontier, followed by a part-of-speech tag on a tape of its own
+-- is joined with queries on each of its tapes (which is where a state gets
+asked about a tape it has nothing to do with, since the query's matches are
+passed on to the lexicon), with and without skipping the states that can't
+match the tape, reporting the time to get all the results and how many
+states got asked (called ndQuery()).
+"""
+
+from .. import stateMachine
+from ..stateMachine import State, Seq, Uni, Lit, Join
+from .bench_frontier import SUFFIXES, makeStems
+from .utils_for_benchmarks import bestOf, printTable
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+import random
+
+SIZES: List[int] = [500, 2_000, 10_000]
+TAGS: List[str] = ["N", "V", "ADJ"]
+
+
+def makeLexicon(stems: List[str]) -> State:
+    rows: State = Uni(*(Seq(Lit("text", s), Lit("gloss", f"S{i}"))
+                        for i, s in enumerate(stems)))
+    suffixes: State = Uni(*(Seq(Lit("text", s), Lit("gloss", f"-{s.upper()}"))
+                            for s in SUFFIXES))
+    tags: State = Uni(*(Lit("pos", tag) for tag in TAGS))
+    return Seq(rows, suffixes, tags)
+
+@contextmanager
+def withoutMasks() -> Iterator[None]:
+    """ Ask every state, as if it might match any tape """
+    ignores = stateMachine._ignores
+    stateMachine._ignores = lambda *args: False
+    try:
+        yield
+    finally:
+        stateMachine._ignores = ignores
+
+def countQueries(function: Callable[[], object]) -> int:
+    """ How many times function calls ndQuery() """
+    counts: List[int] = [0]
+    originals: Dict[type, Callable] = {}
+    classes: List[type] = [stateMachine.State]
+    while classes:
+        cls: type = classes.pop()
+        classes.extend(cls.__subclasses__())
+        if "ndQuery" in cls.__dict__:
+            originals[cls] = cls.__dict__["ndQuery"]
+    def counting(original: Callable) -> Callable:
+        def ndQuery(self, *args):
+            counts[0] += 1
+            return original(self, *args)
+        return ndQuery
+    for cls, original in originals.items():
+        setattr(cls, "ndQuery", counting(original))
+    try:
+        function()
+    finally:
+        for cls, original in originals.items():
+            setattr(cls, "ndQuery", original)
+    return counts[0]
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for numStems in SIZES:
+        stems: List[str] = makeStems(numStems)
+        i: int = random.Random(numStems).randrange(numStems)
+        queries: Dict[str, State] = {
+            "text": Lit("text", stems[i] + SUFFIXES[0]),
+            "gloss": Lit("gloss", f"S{i}-{SUFFIXES[0].upper()}"),
+            "pos, then text": Seq(Lit("pos", "V"), Lit("text", stems[i] + SUFFIXES[0])),
+        }
+        for tapeName, query in queries.items():
+            for masks in [False, True]:
+                lexicon: State = makeLexicon(stems)
+                lexicon.compile()
+                def run() -> int:
+                    return len(list(Join(query, lexicon).generate()))
+                if masks:
+                    numResults: int = run()
+                    seconds: float = bestOf(run, repeat=3)
+                    numQueries: int = countQueries(run)
+                else:
+                    with withoutMasks():
+                        numResults = run()
+                        seconds = bestOf(run, repeat=3)
+                        numQueries = countQueries(run)
+                rows.append([numStems, tapeName, masks, numResults, numQueries,
+                             f"{seconds * 1e3:.1f}"])
+    printTable(["stems", "query on", "tape masks", "results", "states asked", "time (ms)"],
+               rows)
+
+if __name__ == "__main__":
+    main()
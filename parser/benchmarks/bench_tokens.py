@@ -0,0 +1,74 @@
+"""
+Micro-benchmark comparing the token backends.
+
+Times the three operations that dominate State.dQuery (and_, andNot and
+isEmpty) under each backend, then times a whole generate() call on a small
+grammar so the difference can be seen in context.
+"""
+
+from ..stateMachine import State, Seq, Uni, Join, Any, Lit
+from ..tapes import Token, TOKEN_BACKENDS, TapeCollection, setTokenBackend, \
+                    getTokenBackend
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List
+
+OPS_PER_RUN: int = 100_000
+
+
+def benchOps() -> List[List[object]]:
+    rows: List[List[object]] = []
+    for name, backend in TOKEN_BACKENDS.items():
+        tapes: TapeCollection = TapeCollection(backend)
+        tapes.addToVocab("text", "ab")
+        tapes.fixWidth()
+        a, b = tapes.tokenize("text", "ab")
+        anyChar: Token = tapes.matchTape("text").any()
+        timings: List[str] = []
+
+        def andOp() -> None:
+            for _ in range(OPS_PER_RUN):
+                anyChar.and_(a)
+
+        def andNotOp() -> None:
+            for _ in range(OPS_PER_RUN):
+                a.andNot(b)
+
+        def isEmptyOp() -> None:
+            for _ in range(OPS_PER_RUN):
+                a.isEmpty()
+
+        for op in (andOp, andNotOp, isEmptyOp):
+            seconds: float = bestOf(op)
+            timings.append(f"{seconds / OPS_PER_RUN * 1e9:.0f}")
+        rows.append([name] + timings)
+    return rows
+
+def makeGrammar() -> State:
+    stems: State = Uni(*(Lit("text", w) for w in
+                         ["hamx'id", "qotlal", "galulhx'id", "kwax'id", "tlixw"]))
+    suffixes: State = Uni(*(Lit("text", s) for s in ["an", "as", "ux", "i"]))
+    return Join(Seq(stems, suffixes), Seq(Any("text"), Any("text"), Any("text"), Lit("text", "x'idux")))
+
+def benchGenerate() -> List[List[object]]:
+    rows: List[List[object]] = []
+    oldBackend: str = getTokenBackend().name
+    try:
+        for name in TOKEN_BACKENDS:
+            setTokenBackend(name)
+            grammar: State = makeGrammar()
+            seconds: float = bestOf(lambda: list(grammar.generate()), number=10)
+            rows.append([name, f"{seconds / 10 * 1e3:.2f}"])
+    finally:
+        setTokenBackend(oldBackend)
+    return rows
+
+def main() -> None:
+    print("Token operations (ns/op)")
+    printTable(["backend", "and_", "andNot", "isEmpty"], benchOps())
+    print()
+    print("generate() on a small join grammar (ms/call)")
+    printTable(["backend", "generate"], benchGenerate())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark of literal unions made into tries.
+
+For lists of stems (the prefix-sharing stems of bench_frontier), compares the
+stems as a plain union with the stems as a trie (see Trie()):
+    - the live alternatives of generating the stems: the frontier's states,
+      counting each child of a union as one.  (generate()'s frontier itself
+      is about the same size either way, since dQuery() already puts the
+      successors of the same symbol in one union; what a trie saves is how
+      many rows that union has, which is what every later query has to go
+      through.)
+    - for a lexicon of the stems, each with a gloss, followed by a union of
+      suffixes, the time to build the grammar, generate everything and parse
+      100 words.
+
+Then, for the lexicon sheets of bench_spreadsheets, compares loading them with
+and without tries, and the first and later parses of a word.
+"""
+
+from ..spreadsheets import SheetCompiler
+from ..stateMachine import State, ConcatState, UnionState, CounterStack, Seq, Uni, Trie, \
+                           Lit, Embed
+from ..tapes import TapeCollection
+from .bench_frontier import SUFFIXES, makeStems
+from .bench_spreadsheets import writeLexicon
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import Callable, List, Tuple
+import random
+import tempfile
+import time
+
+SIZES: List[int] = [500, 2_000, 10_000]
+SHEET_SIZES: List[int] = [10_000, 100_000]
+
+
+def makeLexicon(stems: List[str], union: Callable[..., State]) -> State:
+    rows: State = union(*(Seq(Lit("text", s), Lit("gloss", f"S{i}"))
+                          for i, s in enumerate(stems)))
+    suffixes: State = Uni(*(Seq(Lit("text", s), Lit("gloss", f"-{s.upper()}"))
+                            for s in SUFFIXES))
+    return Seq(rows, suffixes)
+
+def width(state: State) -> int:
+    """ How many alternatives state has left """
+    if isinstance(state, UnionState):
+        return sum(width(child) for child in state.children)
+    if isinstance(state, ConcatState):
+        return width(state.children[0])
+    return 1
+
+def alternatives(grammar: State) -> Tuple[int, int]:
+    """ The most live alternatives at any step of generation, and the total """
+    tapes: TapeCollection = grammar.compile()
+    frontier: List[State] = [grammar]
+    sizes: List[int] = []
+    while frontier:
+        sizes.append(sum(width(state) for state in frontier))
+        frontier = [nextState for state in frontier
+                    for _, _, _, nextState in state.dQuery(tapes, tapes.any(), CounterStack())]
+    return max(sizes), sum(sizes)
+
+def compareGrammars() -> None:
+    rows: List[List[object]] = []
+    for numStems in SIZES:
+        stems: List[str] = makeStems(numStems)
+        words: List[str] = [s + random.Random(i).choice(SUFFIXES)
+                            for i, s in enumerate(random.Random(numStems).sample(stems, 100))]
+        for union in [Uni, Trie]:
+            buildSeconds: float = bestOf(lambda: makeLexicon(stems, union), repeat=3)
+            maxAlternatives, totalAlternatives = alternatives(union(*(Lit("text", s)
+                                                                      for s in stems)))
+            grammar: State = makeLexicon(stems, union)
+            numResults: int = len(list(grammar.generate()))
+            generateSeconds: float = bestOf(lambda: list(grammar.generate()), repeat=3)
+            parseSeconds: float = bestOf(lambda: [list(grammar.parse({"text": w})) for w in words],
+                                         repeat=3)
+            rows.append([numStems, union.__name__, numResults, maxAlternatives,
+                         totalAlternatives, f"{buildSeconds * 1e3:.1f}",
+                         f"{generateSeconds * 1e3:.1f}", f"{parseSeconds * 1e3:.1f}"])
+    printTable(["stems", "stems as", "results", "max alternatives", "total alternatives",
+                "build (ms)", "generate (ms)", "100 parses (ms)"], rows)
+
+def compareSheets() -> None:
+    rows: List[List[object]] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for numRows in SHEET_SIZES:
+            lexicon, word = writeLexicon(directory, numRows)
+            for tries in [False, True]:
+                loadSeconds: float = bestOf(lambda: SheetCompiler(tries=tries).loadFile(lexicon),
+                                            repeat=3)
+                compiler: SheetCompiler = SheetCompiler(tries=tries)
+                compiler.loadFile(lexicon)
+                grammar: State = Embed("WORD", compiler.symbolTable)
+                start: float = time.perf_counter()
+                assert len(list(grammar.parse({"surf": word}))) == 1
+                firstSeconds: float = time.perf_counter() - start
+                parseSeconds: float = bestOf(lambda: list(grammar.parse({"surf": word})),
+                                             repeat=5)
+                rows.append([numRows, tries, f"{loadSeconds * 1e3:.0f}",
+                             f"{firstSeconds * 1e3:.1f}", f"{parseSeconds * 1e3:.2f}"])
+    printTable(["rows", "tries", "load (ms)", "first parse (ms)", "parse (ms)"], rows)
+
+def main() -> None:
+    compareGrammars()
+    compareSheets()
+
+if __name__ == "__main__":
+    main()
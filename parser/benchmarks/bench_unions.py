@@ -0,0 +1,53 @@
+"""
+Benchmark of very large unions.
+
+Builds a union of up to 100k random words (each with a gloss), and reports
+the time to build it, to compile it, and to parse one word with it, the first
+time (when the union indexes its children) and again afterwards.
+"""
+
+from ..stateMachine import State, Seq, Uni, Lit
+from .utils_for_benchmarks import printTable
+
+from typing import List
+import random
+import time
+
+
+def makeWords(numWords: int, seed: int = 0) -> List[str]:
+    rng: random.Random = random.Random(seed)
+    letters: str = "abcdefghijklmnopqrstuvwxyz"
+    words: List[str] = []
+    seen = set()
+    while len(words) < numWords:
+        word: str = "".join(rng.choice(letters) for _ in range(rng.randint(4, 9)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def makeWordList(words: List[str]) -> State:
+    return Uni(*(Seq(Lit("text", w), Lit("gloss", f"G{i}")) for i, w in enumerate(words)))
+
+def main() -> None:
+    rows: List[List[object]] = []
+    for numWords in [1000, 10000, 100000]:
+        words: List[str] = makeWords(numWords)
+        start: float = time.perf_counter()
+        grammar: State = makeWordList(words)
+        built: float = time.perf_counter()
+        grammar.compile()
+        compiled: float = time.perf_counter()
+        results = list(grammar.parse({"text": words[numWords // 2]}))
+        parsed: float = time.perf_counter()
+        assert len(results) == 1
+        results = list(grammar.parse({"text": words[numWords // 3]}))
+        reparsed: float = time.perf_counter()
+        assert len(results) == 1
+        rows.append([numWords, f"{(built - start) * 1e3:.0f}", 
+                     f"{(compiled - built) * 1e3:.0f}", f"{(parsed - compiled) * 1e3:.0f}",
+                     f"{(reparsed - parsed) * 1e3:.1f}"])
+    printTable(["words", "build (ms)", "compile (ms)", "parse (ms)", "next parse (ms)"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Scaling benchmark for tape vocabulary size.
+
+Builds grammars whose single tape uses 32, 256 and 4096 distinct symbols, and
+times (a) generating every word and (b) parsing one word by joining it with
+the grammar, under each token backend.  Throughput is reported in characters
+output per second, so that the grammars of different sizes are comparable.
+"""
+
+from ..stateMachine import State, Uni, Join, Lit
+from ..tapes import TOKEN_BACKENDS, setTokenBackend, getTokenBackend
+from .utils_for_benchmarks import bestOf, printTable
+
+from typing import List
+
+VOCAB_SIZES: List[int] = [32, 256, 4096]
+WORD_LENGTH: int = 8
+NUM_WORDS: int = 64
+
+
+def makeWords(vocabSize: int) -> List[str]:
+    """
+    Make NUM_WORDS distinct words that between them use every one of vocabSize
+    symbols (CJK ideographs, so they're all distinct).  Words are at least
+    WORD_LENGTH symbols long, longer if that's what it takes to cover the
+    vocabulary.
+    """
+    symbols: List[str] = [chr(0x4E00 + i) for i in range(vocabSize)]
+    length: int = max(WORD_LENGTH, vocabSize // NUM_WORDS + 2)
+    words: List[str] = []
+    for i in range(NUM_WORDS):
+        # the first two symbols keep the words distinct
+        prefix: str = symbols[i % vocabSize] + symbols[(i // vocabSize) % vocabSize]
+        words.append(prefix + "".join(symbols[(i * (length - 2) + j) % vocabSize]
+                                      for j in range(length - 2)))
+    return words
+
+def main() -> None:
+    rows: List[List[object]] = []
+    oldBackend: str = getTokenBackend().name
+    try:
+        for backend in TOKEN_BACKENDS:
+            setTokenBackend(backend)
+            for vocabSize in VOCAB_SIZES:
+                words: List[str] = makeWords(vocabSize)
+                grammar: State = Uni(*(Lit("text", w) for w in words))
+                numChars: int = sum(len(w) for w in words)
+                genSeconds: float = bestOf(lambda: list(grammar.generate(maxChars=5000)),
+                                           repeat=3)
+                query: State = Join(Lit("text", words[NUM_WORDS // 2]), grammar)
+                parseSeconds: float = bestOf(lambda: list(query.generate()), repeat=3)
+                rows.append([backend, vocabSize,
+                             f"{numChars / genSeconds:,.0f}",
+                             f"{parseSeconds * 1e3:.2f}"])
+    finally:
+        setTokenBackend(oldBackend)
+    printTable(["backend", "symbols", "generate (chars/s)", "parse one word (ms)"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+from typing import Callable, List
+import time
+
+
+def bestOf(function: Callable[[], object], repeat: int = 5, number: int = 1) -> float:
+    """
+    Return the best (i.e., least noisy) time in seconds of calling function
+    number times in a row, out of repeat attempts.
+    """
+    best: float = float("inf")
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def printTable(header: List[str], rows: List[List[object]]) -> None:
+    """ Print a simple left-aligned table of results. """
+    cells: List[List[str]] = [header] + [[str(c) for c in row] for row in rows]
+    widths: List[int] = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    for row in cells:
+        print("  ".join(c.ljust(w) for c, w in zip(row, widths)))
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Final, Generic, Hashable, Optional, TypeVar
+
+""" Caches
+
+The engine is lazy: states work out their successors when they're queried,
+rather than us building the whole state graph up front.  That's essential for
+grammars whose graphs would be enormous, but it means that a state reached a
+million times works out its successors a million times.  A TransitionCache
+remembers the results of queries, so that the parts of the graph we actually
+visit get built once and afterwards are just table lookups.
+
+Since we still can't afford the whole graph, the cache is bounded: when it's
+full, the entry used least recently is dropped.
+"""
+
+Value = TypeVar('Value')
+
+
+class TransitionCache(Generic[Value]):
+    """ Transition Cache
+
+    A least-recently-used table from queries to their results.  It also
+    interns objects (namely, the states that queries lead to), so that
+    structurally identical states found by different queries become the same
+    object, and share everything they've cached about themselves.
+
+    Attributes:
+        maxEntries: the most query results to keep at once
+        hits, misses: lookup statistics
+    """
+    def __init__(self, maxEntries: int = 100000) -> None:
+        if maxEntries < 1:
+            raise ValueError("A TransitionCache needs room for at least one entry")
+        self.maxEntries: Final[int] = maxEntries
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[Hashable, Value] = OrderedDict()
+        self._interned: OrderedDict[Hashable, Hashable] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Value]:
+        value: Optional[Value] = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Value) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+
+    def intern(self, obj: Hashable) -> Hashable:
+        """
+        Return the canonical object equal to obj, making obj canonical if
+        there isn't one yet.
+        """
+        canonical: Optional[Hashable] = self._interned.get(obj)
+        if canonical is None:
+            self._interned[obj] = obj
+            if len(self._interned) > self.maxEntries:
+                self._interned.popitem(last=False)
+            return obj
+        self._interned.move_to_end(obj)
+        return canonical
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._interned.clear()
+        self.hits = 0
+        self.misses = 0
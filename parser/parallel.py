@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+from .stateMachine import State, Join
+from .util import StringDict, Gen
+
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import deque
+from itertools import islice
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Set, Tuple
+import os
+
+""" Parallel parsing and generation
+
+Python only runs one thread at a time, so to use more than one core we need
+more than one process.  The functions here start a pool of worker processes,
+send each of them the grammar once (compiled, so that it arrives with its
+vocabulary and nobody has to collect it again), and then hand out the inputs
+in chunks.
+
+Only a limited number of chunks are in flight at once, so we never read much
+further ahead in the inputs than the workers have gotten, and never hold onto
+many more results than the caller has taken; that keeps memory bounded however
+long the input stream is.  Results come back either in the order of the
+inputs, or in whatever order they're finished.
+"""
+
+# The grammar, in each worker process; set by _initWorker()
+_workerGrammar: Optional[State] = None
+
+
+def _initWorker(grammar: State, cacheSize: int) -> None:
+    global _workerGrammar
+    grammar.compile(cacheSize)
+    _workerGrammar = grammar
+
+def _parseChunk(chunk: List[str],
+                tapeName: str,
+                maxResults: Optional[int]) -> List[Tuple[str, List[StringDict]]]:
+    assert _workerGrammar is not None
+    return list(_workerGrammar.parseBatch(chunk, tapeName, len(chunk), maxResults))
+
+def _generateChunk(chunk: List[State],
+                   maxRecursion: int,
+                   maxChars: int) -> List[Tuple[State, List[StringDict]]]:
+    assert _workerGrammar is not None
+    return [(query, list(Join(query, _workerGrammar).generate(maxRecursion, maxChars)))
+            for query in chunk]
+
+
+def parallelParse(grammar: State,
+                  inputs: Iterable[str],
+                  tapeName: str = "text",
+                  numWorkers: Optional[int] = None,
+                  chunkSize: int = 1000,
+                  maxInFlight: Optional[int] = None,
+                  ordered: bool = True,
+                  maxResults: Optional[int] = None,
+                  cacheSize: int = 0) -> Gen[Tuple[str, List[StringDict]]]:
+    """
+    Parse inputs on tapeName in parallel, like State.parseBatch() does in a
+    single process.
+
+    @param grammar The grammar to parse with; it gets compiled, if it isn't
+                already
+    @param inputs The strings to parse
+    @param [tapeName] The tape the inputs are on
+    @param [numWorkers] How many processes to use (default: one per core)
+    @param [chunkSize] How many inputs to send to a worker at a time
+    @param [maxInFlight] The most chunks to have sent out but not yet given
+                back to the caller (default: twice the number of workers)
+    @param [ordered] Whether to give back results in the order of the inputs,
+                or in the order they're finished
+    @param [maxResults] The most results to keep for any one input
+    @param [cacheSize] The size of each worker's TransitionCache (see
+                State.compile()); 0 for no cache
+    @returns a generator of (input, results) pairs
+    """
+    for results in _runChunks(grammar, cacheSize, inputs, chunkSize,
+                              lambda chunk: (_parseChunk, chunk, tapeName, maxResults),
+                              numWorkers, maxInFlight, ordered):
+        yield from results
+
+def parallelGenerate(grammar: State,
+                     queries: Iterable[State],
+                     numWorkers: Optional[int] = None,
+                     chunkSize: int = 100,
+                     maxInFlight: Optional[int] = None,
+                     ordered: bool = True,
+                     maxRecursion: int = 4,
+                     maxChars: int = 1000,
+                     cacheSize: int = 0) -> Gen[Tuple[State, List[StringDict]]]:
+    """
+    Join each of the query grammars with grammar and generate, in parallel.
+    This is for queries that parse() can't do, e.g. ones with dots in them.
+
+    @param grammar The grammar to query; it gets compiled, if it isn't already
+    @param queries The query grammars
+    @param [numWorkers] How many processes to use (default: one per core)
+    @param [chunkSize] How many queries to send to a worker at a time
+    @param [maxInFlight] The most chunks to have sent out but not yet given
+                back to the caller (default: twice the number of workers)
+    @param [ordered] Whether to give back results in the order of the
+                queries, or in the order they're finished
+    @param [maxRecursion] The maximum number of times the grammar can
+                recurse; for infinite recursion pass Infinity.
+    @param [maxChars] The maximum number of steps any one traversal can take
+    @param [cacheSize] The size of each worker's TransitionCache (see
+                State.compile()); 0 for no cache
+    @returns a generator of (query, results) pairs
+    """
+    for results in _runChunks(grammar, cacheSize, queries, chunkSize,
+                              lambda chunk: (_generateChunk, chunk, maxRecursion, maxChars),
+                              numWorkers, maxInFlight, ordered):
+        yield from results
+
+def _runChunks(grammar: State,
+               cacheSize: int,
+               items: Iterable[Any],
+               chunkSize: int,
+               makeTask: Callable[[List[Any]], Tuple],
+               numWorkers: Optional[int],
+               maxInFlight: Optional[int],
+               ordered: bool) -> Gen[List[Any]]:
+    """
+    Split items into chunks and run makeTask(chunk) -- a (function, *args)
+    tuple -- on each of them in a pool of workers, with at most maxInFlight
+    chunks pending at once.
+    """
+    grammar.compile()
+    iterator: Iterator[Any] = iter(items)
+    with ProcessPoolExecutor(numWorkers, initializer=_initWorker,
+                             initargs=(grammar, cacheSize)) as executor:
+        if maxInFlight is None:
+            maxInFlight = 2 * (numWorkers or os.cpu_count() or 1)
+        pending: Deque[Future] = deque()
+        running: Set[Future] = set()
+        exhausted: bool = False
+        while True:
+            while not exhausted and len(pending) + len(running) < maxInFlight:
+                chunk: List[Any] = list(islice(iterator, chunkSize))
+                if len(chunk) == 0:
+                    exhausted = True
+                    break
+                function, *args = makeTask(chunk)
+                future: Future = executor.submit(function, *args)
+                if ordered:
+                    pending.append(future)
+                else:
+                    running.add(future)
+            if ordered:
+                if len(pending) == 0:
+                    return
+                yield pending.popleft().result()
+            else:
+                if len(running) == 0:
+                    return
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.remove(future)
+                    yield future.result()
@@ -0,0 +1,443 @@
+from __future__ import annotations
+
+from .stateMachine import State, SymbolTable, UnionState, CounterStack, Seq, Uni, Trie, Lit, Embed
+from .tapes import TapeCollection
+
+from typing import Dict, Final, Iterable, List, Optional, Sequence, Set, Tuple
+import csv
+import gc
+import hashlib
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+
+""" Spreadsheets
+
+Grammars are written as spreadsheets, saved as CSV.  A sheet is a series of
+stanzas, each of them a header row followed by content rows, like
+
+    ROOT,  gloss,  surf
+        ,  eat,    hamx'id
+        ,  know,   qotlal
+
+    WORD,  var,    var
+        ,  ROOT,   SUFFIX
+
+The first cell of a header row is the name of a symbol, and the rest of its
+cells are column headers, which are tape names (or "var"; see below).  Content
+rows leave the first cell empty.  Each content row is the sequence of its
+cells: a literal on its column's tape, or, in a "var" column, the symbol the
+cell names (see EmbedState).  A symbol is the union of its rows.  Rows that are
+empty, or whose first cell starts with "#", are skipped.  A symbol with many
+rows, like a lexicon, is made into a trie instead (see TrieState), so that
+rows that start alike are matched together.
+
+Lexicon sheets run to hundreds of thousands of rows, so a sheet is read a row
+at a time and each row is turned into a state straight away: a stanza is never
+held as cells, just as the list of its rows, which becomes one n-ary
+UnionState.  Identical cells (the same gloss on a thousand rows, say) share
+one state.
+
+Even so, reading a big lexicon and compiling and indexing it takes seconds,
+and a process that just wants to parse with it would
+rather not do that every time it starts.  So loadGrammar() keeps the compiled
+grammar in a file next to the sheets (see GRAMMAR_FILE_MAGIC), and as long as
+the sheets haven't changed, the next process just loads that.
+"""
+
+# The column header for cells that name a symbol, rather than being literals
+VAR_HEADER: Final[str] = "var"
+
+# Compiled grammar files start with this, then the fingerprint of what they
+# were compiled from (see _fingerprint()), then the pickled grammar.  Change
+# the version whenever a change to the states or tapes would make old files
+# unpickle into something wrong.
+GRAMMAR_FILE_MAGIC: Final[bytes] = b"GRAMMAR\x03"
+FINGERPRINT_SIZE: Final[int] = hashlib.sha256().digest_size
+
+
+class SheetError(Exception):
+    """ Exception for a problem in the contents of a sheet.
+
+    These are collected in a SheetReport, rather than raised, so that one bad
+    cell doesn't stop the rest of the sheet loading; raise them if you want.
+
+    Attributes:
+        sheetName: the sheet the problem is in
+        row: the row it's in, counting from 0 as the CSV does
+        col: the column it's in, counting from 0; None if it's the whole row
+        msg: explanatory error message
+    """
+    def __init__(self, sheetName: str, row: int, col: Optional[int], msg: str) -> None:
+        self.sheetName = sheetName
+        self.row = row
+        self.col = col
+        self.msg = msg
+        location: str = f"{sheetName}:{row}" if col is None else f"{sheetName}:{row}:{col}"
+        super().__init__(f"{location}: {msg}")
+
+    def __reduce__(self) -> Tuple:
+        return (SheetError, (self.sheetName, self.row, self.col, self.msg))
+
+
+class SheetReport:
+    """ Sheet Report
+
+    What loading a sheet defined, what went wrong, and what it cost.
+
+    Attributes:
+        sheetName: the sheet's name
+        numRows: how many (non-empty, non-comment) rows it has
+        symbols: the names of the symbols it defined, in order
+        errors: the problems found in it (see SheetError)
+        seconds: how long it took to load
+        peakBytes: the most memory allocated at once while loading it, and
+        retainedBytes: the memory still allocated afterwards, i.e. the size
+            of its grammar; both None unless memory was traced (see
+            SheetCompiler)
+    """
+    __slots__ = ("sheetName", "numRows", "symbols", "errors", "seconds",
+                 "peakBytes", "retainedBytes")
+
+    def __init__(self, sheetName: str) -> None:
+        self.sheetName: str = sheetName
+        self.numRows: int = 0
+        self.symbols: List[str] = []
+        self.errors: List[SheetError] = []
+        self.seconds: float = 0.0
+        self.peakBytes: Optional[int] = None
+        self.retainedBytes: Optional[int] = None
+
+    def __str__(self) -> str:
+        summary: str = f"{self.sheetName}: {self.numRows} rows, {len(self.symbols)} symbols, " \
+                       f"{len(self.errors)} errors, {self.seconds * 1e3:.1f} ms"
+        if self.peakBytes is not None and self.retainedBytes is not None:
+            summary += f", {self.peakBytes / 2**20:.1f} MiB peak, " \
+                       f"{self.retainedBytes / 2**20:.1f} MiB retained"
+        return summary
+
+
+class SheetCompiler:
+    """ Sheet Compiler
+
+    Compiles sheets into a SymbolTable.  Sheets loaded by the same compiler
+    share the table, so a "var" cell can name a symbol from another sheet, or
+    one that isn't defined until a later sheet; names are only looked up when
+    the grammar is queried.
+
+    Attributes:
+        symbolTable: the symbols defined so far
+        reports: a SheetReport for each sheet loaded so far, in order
+        traceMemory: whether to measure the memory each sheet takes, with
+            tracemalloc.  That slows loading down a lot, so leave it off when
+            what you want to know is how long loading takes.
+        tries: whether to make symbols with many rows into tries (see
+            Trie()), rather than plain unions.  Building the trie of a big
+            lexicon takes a while (it makes loading a 100k-row sheet about
+            three times as slow), but it's made up for by the first parse,
+            and parses after that are hundreds of times as fast.
+    """
+    def __init__(self,
+                 symbolTable: Optional[SymbolTable] = None,
+                 traceMemory: bool = False,
+                 tries: bool = True) -> None:
+        self.symbolTable: Final[SymbolTable] = symbolTable if symbolTable is not None else {}
+        self.reports: Final[List[SheetReport]] = []
+        self.traceMemory: bool = traceMemory
+        self.tries: bool = tries
+        self._cells: Dict[Tuple[str, str], State] = {}
+        # The symbols named in the "var" cells of each symbol's rows
+        self._references: Dict[str, Set[str]] = {}
+
+    def loadFile(self, filename: str) -> SheetReport:
+        """
+        Load a sheet from a CSV file, named after the file.
+
+        @param filename The path of the CSV file
+        @returns the sheet's report
+        """
+        sheetName: str = os.path.splitext(os.path.basename(filename))[0]
+        with open(filename, "r", newline="", encoding="utf-8") as csvFile:
+            return self.loadRows(sheetName, csv.reader(csvFile))
+
+    def loadRows(self, sheetName: str, rows: Iterable[Sequence[str]]) -> SheetReport:
+        """
+        Load a sheet from its rows of cells, e.g. from a csv.reader.  The rows
+        are read one at a time, and not kept.
+
+        @param sheetName The sheet's name, for its report and errors
+        @param rows The sheet's rows
+        @returns the sheet's report
+        """
+        report: SheetReport = SheetReport(sheetName)
+        startTracing: bool = self.traceMemory and not tracemalloc.is_tracing()
+        if startTracing:
+            tracemalloc.start()
+        before: int = 0
+        if self.traceMemory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start: float = time.perf_counter()
+        try:
+            self._compileRows(report, rows)
+        finally:
+            report.seconds = time.perf_counter() - start
+            if self.traceMemory:
+                current, peak = tracemalloc.get_traced_memory()
+                report.retainedBytes = current - before
+                report.peakBytes = peak - before
+            if startTracing:
+                tracemalloc.stop()
+        self.reports.append(report)
+        return report
+
+    def _compileRows(self, report: SheetReport, rows: Iterable[Sequence[str]]) -> None:
+        symbolName: Optional[str] = None
+        headerRow: int = 0
+        headers: Dict[int, str] = {}
+        stanza: List[State] = []
+        references: Set[str] = set()
+        for rowNum, cells in enumerate(rows):
+            if _isRowEmpty(cells):
+                continue
+            report.numRows += 1
+            first: str = cells[0].strip()
+            if first:
+                # a header row, starting a new stanza
+                if symbolName is not None:
+                    self._define(report, symbolName, headerRow, stanza, references)
+                symbolName, headerRow, stanza, references = first, rowNum, [], set()
+                headers = {col: cell.strip() for col, cell in enumerate(cells)
+                           if col > 0 and cell.strip()}
+                continue
+            if symbolName is None:
+                report.errors.append(SheetError(report.sheetName, rowNum, None,
+                    "This row should belong to a symbol, but no symbol precedes it"))
+                continue
+            row: Optional[State] = self._compileRow(report, rowNum, cells, headers, references)
+            if row is not None:
+                stanza.append(row)
+        if symbolName is not None:
+            self._define(report, symbolName, headerRow, stanza, references)
+
+    def _compileRow(self,
+                    report: SheetReport,
+                    rowNum: int,
+                    cells: Sequence[str],
+                    headers: Dict[int, str],
+                    references: Set[str]) -> Optional[State]:
+        children: List[State] = []
+        for col in range(1, len(cells)):
+            text: str = cells[col].strip()
+            if not text:
+                continue
+            header: Optional[str] = headers.get(col)
+            if header is None:
+                report.errors.append(SheetError(report.sheetName, rowNum, col,
+                    "This cell doesn't have a column header"))
+                continue
+            if header == VAR_HEADER:
+                references.add(text)
+            children.append(self._compileCell(header, text))
+        if len(children) == 0:
+            return None
+        return Seq(*children)
+
+    def _compileCell(self, header: str, text: str) -> State:
+        cell: Optional[State] = self._cells.get((header, text))
+        if cell is None:
+            cell = Embed(text, self.symbolTable) if header == VAR_HEADER else Lit(header, text)
+            self._cells[(header, text)] = cell
+        return cell
+
+    def reachable(self, rootSymbol: str) -> List[str]:
+        """ The symbols defined so far that rootSymbol uses, itself included """
+        found: List[str] = []
+        toVisit: List[str] = [rootSymbol]
+        visited: Set[str] = set(toVisit)
+        while toVisit:
+            symbolName: str = toVisit.pop()
+            if symbolName not in self.symbolTable:
+                continue
+            found.append(symbolName)
+            for reference in self._references.get(symbolName, ()):
+                if reference not in visited:
+                    visited.add(reference)
+                    toVisit.append(reference)
+        return found
+
+    def prepare(self, tapes: TapeCollection, rootSymbol: str) -> None:
+        """
+        Do ahead of time the work that the first queries of rootSymbol's
+        grammar would otherwise do, with tapes (which should be that grammar's
+        compiled tapes; see State.compile()): index the big unions of the
+        symbols it uses, which tokenizes the literals they start with.  Unions
+        keep their indices, and tapes the tokens of the strings they've
+        tokenized, including when they're pickled.  (Tries don't need
+        anything done; their rows are only tokenized a symbol at a time.)
+        """
+        for symbolName in self.reachable(rootSymbol):
+            union: State = self.symbolTable[symbolName]
+            if isinstance(union, UnionState) and \
+                    len(union.children) >= UnionState.INDEX_THRESHOLD:
+                union.index(tapes, CounterStack())
+
+    def _define(self,
+                report: SheetReport,
+                symbolName: str,
+                headerRow: int,
+                stanza: List[State],
+                references: Set[str]) -> None:
+        if len(stanza) == 0:
+            report.errors.append(SheetError(report.sheetName, headerRow, None,
+                f"Symbol {symbolName} has no rows"))
+        elif symbolName in self.symbolTable:
+            report.errors.append(SheetError(report.sheetName, headerRow, None,
+                f"Symbol {symbolName} is already defined; this definition is ignored"))
+        else:
+            if self.tries and len(stanza) >= UnionState.INDEX_THRESHOLD:
+                self.symbolTable[symbolName] = Trie(*stanza)
+            else:
+                # A union this small is cheap enough to query as it is
+                self.symbolTable[symbolName] = Uni(*stanza)
+            self._references[symbolName] = references
+            report.symbols.append(symbolName)
+
+
+def _isRowEmpty(cells: Sequence[str]) -> bool:
+    """ Is the row a comment, or made only of empty cells? """
+    if len(cells) == 0 or cells[0].strip().startswith("#"):
+        return True
+    return not any(cell.strip() for cell in cells)
+
+def loadSheets(filenames: Iterable[str],
+               traceMemory: bool = False) -> Tuple[SymbolTable, List[SheetReport]]:
+    """
+    Compile CSV sheets into one SymbolTable; see SheetCompiler.
+
+    @param filenames The CSV files to load, in order
+    @param [traceMemory] Whether to measure the memory each sheet takes
+    @returns the symbol table, and a report for each sheet
+    """
+    compiler: SheetCompiler = SheetCompiler(traceMemory=traceMemory)
+    for filename in filenames:
+        compiler.loadFile(filename)
+    return compiler.symbolTable, compiler.reports
+
+def loadGrammar(filenames: Sequence[str],
+                rootSymbol: str,
+                grammarFile: Optional[str] = None) -> Tuple[State, List[SheetReport]]:
+    """
+    Get the compiled grammar of rootSymbol in the given sheets, from
+    grammarFile if that was compiled from exactly these sheets, and
+    otherwise by loading them, compiling it and preparing it for queries
+    (see SheetCompiler.prepare()), and then saving it in grammarFile for
+    next time.
+
+    The grammar file is only trusted if its fingerprint (a hash of the
+    contents of the sheets, and of rootSymbol) matches; a file that's out of
+    date, or can't be read, is just replaced.  Remember that a grammar file
+    is a pickle, so only load ones you (or your build) wrote.
+
+    @param filenames The CSV files to load, in order
+    @param rootSymbol The symbol whose grammar we want
+    @param [grammarFile] Where to keep the compiled grammar (default: next to
+                the first sheet, with the extension .grammar)
+    @returns the grammar, and the reports of loading the sheets (those from
+                when it was compiled, if it comes from grammarFile)
+    """
+    if grammarFile is None:
+        grammarFile = os.path.splitext(filenames[0])[0] + ".grammar"
+    fingerprint: bytes = _fingerprint(filenames, rootSymbol)
+    saved: Optional[Tuple[State, List[SheetReport]]] = _readGrammarFile(grammarFile, fingerprint)
+    if saved is not None:
+        return saved
+
+    compiler: SheetCompiler = SheetCompiler()
+    for filename in filenames:
+        compiler.loadFile(filename)
+    grammar: State = Embed(rootSymbol, compiler.symbolTable)
+    compiler.prepare(grammar.compile(), rootSymbol)
+    _writeGrammarFile(grammarFile, fingerprint, (grammar, compiler.reports))
+    return grammar, compiler.reports
+
+def _fingerprint(filenames: Sequence[str], rootSymbol: str) -> bytes:
+    digest = hashlib.sha256(GRAMMAR_FILE_MAGIC)
+    for part in [rootSymbol.encode("utf-8")] + [_readBytes(f) for f in filenames]:
+        # lengths first, so that the parts can't run into one another
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.digest()
+
+def _readBytes(filename: str) -> bytes:
+    with open(filename, "rb") as sheetFile:
+        return sheetFile.read()
+
+def _readGrammarFile(grammarFile: str,
+                     fingerprint: bytes) -> Optional[Tuple[State, List[SheetReport]]]:
+    """
+    Unpickle what's in grammarFile, if it has the right fingerprint; None if
+    not (or if it can't be read at all).  The file is mapped rather than read
+    into a buffer of its own, and the unpickler reads straight from the map.
+    """
+    headerSize: int = len(GRAMMAR_FILE_MAGIC) + FINGERPRINT_SIZE
+    try:
+        with open(grammarFile, "rb") as savedFile, \
+                mmap.mmap(savedFile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped[:headerSize] != GRAMMAR_FILE_MAGIC + fingerprint:
+                return None
+            with memoryview(mapped) as view:
+                # Unpickling makes hundreds of thousands of objects, none of
+                # them garbage, and each batch of them would otherwise set
+                # off the cycle collector.
+                collecting: bool = gc.isenabled()
+                gc.disable()
+                try:
+                    return pickle.loads(view[headerSize:])
+                finally:
+                    if collecting:
+                        gc.enable()
+    except Exception:
+        # missing, empty, truncated, or from an incompatible version
+        return None
+
+def _writeGrammarFile(grammarFile: str, fingerprint: bytes, saved: Tuple) -> None:
+    """
+    Pickle saved into grammarFile.  The file is written under another name
+    and then renamed, so that a process reading it never sees half of it.
+    Failing to write it isn't fatal, since it's only a cache.
+    """
+    directory: str = os.path.dirname(os.path.abspath(grammarFile))
+    try:
+        descriptor, tempName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as tempFile:
+                tempFile.write(GRAMMAR_FILE_MAGIC + fingerprint)
+                pickle.dump(saved, tempFile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tempName, grammarFile)
+        except BaseException:
+            os.remove(tempName)
+            raise
+    except (OSError, pickle.PicklingError, RecursionError) as error:
+        print(f"Warning: couldn't save the compiled grammar in {grammarFile}: {error}",
+              file=sys.stderr)
+
+
+def main() -> None:
+    """
+    Load the CSV files named on the command line, and report on them (with
+    --memory, on their memory too)
+    """
+    filenames: List[str] = [arg for arg in sys.argv[1:] if arg != "--memory"]
+    _, reports = loadSheets(filenames, traceMemory="--memory" in sys.argv)
+    for report in reports:
+        print(report)
+        for error in report.errors:
+            print(f"  {error}")
+
+if __name__ == "__main__":
+    main()
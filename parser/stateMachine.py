@@ -1,12 +1,16 @@
 from __future__ import annotations
 
-from .util import StringDict, Gen, BitSet
+from .util import StringDict, Gen, Bits
+from .cache import TransitionCache
 from .tapes import MultiTapeOutput, Tape, StringTape, RenamedTape, \
-                  TapeCollection, Token, ANY_CHAR, NO_CHAR
+                  TapeCollection, Token, TokenBackend, ALL_TAPES, tapeBit
 
-from typing import Final, Optional, List, Dict, Tuple, Callable, TypeVar
+from typing import Final, Optional, List, Dict, Set, FrozenSet, Tuple, Callable, TypeVar, Hashable, \
+                   Iterable, Iterator, Sequence
 from abc import ABC, abstractmethod
+from array import array
 
+import heapq
 import sys
 import json
 
@@ -33,6 +37,8 @@ Each state constructs successor states as necessary.
 """
 
 
+_HASH_MODULUS: Final[int] = 2 ** 61 - 1
+
 class CounterStack:
     """ CounterStack
     
@@ -51,26 +57,77 @@ class CounterStack:
     recursions before stopping recursion.  Advanced programmers will be able to
     turn this off and allow infinite recursion, but they have to take an extra
     step to do so.
+
+    Stacks are persistent: each one is a frame holding the key that was added
+    and its new count, pointing to the stack it was added to, so add() doesn't
+    copy anything.  A stack also remembers what's been added to it, so adding
+    the same key to the same stack twice gives the same object, and all the
+    paths of a traversal that embed the same symbols share their stacks.
+    Stacks with the same counts are equal (however they got them) and hash
+    the same, so they can be part of a cache key (see State.dQuery()).  The
+    hash is the sum of the hashes of the (key, count) pairs, so each frame
+    can work it out from its parent's.
     """
+    __slots__ = ("max", "_key", "_count", "_parent", "_children", "_counts", "_hash")
+
     def __init__(self, max: int = 4) -> None:
         self.max: int = max
-        self.stack: Dict[str, int] = {}
+        self._key: Optional[str] = None
+        self._count: int = 0
+        self._parent: Optional[CounterStack] = None
+        self._children: Dict[str, CounterStack] = {}
+        self._counts: Optional[FrozenSet[Tuple[str, int]]] = None
+        self._hash: int = hash(max)
 
     def add(self, key: str) -> CounterStack:
-        result: CounterStack = CounterStack(self.max)
-        result.stack[key] = 0
-        result.stack.update(self.stack)
-        result.stack[key] += 1
+        result: Optional[CounterStack] = self._children.get(key)
+        if result is None:
+            count: int = self.get(key)
+            result = CounterStack(self.max)
+            result._key = key
+            result._count = count + 1
+            result._parent = self
+            result._hash = (self._hash + hash((key, count + 1)) - 
+                            (hash((key, count)) if count else 0)) % _HASH_MODULUS
+            self._children[key] = result
         return result
     
     def get(self, key: str) -> int:
-        return self.stack.get(key, 0)
+        frame: Optional[CounterStack] = self
+        while frame is not None and frame._key is not None:
+            if frame._key == key:
+                return frame._count
+            frame = frame._parent
+        return 0
 
     def exceedsMax(self, key: str) -> bool:
         return self.get(key) >= self.max
 
+    @property
+    def counts(self) -> FrozenSet[Tuple[str, int]]:
+        """ The (key, count) pairs of everything that's been added """
+        if self._counts is None:
+            counts: Dict[str, int] = {}
+            frame: Optional[CounterStack] = self
+            while frame is not None and frame._key is not None:
+                counts.setdefault(frame._key, frame._count)
+                frame = frame._parent
+            self._counts = frozenset(counts.items())
+        return self._counts
+
+    def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
+        if not isinstance(other, CounterStack):
+            return False
+        return self.max == other.max and hash(self) == hash(other) and \
+               self.counts == other.counts
+
+    def __hash__(self) -> int:
+        return self._hash
+
     def toString(self) -> str:
-        return json.dumps(self.stack)
+        return json.dumps(dict(sorted(self.counts)))
 
 
 class StateError(Exception):
@@ -127,7 +184,67 @@ class State(ABC):
             specific character can only lead to one state.
         accepting(): Whether this state is a final state, meaning it consistutes
             a complete parse.
+
+    States are immutable once constructed, and two states with the same
+    structure (e.g. two LiteralStates looking for the same remaining text on
+    the same tape) behave identically, so States compare and hash by
+    structure.  That lets us spot when different paths have arrived at the
+    same state (see mergeFrontier()).  The hash is cached, since successor
+    states share most of their structure with their predecessors.  So is
+    the state's tapeMask, which says what tapes it has anything to do with.
     """
+    __slots__ = ("_compiledTapes", "_hash", "_tapeMask")
+
+    def __init__(self) -> None:
+        self._compiledTapes: Optional[TapeCollection] = None
+        self._hash: Optional[int] = None
+        self._tapeMask: Optional[int] = None
+
+    @abstractmethod
+    def _key(self) -> Tuple:
+        """
+        Return the parts of this state that determine its behavior, for
+        structural comparison and hashing.  (The state's class is compared
+        separately.)
+        """
+        pass
+
+    def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
+        if type(self) is not type(other):
+            return False
+        assert isinstance(other, State)
+        return hash(self) == hash(other) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            self._hash = hash((self.__class__.__name__, self._key()))
+        return self._hash
+
+    def __getstate__(self) -> Dict:
+        # String hashes differ from process to process, so a pickled state
+        # mustn't bring its cached hash along (nor its tapeMask, since tape
+        # bits are given out per process).  Most states aren't compiled,
+        # so we leave that out too unless they are; grammars can have
+        # hundreds of thousands of states, and every entry makes unpickling
+        # them slower.
+        state: Dict = {name: getattr(self, name) 
+                       for cls in type(self).__mro__ 
+                       for name in getattr(cls, "__slots__", ())
+                       if name != "_hash" and name != "_tapeMask"}
+        state.update(getattr(self, "__dict__", {}))
+        if state["_compiledTapes"] is None:
+            del state["_compiledTapes"]
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self._compiledTapes = None
+        self._hash = None
+        self._tapeMask = None
+        for name, value in state.items():
+            setattr(self, name, value)
+
     @property
     @abstractmethod
     def id(self) -> str:
@@ -141,6 +258,35 @@ class State(ABC):
         """
         pass
 
+    @property
+    def tapeMask(self) -> int:
+        """
+        The tapes this state, or anything it can become, might match, as a
+        mask of their tapeBit()s.  Queried on one tape that isn't among them,
+        the state just gives itself back, unmatched, so there's no need to
+        ask it (see _ignores()); that's what lets a ConcatState or JoinState
+        skip the children that have nothing to do with a tape, and a whole
+        lexicon gets skipped as quickly as a literal.
+
+        States that might do anything else on another tape (say, match
+        nothing at all, like a TrivialState) have to be asked, so their mask
+        is ALL_TAPES, and so is that of anything containing them.
+
+        The mask is worked out from the states' children the first time it's
+        needed (compile() does it for the whole grammar) and kept, so a
+        successor only has to combine the masks of its children.
+        """
+        if self._tapeMask is None:
+            # Anything that gets back to this state while we work this out
+            # is recursive, and might match anything
+            self._tapeMask = ALL_TAPES
+            self._tapeMask = self._computeTapeMask()
+        return self._tapeMask
+
+    def _computeTapeMask(self) -> int:
+        """ Work out the state's tapeMask """
+        return ALL_TAPES
+
     def accepting(self, symbolStack: CounterStack) -> bool:
         """
         Return whether the state is accepting (i.e. indicates that we have
@@ -155,6 +301,16 @@ class State(ABC):
         """
         return False
 
+    def acceptingWeight(self, symbolStack: CounterStack) -> Optional[float]:
+        """
+        What it costs to stop here: the least weight of the ways this state
+        can accept without matching anything more (see WeightState), or None
+        if it isn't accepting().  Weights are usually paid by the tokens a
+        path matches, but a weighted branch that matches nothing (like a
+        weighted Empty()) can only be paid for here.
+        """
+        return 0.0 if self.accepting(symbolStack) else None
+
     @abstractmethod
     def ndQuery(self,
                 tape: Tape, 
@@ -200,17 +356,25 @@ class State(ABC):
         accurately, so that all returned transitions are disjoint).  (There can
         still be multiple results; when we query ANY:ANY, for example.)
 
-        This looks a bit complicated (and it kind of is) but what it's doing is
-        handing off the query to ndQuery, then combining results so that there's
-        no overlap between the tokens.  For example, say ndQuery yields two
-        tokens X and Y, and they have no intersection.  Then we're good, we just
-        yield those.  But if they do have an intersection, we need to return
-        three paths:
+        This hands off the query to ndQuery, then combines results so that
+        there's no overlap between the tokens.  For example, say ndQuery yields
+        two tokens X and Y, and they have no intersection.  Then we're good, we
+        just yield those.  But if they do have an intersection, we need to
+        return three paths:
         
            X&Y (leading to the UnionState of the states X and Y would have led to)
            X-Y (leading to the state X would have led to)
            Y-X (leading to the state Y would have led to)
-        
+
+        (See _makeDisjoint() for how that's done without comparing every
+        result to every other.)
+
+        The one exception is weights: results whose tokens have different
+        weights (see WeightedToken) are kept apart even if they overlap, since
+        each path has to keep its own weight.  So the results are only
+        disjoint among those of the same weight, and in a weighted grammar
+        the same symbol can lead to more than one state.
+
         @param tape A Tape object identifying the name/type/vocabulary of the
                     relevant tape
         @param target A Token identifying what characters we need to match
@@ -222,86 +386,540 @@ class State(ABC):
             matched is whether we actually made a match or ignored it (for being
                 on the wrong tape)
             nextState is the state the matched transition leads to.
-        """
-        results: List[Tuple[Tape, Token, bool, State]] = []
-        nextStates: List[Tuple[Tape, Token, bool, State]] 
-        nextStates = list(self.ndQuery(tape, target, symbolStack))
-        for tape, bits, matched, nxt in nextStates:
-            if tape.numTapes == 0:
-                results.append((tape, bits, matched, nxt))
-                continue
 
-            newResults: List[Tuple[Tape, Token, bool, State]] = []
-            for otherTape, otherBits, otherMatched, otherNext in results:
-                if (tape.tapeName != otherTape.tapeName):
-                    newResults.append((otherTape, otherBits, otherMatched, otherNext))
-                    continue
+        If the tape carries a TransitionCache (see compile()), results are
+        looked up there first and stored there afterwards.  A state that has
+        nothing to do with the tape (see tapeMask) isn't asked at all.
+        """
+        if _ignores(self, tape, symbolStack, target):
+            yield (tape, target, False, self)
+            return
 
-                intersection: Token = bits.and_(otherBits)
-                if not intersection.isEmpty():
-                    union: State = UnionState(nxt, otherNext)
-                    newResults.append((tape, intersection, matched or otherMatched, union))
-                bits = bits.andNot(intersection)
-                otherBits = otherBits.andNot(intersection)
-                if not otherBits.isEmpty():
-                    newResults.append((otherTape, otherBits, otherMatched, otherNext))
-            results = newResults
-            if not bits.isEmpty():
-                results.append((tape, bits, matched, nxt))
+        transitions: Final[Optional[TransitionCache]] = tape.transitions
+        if transitions is not None:
+            key: Final[Tuple] = (self, tape, target.bits, target.weight, symbolStack)
+            cached = transitions.get(key)
+            if cached is not None:
+                yield from cached
+                return
+
+        results: List[Tuple[Tape, Token, bool, State]]
+        results = _makeDisjoint(list(self.ndQuery(tape, target, symbolStack)))
+        if transitions is not None:
+            results = [(t, b, m, transitions.intern(n)) for t, b, m, n in results]
+            transitions.put(key, tuple(results))
         yield from results
 
-    def generate(self, maxRecursion: int = 4, maxChars: int = 1000) -> Gen[StringDict]:
+    def generate(self, 
+                 maxRecursion: int = 4, 
+                 maxChars: int = 1000,
+                 mergeStates: bool = False,
+                 frontierSizes: Optional[List[int]] = None,
+                 maxResults: Optional[int] = None,
+                 maxFrontier: Optional[int] = None,
+                 strategy: str = "bfs") -> Gen[StringDict]:
         """
-        Perform a breadth-first traversal of the graph.  This will be the
-        function that most clients will be calling.
-
-        Note that there's no corresponding "parse" function, only "generate".
-        To do parses, we join the grammar with a grammar corresponding to the
-        query.  E.g., if we wanted to parse { text: "foo" } in grammar X, we
-        would construct JoinState(LiteralState("text", "foo"), X). The reason
-        for this is that it allows us a diverse collection of query types for
-        free, by choosing an appropriate "query grammar" to join X with.
+        Perform a traversal of the graph (breadth-first, unless you ask for
+        something else).  This will be the function that most clients will be
+        calling.
+
+        To do general queries, we join the grammar with a grammar corresponding
+        to the query.  E.g., if we wanted to parse { text: "foo" } in grammar
+        X, we could construct JoinState(LiteralState("text", "foo"), X). The
+        reason for this is that it allows us a diverse collection of query
+        types for free, by choosing an appropriate "query grammar" to join X
+        with.  (For the most common kind of query, though, where we know the
+        whole string on some tapes, parse() is much faster.)
+
+        A breadth-first traversal keeps every path of the current step in
+        memory, which for a wide grammar (like a big lexicon) can be a lot.
+        A depth-first one ("dfs") only keeps the path it's on (and the
+        alternatives at each step of it), so it needs memory proportional to
+        the depth rather than the width, and gets to its first result sooner,
+        but gives results in a different order.  An iterative-deepening one
+        ("iddfs") does depth-first traversals to depth 0, 1, 2, ..., giving
+        only the results at exactly that depth each time, so it gives results
+        in the same order (step by step) as breadth-first does, with the memory
+        of depth-first, at the cost of traversing the top of the graph again
+        for every depth.
         
         @param [maxRecursion] The maximum number of times the grammar can
                     recurse; for infinite recursion pass Infinity.
         @param [maxChars] The maximum number of steps any one traversal can take
                     (roughly == the total number of characters output to all
                     tapes)
+        @param [mergeStates] Whether to merge paths that arrive at the same
+                    state at the same step (see mergeFrontier()), so that the
+                    frontier only ever holds distinct states.  The outputs
+                    are the same either way, although not necessarily in the
+                    same order.  (Breadth-first only.)
+        @param [frontierSizes] If given, the size of each step's frontier is
+                    appended to this list (for benchmarking and debugging).
+                    (Breadth-first only.)
+        @param [maxResults] Stop after this many results; None for no limit.
+                    (Unlike stopping iterating, this also stops expanding a
+                    merged output into its results partway through.)
+        @param [maxFrontier] Keep only the first this many paths at each step,
+                    and don't even query the rest; None for no limit.  This
+                    keeps an ambiguous grammar's frontier from growing
+                    exponentially before it gets to any results, so together
+                    with maxResults it makes "just give me one" cheap, but the
+                    paths that are dropped are gone, so some results may be
+                    missed.  (Breadth-first only.)
+        @param [strategy] "bfs" (breadth-first), "dfs" (depth-first),
+                    "iddfs" (iterative deepening) or "best" (best-first; see
+                    generateBest())
         @returns a generator of { tape: string } dictionaries, one for each
             successful traversal. 
         """
-        allTapes: TapeCollection = TapeCollection()
-        self.collectVocab(allTapes, [])
+        if maxResults is not None and maxResults <= 0:
+            return
+        symbolStack = CounterStack(maxRecursion)
+        outputs: Gen[MultiTapeOutput]
+        if strategy == "bfs":
+            outputs = self._generateBreadthFirst(symbolStack, maxChars, mergeStates,
+                                                 frontierSizes, maxFrontier)
+        elif strategy == "dfs":
+            outputs = (output for output, state, depth 
+                       in self._traverseDepthFirst(symbolStack, maxChars)
+                       if state.accepting(symbolStack))
+        elif strategy == "iddfs":
+            outputs = self._generateIterativeDeepening(symbolStack, maxChars)
+        elif strategy == "best":
+            outputs = (output for _, output in self._generateBestFirst(symbolStack, maxChars))
+        else:
+            raise StateError(f"Unknown generation strategy: {strategy}")
+
+        numResults: int = 0
+        for output in outputs:
+            for result in output.toStrings():
+                yield result
+                numResults += 1
+                if maxResults is not None and numResults >= maxResults:
+                    return
+
+    def generateBest(self,
+                     maxRecursion: int = 4,
+                     maxChars: int = 1000,
+                     maxResults: Optional[int] = None) -> Gen[Tuple[float, StringDict]]:
+        """
+        Generate the outputs of a weighted grammar (see WeightState) best
+        first, i.e. in order of their weights, lightest first, along with
+        those weights.
+
+        The frontier is a heap of paths, keyed on the weight of the path so
+        far.  Since weights are never negative, a path only gets heavier as it
+        goes, so once we get to a finished path, there's no lighter one left
+        to find, and we never go any further down a path than we have to to
+        get to the results that are asked for.  (Paths that weigh the same
+        are taken in the order they were found, so an unweighted grammar is
+        traversed breadth-first.)
+
+        Note that the same output can come out more than once, if there's more
+        than one way (of different weights) to get it.
+
+        @param [maxRecursion] The maximum number of times the grammar can
+                    recurse; for infinite recursion pass Infinity.
+        @param [maxChars] The maximum number of steps any one traversal can take
+        @param [maxResults] Stop after this many results; None for no limit
+        @returns a generator of (weight, { tape: string }) pairs
+        """
+        if maxResults is not None and maxResults <= 0:
+            return
+        numResults: int = 0
+        for weight, output in self._generateBestFirst(CounterStack(maxRecursion), maxChars):
+            for result in output.toStrings():
+                yield (weight, result)
+                numResults += 1
+                if maxResults is not None and numResults >= maxResults:
+                    return
+
+    def _generateBestFirst(self,
+                           symbolStack: CounterStack,
+                           maxChars: int) -> Gen[Tuple[float, MultiTapeOutput]]:
+        """ Yield the (weight, output) of each accepting path, best-first; see generateBest() """
+        allTapes: Final[TapeCollection] = self._getTapes()
+        anyChar: Final[Token] = allTapes.any()
+        if maxChars <= 0:
+            return
+        # (weight, order found, steps, output, state); a path with no state is
+        # one that's finished, and just waiting its turn to be yielded
+        heap: List[Tuple[float, int, int, MultiTapeOutput, Optional[State]]] = \
+            [(0.0, 0, 0, MultiTapeOutput(), self)]
+        numFound: int = 1
+        while heap:
+            weight, _, chars, prevOutput, prevState = heapq.heappop(heap)
+            if prevState is None:
+                yield (weight, prevOutput)
+                continue
+            acceptingWeight: Optional[float] = prevState.acceptingWeight(symbolStack)
+            if acceptingWeight == 0:
+                yield (weight, prevOutput)
+            elif acceptingWeight is not None:
+                heapq.heappush(heap, (weight + acceptingWeight, numFound, chars, prevOutput, None))
+                numFound += 1
+            if chars + 1 >= maxChars:
+                continue
+            for tape, c, matched, newState in prevState.dQuery(allTapes, anyChar, symbolStack):
+                if not matched:
+                    print("Warning: got all the way through without a match", file=sys.stderr)
+                    continue
+                heapq.heappush(heap, (weight + c.weight, numFound, chars + 1, 
+                                      prevOutput.add(tape, c), newState))
+                numFound += 1
+
+    def _generateBreadthFirst(self,
+                              symbolStack: CounterStack,
+                              maxChars: int,
+                              mergeStates: bool,
+                              frontierSizes: Optional[List[int]],
+                              maxFrontier: Optional[int]) -> Gen[MultiTapeOutput]:
+        """ Yield the output of each accepting path, breadth-first; see generate() """
+        allTapes: Final[TapeCollection] = self._getTapes()
+        anyChar: Final[Token] = allTapes.any()
         initialOutput: MultiTapeOutput = MultiTapeOutput()
         stateQueue: List[Tuple[MultiTapeOutput, State]] = [(initialOutput, self)]
-        symbolStack = CounterStack(maxRecursion)
         chars: int = 0
 
         while len(stateQueue) > 0 and chars < maxChars:
+            if frontierSizes is not None:
+                frontierSizes.append(len(stateQueue))
             nextQueue: List[Tuple[MultiTapeOutput, State]] = []
             for prevOutput, prevState in stateQueue:
                 if prevState.accepting(symbolStack):
-                    yield from prevOutput.toStrings()
-                for tape, c, matched, newState in prevState.dQuery(allTapes, ANY_CHAR, symbolStack):
+                    yield prevOutput
+                if maxFrontier is not None and len(nextQueue) >= maxFrontier:
+                    continue
+                for tape, c, matched, newState in prevState.dQuery(allTapes, anyChar, symbolStack):
                     if not matched:
                         print("Warning: got all the way through without a match", file=sys.stderr)
                         continue
                     nextOutput: MultiTapeOutput = prevOutput.add(tape, c)
                     nextQueue.append((nextOutput, newState))
+            if mergeStates:
+                nextQueue = mergeFrontier(nextQueue)
+            if maxFrontier is not None:
+                del nextQueue[maxFrontier:]
             stateQueue = nextQueue
             chars += 1
-    
+
+    def _traverseDepthFirst(self,
+                            symbolStack: CounterStack,
+                            maxChars: int) -> Gen[Tuple[MultiTapeOutput, State, int]]:
+        """
+        Yield (output, state, depth) for every path of fewer than maxChars
+        steps, depth-first.  Rather than a list of the paths still to do, we
+        keep a stack of the queries we're partway through, one per step of
+        the current path.
+        """
+        allTapes: Final[TapeCollection] = self._getTapes()
+        anyChar: Final[Token] = allTapes.any()
+        if maxChars <= 0:
+            return
+        initialOutput: MultiTapeOutput = MultiTapeOutput()
+        yield (initialOutput, self, 0)
+        stack: List[Tuple[MultiTapeOutput, Gen[Tuple[Tape, Token, bool, State]]]] = []
+        if maxChars > 1:
+            stack.append((initialOutput, self.dQuery(allTapes, anyChar, symbolStack)))
+        while stack:
+            prevOutput, results = stack[-1]
+            result: Optional[Tuple[Tape, Token, bool, State]] = next(results, None)
+            if result is None:
+                stack.pop()
+                continue
+            tape, c, matched, newState = result
+            if not matched:
+                print("Warning: got all the way through without a match", file=sys.stderr)
+                continue
+            nextOutput: MultiTapeOutput = prevOutput.add(tape, c)
+            yield (nextOutput, newState, len(stack))
+            if len(stack) + 1 < maxChars:
+                stack.append((nextOutput, newState.dQuery(allTapes, anyChar, symbolStack)))
+
+    def _generateIterativeDeepening(self,
+                                    symbolStack: CounterStack,
+                                    maxChars: int) -> Gen[MultiTapeOutput]:
+        """ Yield the output of each accepting path, by iterative deepening; see generate() """
+        for depth in range(maxChars):
+            reached: bool = False
+            for output, state, stateDepth in self._traverseDepthFirst(symbolStack, depth + 1):
+                if stateDepth < depth:
+                    continue
+                reached = True
+                if state.accepting(symbolStack):
+                    yield output
+            if not reached:
+                return
+
+    def parse(self,
+              inputs: StringDict,
+              maxResults: Optional[int] = None,
+              maxRecursion: int = 4,
+              maxChars: int = 1000) -> Gen[StringDict]:
+        """
+        Find the outputs of the grammar that have exactly the given strings on
+        the given tapes, e.g. all the analyses of { text: "foo" }.
+
+        The results are those generate() would give, filtered down to the ones
+        that agree with inputs, but we get them without generating everything
+        else.  We traverse the grammar as generate() does, except that every
+        character a path puts on an input tape has to match the next character
+        of the input (we query with a view of the tapes that only lets that
+        character through; see TapeCollection.restrict()), and a path that
+        doesn't is dropped on the spot.  So the frontier only ever holds paths
+        that are consistent with the input so far, and since paths in the same
+        state having consumed the same amount of input are merged, it stays
+        small however big the grammar is.  We can also stop as soon as we have
+        maxResults results.
+
+        (Note that a dot on an input tape matches any input character, even
+        one the grammar never mentions; that's the same as when we join with
+        the input.  Unlike a join, though, a tape the grammar never writes to
+        can only be matched by "".)
+
+        @param inputs A { tape: string } dictionary of what we know
+        @param [maxResults] Stop after this many results; None for no limit
+        @param [maxRecursion] The maximum number of times the grammar can
+                    recurse; for infinite recursion pass Infinity.
+        @param [maxChars] The maximum number of steps any one traversal can
+                    take (roughly == the total number of characters output to
+                    all tapes, inputs included)
+        @returns a generator of { tape: string } dictionaries, one for each
+            successful traversal, including the inputs themselves
+        """
+        if maxResults is not None and maxResults <= 0:
+            return
+        allTapes: Final[TapeCollection] = self._getTapes([inputs])
+        anyChar: Final[Token] = allTapes.any()
+        inputTokens: Final[Dict[str, List[Token]]] = {
+            tapeName: allTapes.tokenize(tapeName, string, cache=False)
+            for tapeName, string in inputs.items() }
+        finished: Final[Tuple[int, ...]] = tuple(len(t) for t in inputTokens.values())
+        tapeIndex: Final[Dict[str, int]] = {tapeName: i for i, tapeName in enumerate(inputs)}
+        noTokens: Final[Dict[str, Token]] = {
+            tapeName: _noToken(allTapes, tapeName) for tapeName in inputs }
+        views: Dict[Tuple[int, ...], Tape] = {}
+        
+        # Each entry's state is paired with how far it's gotten into each input 
+        stateQueue: List[Tuple[MultiTapeOutput, Tuple[State, Tuple[int, ...]]]]
+        stateQueue = [(MultiTapeOutput(), (self, (0,) * len(inputs)))]
+        symbolStack = CounterStack(maxRecursion)
+        numResults: int = 0
+        chars: int = 0
+
+        while len(stateQueue) > 0 and chars < maxChars:
+            nextQueue: List[Tuple[MultiTapeOutput, Tuple[State, Tuple[int, ...]]]] = []
+            for prevOutput, (prevState, positions) in stateQueue:
+                if positions == finished and prevState.accepting(symbolStack):
+                    for result in prevOutput.toStrings():
+                        yield result
+                        numResults += 1
+                        if maxResults is not None and numResults >= maxResults:
+                            return
+                view: Optional[Tape] = views.get(positions)
+                if view is None:
+                    view = allTapes.restrict({
+                        tapeName: tokens[pos] if pos < len(tokens) else noTokens[tapeName]
+                        for (tapeName, tokens), pos in zip(inputTokens.items(), positions) })
+                    views[positions] = view
+                for tape, c, matched, newState in prevState.dQuery(view, anyChar, symbolStack):
+                    if not matched or c.isEmpty():
+                        continue
+                    newPositions: Tuple[int, ...] = positions
+                    i: Optional[int] = tapeIndex.get(tape.tapeName)
+                    if i is not None:
+                        newPositions = positions[:i] + (positions[i] + 1,) + positions[i+1:]
+                    nextQueue.append((prevOutput.add(tape, c), (newState, newPositions)))
+            stateQueue = mergeFrontier(nextQueue)
+            chars += 1
+
+    def parseBatch(self,
+                   inputs: Iterable[str],
+                   tapeName: str = "text",
+                   chunkSize: int = 1000,
+                   maxResults: Optional[int] = None,
+                   maxRecursion: int = 4,
+                   maxChars: int = 1000) -> Gen[Tuple[str, List[StringDict]]]:
+        """
+        Parse a lot of strings on the same tape, e.g. all the words of a
+        corpus, sharing as much of the work as possible.
+
+        Inputs are taken a chunk at a time, and each chunk is made into a trie,
+        so that inputs sharing a prefix share the traversal of that prefix:
+        everything is the same as in parse(), except that instead of pairing
+        each state with a position in the input, we pair it with a node of the
+        trie, and a path that writes to the input tape can go on to any child
+        of its node that agrees with it.  (So what we let through on the input
+        tape is any of the node's children's tokens.)  Repeated inputs are
+        only parsed once.
+
+        @param inputs The strings to parse
+        @param [tapeName] The tape the inputs are on
+        @param [chunkSize] How many inputs to parse at once
+        @param [maxResults] The most results to keep for any one input
+        @param [maxRecursion] The maximum number of times the grammar can
+                    recurse; for infinite recursion pass Infinity.
+        @param [maxChars] The maximum number of steps any one traversal can 
+                    take
+        @returns a generator of (input, results) pairs, in the same order as
+            inputs, where results are what parse() would give for input
+        """
+        chunk: List[str] = []
+        for string in inputs:
+            chunk.append(string)
+            if len(chunk) == chunkSize:
+                yield from self._parseChunk(chunk, tapeName, maxResults, maxRecursion, maxChars)
+                chunk = []
+        if len(chunk) > 0:
+            yield from self._parseChunk(chunk, tapeName, maxResults, maxRecursion, maxChars)
+
+    def _parseChunk(self,
+                    chunk: List[str],
+                    tapeName: str,
+                    maxResults: Optional[int],
+                    maxRecursion: int,
+                    maxChars: int) -> Gen[Tuple[str, List[StringDict]]]:
+        allTapes: Final[TapeCollection] = self._getTapes([{tapeName: s} for s in chunk])
+        anyChar: Final[Token] = allTapes.any()
+        root: Final[InputTrie] = InputTrie()
+        results: Dict[str, List[StringDict]] = {}
+        for string in chunk:
+            if string not in results:
+                root.add(allTapes.tokenize(tapeName, string, cache=False), string)
+                results[string] = []
+        
+        noToken: Final[Token] = _noToken(allTapes, tapeName)
+        stateQueue: List[Tuple[MultiTapeOutput, Tuple[State, InputTrie]]]
+        stateQueue = [(MultiTapeOutput(), (self, root))]
+        symbolStack = CounterStack(maxRecursion)
+        chars: int = 0
+
+        while len(stateQueue) > 0 and chars < maxChars:
+            nextQueue: List[Tuple[MultiTapeOutput, Tuple[State, InputTrie]]] = []
+            for prevOutput, (prevState, node) in stateQueue:
+                if node.string is not None and prevState.accepting(symbolStack):
+                    nodeResults: List[StringDict] = results[node.string]
+                    for result in prevOutput.toStrings():
+                        if maxResults is not None and len(nodeResults) >= maxResults:
+                            break
+                        nodeResults.append(result)
+                view: Tape = allTapes.restrict({tapeName: node.next or noToken})
+                for tape, c, matched, newState in prevState.dQuery(view, anyChar, symbolStack):
+                    if not matched or c.isEmpty():
+                        continue
+                    if tape.tapeName != tapeName:
+                        nextQueue.append((prevOutput.add(tape, c), (newState, node)))
+                        continue
+                    for token, child in node.children:
+                        match: Token = c.and_(token)
+                        if not match.isEmpty():
+                            nextQueue.append((prevOutput.add(tape, match), (newState, child)))
+            stateQueue = mergeFrontier(nextQueue)
+            chars += 1
+
+        for string in chunk:
+            yield (string, list(results[string]))
+
+    def _getTapes(self, inputs: Sequence[StringDict] = ()) -> TapeCollection:
+        """
+        Get a TapeCollection to query the grammar with: the one it's compiled
+        with (compiling it if need be), if that already knows all the symbols
+        in inputs, and otherwise a new one that adds them to it.
+        """
+        compiledTapes: Final[TapeCollection] = self.compile()
+        if all(compiledTapes.inVocab(tapeName, string) 
+               for strings in inputs for tapeName, string in strings.items()):
+            return compiledTapes
+        tapes: TapeCollection = compiledTapes.extend()
+        for strings in inputs:
+            for tapeName, string in strings.items():
+                tapes.addToVocab(tapeName, string)
+        tapes.fixWidth()
+        return tapes
+
+    def compile(self, cacheSize: int = 0) -> TapeCollection:
+        """
+        Collect the grammar's vocabulary into a TapeCollection of its own and
+        freeze it.  This happens the first time the grammar is queried (by
+        generate(), parse(), etc.), and afterwards that collection is reused,
+        rather than collecting vocab all over again.  It's also reused by
+        grammars that contain this one, like a join of it with a query: they
+        start from this grammar's collection (see collectVocab()), so only
+        what's new in the query has to be collected and tokenized.
+
+        If cacheSize is given, the collection also gets a TransitionCache of
+        that many entries, and from then on every dQuery made with its tapes
+        is memoized: the first query of a state builds that bit of the state
+        graph, and later ones look it up.  States reached this way are
+        interned, so equal states found along different paths are the same
+        object.  This is the closest we get to compiling the grammar into an
+        explicit automaton, since the whole automaton is usually too big to
+        build; the cache is LRU, so the parts we stop visiting get dropped.
+
+        @param [cacheSize] The most transitions to remember; 0 for no cache
+        @returns the grammar's frozen TapeCollection
+        """
+        if self._compiledTapes is None:
+            tapes: TapeCollection = TapeCollection()
+            self.collectVocab(tapes, [])
+            tapes.freeze()
+            self._compiledTapes = tapes
+            # While we're going through the grammar, work out its tapeMasks
+            self.tapeMask
+        if cacheSize > 0 and self._compiledTapes.transitions is None:
+            self._compiledTapes.cacheTransitions(TransitionCache(cacheSize))
+        return self._compiledTapes
+
     def collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
         """
         Collect all explicitly mentioned characters in the grammar for all tapes.
+        If this state has been compiled, that's already been done, and its
+        collection is just included in tapes.
         
         @param tapes A TapeCollection for holding found characters
         @param stateStack What symbols we've already collected from, to prevent
                     inappropriate recursion
         @returns vocab
         """
+        if self._compiledTapes is not None and self._compiledTapes is not tapes:
+            tapes.includeVocab(self._compiledTapes)
+            return
+        self._collectVocab(tapes, stateStack)
+
+    def _collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
+        """ Collect this state's own vocab; see collectVocab() """
         pass
 
+    def _firstTokens(self, tape: Tape, symbolStack: CounterStack) -> Optional[FirstTokens]:
+        """
+        If we know that everything this state can match, when queried with
+        tape, is on one particular tape and among particular tokens, return
+        (tapeName, tokens); tapeName is None if there's nothing it can match.
+        Otherwise (say, when the state might not care about the tape, and
+        would give back an unmatched result) return None.
+
+        This is what UnionState uses to index its children; states that
+        don't know just return None, and always get queried.
+        """
+        return None
+
+
+def _ignores(state: State, 
+             tape: Tape, 
+             symbolStack: CounterStack, 
+             target: Optional[Token] = None) -> bool:
+    """
+    Whether querying state on tape (for target, if given) would just give
+    state back, unmatched (see State.tapeMask), so there's no need to ask it.
+    We can only tell when the query is on one tape, and the target has to be
+    something (results that match nothing are dropped), and embedding has to
+    be allowed at all (with a maxRecursion of 0, every EmbedState matches
+    nothing).
+    """
+    tapeMask: int = tape.tapeMask
+    return tapeMask != ALL_TAPES and not (state.tapeMask & tapeMask) and \
+           symbolStack.max > 0 and (target is None or not target.isEmpty())
+
 
 class TextState(State):
     """ Text State
@@ -312,11 +930,14 @@ class TextState(State):
     In order to implement TextState, a descendant class must implement
     _firstToken() (giving the first token that needs to be matched) and
     _successor() (returning the state to which we would transfer upon successful
-    matching of the token).
+    matching of the token).  Both are given the tape being matched, since
+    that's what knows how to turn text into tokens.
 
-    There is a inherent assumption that collectVocab is called before
-    _firstToken() is ever called.
+    There is a inherent assumption that collectVocab (and fixing the tapes'
+    widths) happens before _firstToken() is ever called.
     """
+    __slots__ = ("tapeName",)
+
     def __init__(self, tapeName: str) -> None:
         self.tapeName = tapeName
         super().__init__()
@@ -326,9 +947,12 @@ class TextState(State):
         pass
 
     @abstractmethod
-    def _successor(self) -> State:
+    def _successor(self, tape: Tape) -> State:
         pass
 
+    def _computeTapeMask(self) -> int:
+        return tapeBit(self.tapeName)
+
     def ndQuery(self,
                 tape: Tape, 
                 target: Token, 
@@ -344,9 +968,19 @@ class TextState(State):
 
         bits: Token = self._firstToken(matchedTape)
         result: Token = matchedTape.match(bits, target)
-        nextState: State = self._successor()
+        if result.isEmpty():
+            return
+        nextState: State = self._successor(matchedTape)
         yield (matchedTape, result, True, nextState)
 
+    def _firstTokens(self, tape: Tape, symbolStack: CounterStack) -> Optional[FirstTokens]:
+        matchedTape: Optional[Tape] = tape.matchTape(self.tapeName)
+        if matchedTape is None:
+            return None
+        if self.accepting(symbolStack):
+            return (None, [])
+        return (self.tapeName, [self._firstToken(matchedTape)])
+
 
 class AnyCharState(TextState):
     """ Any Character State
@@ -354,14 +988,23 @@ class AnyCharState(TextState):
     The state that recognizes/emits any character on a specific tape; 
     implements the "dot" in regular expressions.
     """
+    __slots__ = ()
+
     @property
     def id(self) -> str:
         return f"{self.tapeName}:(ANY)"
 
+    def _key(self) -> Tuple:
+        return (self.tapeName,)
+
+    def _collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
+        # A dot has no symbols of its own, but its tape still has to exist
+        tapes.addToVocab(self.tapeName, "")
+
     def _firstToken(self, tape: Tape) -> Token:
         return tape.any()
     
-    def _successor(self) -> State:
+    def _successor(self, tape: Tape) -> State:
         return TrivialState()
 
 
@@ -369,49 +1012,53 @@ class LiteralState(TextState):
     """ Literal State
 
     Recognizese/emits a literal string on a particular tape.  Inside, it's just
-    a string like "foo"; upon successfully matching "f" we construct a successor
-    state looking for "oo", and so on.
-    
-    The first time we construct a LiteralState, we just pass in the text
-    argument, and leave tokens empty.  (This is because, at the initial point of
-    construction of a LiteralState, we don't know what the total character
-    vocabulary of the grammar is yet, and thus can't tokenize it into Tokens
-    yet.)  On subsequent constructions, like in successor(), we've already
-    tokenized, so we pass the remainder of the tokens into the tokens argument.
-    It doesn't really matter what we pass into text in subsequent constructions,
-    it's not used except for debugging. In the TypeScript implementation, we
-    just pass in the original text, but in this implementation we pass in the
-    remainder of the text after removing the string associated with the previous
-    token.
-    """
-    def __init__(self, tapeName: str, text: str, 
-                 tokens: List[Token] = [], tapes: Optional[Tape] = None) -> None:
+    a string like "foo" and a position in it; upon successfully matching "f" we
+    construct a successor state at position 1, looking for "oo", and so on.
+
+    We can't turn the text into Tokens when we construct a LiteralState,
+    because at that point we don't know what the total character vocabulary of
+    the grammar is yet.  collectVocab() only adds the text's symbols to the
+    tape's vocabulary; the tokens themselves are made by the tape the first
+    time we're queried, once the tape's width is fixed, and the tape keeps
+    them (see StringTape.tokenize()).  So all the successors of a literal share
+    the one tokenized text, and the position is just an index into its
+    tokens; advancing doesn't copy anything.
+
+    Literals compare by the text they have left to match, so that (say) the
+    successors of "hat" and "cat" are equal, which helps mergeFrontier() a
+    lot.  When a literal is finished, its successor is the empty literal.
+    """
+    __slots__ = ("text", "pos")
+
+    def __init__(self, tapeName: str, text: str, pos: int = 0) -> None:
         self.text = text
-        self._tokens = tokens
-        self._tapes = tapes
+        self.pos = pos
         super().__init__(tapeName)
 
     @property
     def id(self) -> str:
-        return f"{self.tapeName}:{self.text}"
+        return f"{self.tapeName}:{self.text[self.pos:]}"
+
+    def _key(self) -> Tuple:
+        # Literals with the same text left to match are interchangeable,
+        # wherever they started.  (Only tapes with single-character symbols
+        # ever get past pos 0 without finishing, so pos counts characters.)
+        return (self.tapeName, self.text[self.pos:])
 
     def accepting(self, symbolStack: CounterStack) -> bool:
-        return len(self._tokens) == 0
+        # A partly-matched literal is never finished (see _successor())
+        return len(self.text) == 0
 
-    def collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
-        self._tokens = tapes.tokenize(self.tapeName, self.text)
-        self._tapes = tapes
+    def _collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
+        tapes.addToVocab(self.tapeName, self.text)
 
     def _firstToken(self, tape: Tape) -> Token:
-        return self._tokens[0]
-    
-    def _successor(self) -> State:
-        newTokens: List[Token] = self._tokens[1:]
-        # newText: str = "".join("".join(self._tapes.fromBits(self.tapeName, t.bits))
-        #                        for t in newTokens)
-        firstText: str = "".join(self._tapes.fromBits(self.tapeName, self._tokens[0].bits))
-        newText: str = self.text[len(firstText):]
-        return LiteralState(self.tapeName, newText, newTokens, self._tapes)
+        return tape.tokenize(self.tapeName, self.text)[self.pos]
+
+    def _successor(self, tape: Tape) -> State:
+        if self.pos + 1 == len(tape.tokenize(self.tapeName, self.text)):
+            return LiteralState(self.tapeName, "")
+        return LiteralState(self.tapeName, self.text, self.pos + 1)
 
 
 class TrivialState(State):
@@ -420,16 +1067,24 @@ class TrivialState(State):
     other states (e.g. when you need a state that's accepting but won't go
     anywhere).
     """
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__()
 
     @property
     def id(self) -> str:
         return "0"
+
+    def _key(self) -> Tuple:
+        return ()
     
     def accepting(self, symbolStack: CounterStack) -> bool:
         return True
 
+    def _firstTokens(self, tape: Tape, symbolStack: CounterStack) -> Optional[FirstTokens]:
+        return (None, [])
+
     def ndQuery(self,
                 tape: Tape, 
                 target: Token, 
@@ -439,34 +1094,92 @@ class TrivialState(State):
 
 class BinaryState(State):
     """
-    Abstract base class of all States with two state children (e.g. [JoinState],
-    [ConcatState], [UnionState]). States that conceptually might have infinite
-    children (like Union) we treat as right-recursive binary (see for example
-    the helper function [Uni] which converts lists of states into
-    right-branching UnionStates).
+    Abstract base class of States with two state children (e.g. [JoinState]).
+    States that conceptually might have any number of children (like Union)
+    are [NaryState]s instead.
     """
+    __slots__ = ("child1", "child2")
+
     def __init__(self, child1: State, child2: State) -> None:
         self.child1 = child1
         self.child2 = child2
         super().__init__()
     
-    def collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
+    def _collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
         self.child1.collectVocab(tapes, stateStack)
         self.child2.collectVocab(tapes, stateStack)
 
+    def _computeTapeMask(self) -> int:
+        return self.child1.tapeMask | self.child2.tapeMask
+
     @property
     def id(self) -> str:
         return f"{self.__class__.__name__}({self.child1.id},{self.child2.id})"
 
+    def _key(self) -> Tuple:
+        return (self.child1, self.child2)
+
     def accepting(self, symbolStack: CounterStack) -> bool:
         return self.child1.accepting(symbolStack) and self.child2.accepting(symbolStack)
 
+    def acceptingWeight(self, symbolStack: CounterStack) -> Optional[float]:
+        weight1: Optional[float] = self.child1.acceptingWeight(symbolStack)
+        if weight1 is None:
+            return None
+        weight2: Optional[float] = self.child2.acceptingWeight(symbolStack)
+        if weight2 is None:
+            return None
+        return weight1 + weight2
+
 
-class ConcatState(BinaryState):
+class NaryState(State):
     """
-    ConcatState represents the current state in a concatenation A+B of two
-    grammars.  It is a [BinaryState], meaning it has two children; sequences
-    ABCDEF are constructed as A+(B+(C+(D+(E+F)))).
+    Abstract base class of States with any number of children ([ConcatState],
+    [UnionState]).  These used to be right-recursive binary states, but the
+    grammars we deal with can have tens of thousands of alternatives, and
+    chains that long are slow to build and too deep to query.
+    """
+    __slots__ = ("children",)
+
+    def __init__(self, *children: State) -> None:
+        self.children: Tuple[State, ...] = children
+        super().__init__()
+    
+    def _collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
+        for child in self.children:
+            child.collectVocab(tapes, stateStack)
+
+    def _computeTapeMask(self) -> int:
+        mask: int = 0
+        for child in self.children:
+            mask |= child.tapeMask
+        return mask
+
+    @property
+    def id(self) -> str:
+        return f"{self.__class__.__name__}({','.join(c.id for c in self.children)})"
+
+    def _key(self) -> Tuple:
+        return self.children
+
+    def accepting(self, symbolStack: CounterStack) -> bool:
+        return all(child.accepting(symbolStack) for child in self.children)
+
+    def acceptingWeight(self, symbolStack: CounterStack) -> Optional[float]:
+        total: float = 0.0
+        for child in self.children:
+            weight: Optional[float] = child.acceptingWeight(symbolStack)
+            if weight is None:
+                return None
+            total += weight
+        return total
+
+
+class ConcatState(NaryState):
+    """
+    ConcatState represents the current state in a concatenation ABCDEF of
+    grammars.  It behaves just like the right-branching A+(B+(C+(D+(E+F)))),
+    which is how it used to be built.
 
     The one thing that makes ConcatState a bit tricky is that they are the only
     part of the grammar where there is a precedence order, which in a naive
@@ -480,57 +1193,822 @@ class ConcatState(BinaryState):
     it'll only get there later.  There are several possible solutions for this,
     but the simplest by far is to implement ConcatState so that it can always
     emit/match on any tape that any of its children refer to.  Basically, it
-    goes through its children, and if child1 returns but doesn't match (meaning
-    it doesn't care about tape T), it asks child2.  Then it returns the
-    appropriate ConcatState consisting of the unmatched material.
+    goes through its children, and if a child returns but doesn't match
+    (meaning it doesn't care about tape T), it asks the rest.  Then it returns
+    the appropriate ConcatState consisting of the unmatched material.
     """
+    __slots__ = ()
+
     def ndQuery(self,
                 tape: Tape, 
                 target: Token, 
                 symbolStack: CounterStack) -> Gen[Tuple[Tape, Token, bool, State]]:
-        # We can yield from child2 if child1 is accepting, OR if child1 doesn't
-        # care about the requested tape, but if child1 is accepting AND doesn't
-        # care about the requested tape, we don't want to yield twice; that
-        # leads to duplicate results.  yieldedAlready is how we keep track of
-        # that.
-        yieldedAlready: bool = False
-
-        for c1tape, c1text, c1matched, c1next in self.child1.dQuery(tape, target, symbolStack):
-            if c1matched:
-                yield (c1tape, c1text, c1matched, ConcatState(c1next, self.child2))
+        for resultTape, resultTarget, matched, children in self._queryChildren(tape, target, symbolStack):
+            yield (resultTape, resultTarget, matched, ConcatState(*children))
+
+    def _queryChildren(self,
+                   tape: Tape, 
+                   target: Token, 
+                   symbolStack: CounterStack) -> Gen[Tuple[Tape, Token, bool, Tuple[State, ...]]]:
+        """
+        Query the concatenation, yielding the successor children rather than
+        a successor state.
+
+        Querying children i onwards means querying child i, and then, if it
+        gives itself back unmatched (it doesn't care about the tape) or is
+        accepting, querying children i+1 onwards, and so on.  Done
+        recursively, that would be a call for each child, and a sequence can
+        have more children than Python can recurse, so instead there's a stack
+        of the children we're in the middle of querying (see _ConcatFrame),
+        each one there because the one before it gave itself back unmatched.
+        When a child is passed over without being queried, or was accepting
+        and we go on to the rest, we're done with it, so its frame is just
+        replaced.
+        """
+        children: Final[Tuple[State, ...]] = self.children
+        last: Final[int] = len(children) - 1
+        stack: List[_ConcatFrame] = [_ConcatFrame(0, (), (), 0.0)]
+        numYielded: int = 0
+        while stack:
+            frame: _ConcatFrame = stack[-1]
+            i: int = frame.i
+            child: State = children[i]
+            if frame.results is None:
+                if i < last and _ignores(child, tape, symbolStack, target):
+                    # child would only give itself back, unmatched, so go
+                    # straight to the rest.  (If they match nothing, asking
+                    # them again because child is accepting wouldn't get
+                    # anything either.)
+                    stack[-1] = _ConcatFrame(i + 1, frame.kept + (child,),
+                                             frame.waiting + (child,), frame.weight)
+                    continue
+                frame.results = iter(child.dQuery(tape, target, symbolStack))
+            elif frame.numBefore is not None:
+                # Back from the rest, after child didn't care about the tape
+                if numYielded > frame.numBefore:
+                    frame.yieldedAlready = True
+                frame.numBefore = None
+
+            descending: bool = False
+            for cTape, cTarget, cMatched, cNext in frame.results:
+                if cMatched or i == last:
+                    rest: Tuple[State, ...] = (cNext,) + children[i+1:]
+                    if cMatched:
+                        yield (cTape, cTarget.addWeight(frame.weight), True, frame.kept + rest)
+                    else:
+                        yield (cTape, cTarget, False, frame.waiting + rest)
+                    numYielded += 1
+                    continue
+                # child not interested in the requested tape, the first
+                # character on the tape must be (if it exists at all) in the
+                # rest.
+                frame.numBefore = numYielded
+                stack.append(_ConcatFrame(i + 1, frame.kept + (child,),
+                                          frame.waiting + (child,), frame.weight))
+                descending = True
+                break
+            if descending:
+                continue
+
+            # We can go on to the rest if child is accepting, OR if child
+            # doesn't care about the requested tape, but if child is accepting
+            # AND doesn't care about the requested tape, we don't want to do
+            # both; that leads to duplicate results.
+            stack.pop()
+            if i == last or frame.yieldedAlready:
+                continue
+            weight: Optional[float] = child.acceptingWeight(symbolStack)
+            if weight is None:
                 continue
-            # child1 not interested in the requested tape, the first character
-            # on the tape must be (if it exists at all) in child2.
-            for c2tape, c2text, c2matched, c2next in self.child2.dQuery(tape, target, symbolStack):
-                yield (c2tape, c2text, c2matched, ConcatState(self.child1, c2next))
-                yieldedAlready = True
+            # Going on without child means accepting it here, so its weight
+            # has to go on whatever the rest matches, or, if they don't match,
+            # stay in the successor
+            waiting: Tuple[State, ...] = frame.waiting
+            if weight:
+                waiting += (WeightState(TrivialState(), weight),)
+            stack.append(_ConcatFrame(i + 1, frame.kept, waiting, frame.weight + weight))
 
-        if not yieldedAlready and self.child1.accepting(symbolStack):
-            yield from self.child2.dQuery(tape, target, symbolStack)
+    def _firstTokens(self, tape: Tape, symbolStack: CounterStack) -> Optional[FirstTokens]:
+        # A child that matches something never lets the query through to the
+        # children after it, unless it's accepting.
+        return _combineFirstTokens(self.children, tape, symbolStack, untilRequired=True)
 
 
-class UnionState(BinaryState):
+class _ConcatFrame:
     """
-    UnionStates are very simple; they just have a left child and a right child,
-    and upon querying they yield from the first and then yield from the second.
+    A child of a ConcatState that's being queried; see
+    ConcatState._queryChildren().  kept is what goes before the successor
+    children of its matches: the children before it that didn't care about
+    the tape.  waiting is what goes before them if nothing matches, where
+    the weights of accepting children we went past have to wait (see
+    State.acceptingWeight()), and weight is those weights, which matches
+    pay instead.  results are what the child gave, while we're going
+    through them, and numBefore is how many results had been yielded when
+    we went on to the rest of the children, while we're there.
+    """
+    __slots__ = ("i", "kept", "waiting", "weight", "results", "numBefore", "yieldedAlready")
+
+    def __init__(self,
+                 i: int,
+                 kept: Tuple[State, ...],
+                 waiting: Tuple[State, ...],
+                 weight: float) -> None:
+        self.i = i
+        self.kept = kept
+        self.waiting = waiting
+        self.weight = weight
+        self.results: Optional[Iterator[Tuple[Tape, Token, bool, State]]] = None
+        self.numBefore: Optional[int] = None
+        self.yieldedAlready: bool = False
+
+
+class UnionState(NaryState):
+    """
+    UnionStates are very simple; upon querying they yield from each of their
+    children in turn.
 
-    Note that UnionStates are only around initally; they don't construct
+    Note that UnionStates are only around initally (or when dQuery() has to
+    combine the successors of overlapping transitions); they don't construct
     successor UnionStates, their successors are just the successors of their
     children.
+
+    A union of a whole lexicon can have tens of thousands of children, though,
+    and when we're parsing, or joining it with something, usually only a few
+    of them can match the character we're asking about.  So a big union
+    indexes its children by the first token each of them can match (see
+    _firstTokens()), and when the query says what that character has to be
+    (see Tape.constrain()), only the children that can match it get queried.
+    The index is made the first time it's needed, with the (compiled) tapes
+    of the query, and kept for as long as the union is, pickles included;
+    children that can't be indexed are always queried.  Free queries, like
+    generate() makes, don't use it.  Since the index goes by symbols, the one
+    made with a grammar's collection also does for collections extended from
+    it (see TapeCollection.origin), like the ones parse() makes for inputs
+    with symbols the grammar doesn't have; only unrelated collections need
+    indices of their own, and only the last MAX_INDICES of those are kept.
+    """
+    __slots__ = ("_indices",)
+    INDEX_THRESHOLD: Final[int] = 16
+    MAX_INDICES: Final[int] = 4
+
+    def __init__(self, *children: State) -> None:
+        super().__init__(*children)
+        self._indices: Dict[Tape, UnionIndex] = {}
+
+    def accepting(self, symbolStack: CounterStack) -> bool:
+        return any(child.accepting(symbolStack) for child in self.children)
+
+    def acceptingWeight(self, symbolStack: CounterStack) -> Optional[float]:
+        least: Optional[float] = None
+        for child in self.children:
+            weight: Optional[float] = child.acceptingWeight(symbolStack)
+            if weight is not None and (least is None or weight < least):
+                least = weight
+                if least == 0:
+                    break   # weights are never negative
+        return least
+
+    def _firstTokens(self, tape: Tape, symbolStack: CounterStack) -> Optional[FirstTokens]:
+        return _combineFirstTokens(self.children, tape, symbolStack, untilRequired=False)
+
+    def ndQuery(self,
+                tape: Tape, 
+                target: Token, 
+                symbolStack: CounterStack) -> Gen[Tuple[Tape, Token, bool, State]]:
+        children: Final[Tuple[State, ...]] = self.children
+        if len(children) < self.INDEX_THRESHOLD or \
+                (target is tape.any() and not tape.restricted):
+            for child in children:
+                yield from child.dQuery(tape, target, symbolStack)
+            return
+
+        index: UnionIndex = self.index(tape, symbolStack)
+        for i in index.candidates(tape, target):
+            yield from children[i].dQuery(tape, target, symbolStack)
+
+    def index(self, tape: Tape, symbolStack: CounterStack) -> UnionIndex:
+        """
+        Get the index of this union's children for queries with tape (or
+        anything with the same base), making it if there isn't one yet.  That
+        normally happens in the first constrained query, but it can be done
+        ahead of time, e.g. before pickling a compiled grammar, since indices
+        are pickled along with their unions.
+        """
+        base: Tape = tape.base
+        if isinstance(base, TapeCollection):
+            base = base.origin
+        index: Optional[UnionIndex] = self._indices.get(base)
+        if index is None:
+            index = UnionIndex(self.children, tape, symbolStack)
+            if len(self._indices) >= self.MAX_INDICES:
+                del self._indices[next(iter(self._indices))]
+            self._indices[base] = index
+        return index
+
+
+FirstTokens = Tuple[Optional[str], List[Token]]
+
+def _combineFirstTokens(children: Sequence[State],
+                        tape: Tape,
+                        symbolStack: CounterStack,
+                        untilRequired: bool) -> Optional[FirstTokens]:
     """
+    Combine the _firstTokens() of children, either all of them (for a union)
+    or up to the first one that isn't accepting (for a concatenation).  If
+    they don't all agree on the tape, we don't know.
+
+    A concatenation passes the query on past children that have nothing to
+    do with the tape (see _ignores()), so those don't count, unless it's the
+    last one, which would give back an unmatched result.
+    """
+    tapeName: Optional[str] = None
+    tokens: List[Token] = []
+    for i, child in enumerate(children):
+        if untilRequired and i < len(children) - 1 and _ignores(child, tape, symbolStack):
+            continue
+        first: Optional[FirstTokens] = child._firstTokens(tape, symbolStack)
+        if first is None:
+            return None
+        if first[0] is not None:
+            if tapeName is not None and first[0] != tapeName:
+                return None
+            tapeName = first[0]
+            tokens.extend(first[1])
+        if untilRequired and not child.accepting(symbolStack):
+            break
+    return (tapeName, tokens)
+
+
+class UnionIndex:
+    """
+    An index of the children of a UnionState by what they can match first; 
+    see UnionState.ndQuery().  It's only good for queries whose tapes have
+    the same symbols as the ones it was made with, though they can have more
+    (see TapeCollection.extend()): a child that can match anything on a tape
+    is only indexed under the symbols it knew about, so a symbol it didn't
+    know could be matched by any of them.
+    """
+    def __init__(self, children: Sequence[State], tape: Tape, symbolStack: CounterStack) -> None:
+        # Children we know nothing about, which always have to be queried
+        self.unindexed: List[int] = []
+        # For each tape, all the children that match on it first, and those
+        # children by the symbols they can match
+        self.byTape: Dict[str, List[int]] = {}
+        self.bySymbol: Dict[str, Dict[str, List[int]]] = {}
+        # The tapes that the symbols came from
+        self.vocab: Dict[str, Tape] = {}
+        for i, child in enumerate(children):
+            first: Optional[FirstTokens] = child._firstTokens(tape, symbolStack)
+            if first is None:
+                self.unindexed.append(i)
+                continue
+            tapeName, tokens = first
+            if tapeName is None:
+                continue    # it can't match anything
+            matchedTape: Optional[Tape] = tape.matchTape(tapeName)
+            assert matchedTape is not None
+            if tapeName not in self.byTape:
+                self.byTape[tapeName] = []
+                self.bySymbol[tapeName] = {}
+                self.vocab[tapeName] = matchedTape.base
+            self.byTape[tapeName].append(i)
+            table: Dict[str, List[int]] = self.bySymbol[tapeName]
+            symbols: Set[str] = set()
+            for token in tokens:
+                symbols.update(matchedTape.fromBits(tapeName, token.bits))
+            for symbol in symbols:
+                table.setdefault(symbol, []).append(i)
+
+    def candidates(self, tape: Tape, target: Token) -> List[int]:
+        """ The (indices of the) children that might match target on tape, in order """
+        candidates: List[int] = list(self.unindexed)
+        sources: int = 1 if candidates else 0
+        for tapeName, children in self.byTape.items():
+            matchedTape: Optional[Tape] = tape.matchTape(tapeName)
+            constraint: Optional[Token] = None
+            if matchedTape is not None:
+                constraint = matchedTape.constrain(target)
+            if constraint is None:
+                candidates.extend(children)
+                sources += 1
+                continue
+            assert matchedTape is not None
+            table: Dict[str, List[int]] = self.bySymbol[tapeName]
+            vocab: Tape = self.vocab[tapeName]
+            for symbol in matchedTape.fromBits(tapeName, constraint.bits):
+                found: Optional[List[int]] = table.get(symbol)
+                if found is not None:
+                    candidates.extend(found)
+                    sources += 1
+                elif not vocab.inVocab(tapeName, symbol):
+                    candidates.extend(children)
+                    sources += 1
+                    break
+        if sources > 1:
+            # Children that can match several of the symbols show up more 
+            # than once, and each list is only sorted by itself
+            return sorted(set(candidates))
+        return candidates
+
+
+# A step of a literal row: a symbol on a tape
+Step = Tuple[str, str]
+# The material along an edge of a trie, as (tapeName, text) segments
+Segments = Tuple[Tuple[str, str], ...]
+TrieEdge = Tuple[Segments, "TrieNode"]
+
+
+class TrieNode:
+    """
+    A node of the trie of a TrieState.  Its edges are kept by the tape and
+    the symbol they start with, and each has the segments of text along it
+    and the node it leads to.  Symbols that all the same rows share are one
+    edge, so a trie has a node for each place where rows diverge (or end),
+    rather than one per symbol.
+
+    final is the tape of the last literal of rows that end here (the empty
+    literal they'd have left, in a union), or None if none do.
+
+    A node also remembers what it would be as an ordinary grammar (see
+    expand()), and the tapes under it (see tapeMask()), once they're
+    needed, but doesn't pickle them.
+    """
+    __slots__ = ("final", "edges", "_expanded", "_tapeMask")
+
+    def __init__(self, final: Optional[str], edges: Dict[str, Dict[str, TrieEdge]]) -> None:
+        self.final = final
+        self.edges = edges
+        self._expanded: Optional[State] = None
+        self._tapeMask: Optional[int] = None
+
+    def __getstate__(self) -> Tuple:
+        return (self.final, self.edges)
+
+    def __setstate__(self, state: Tuple) -> None:
+        self.final, self.edges = state
+        self._expanded = None
+        self._tapeMask = None
+
+    def tapeMask(self) -> int:
+        """
+        The tapes of this node and everything under it, as a mask of their
+        tapeBit()s.  Nodes are shared (see _trieNode()), so this is kept for
+        every node, rather than each TrieState going through its whole
+        subtrie.
+        """
+        if self._tapeMask is None:
+            mask: int = 0 if self.final is None else tapeBit(self.final)
+            for tapeEdges in self.edges.values():
+                for segments, child in tapeEdges.values():
+                    for tapeName, _ in segments:
+                        mask |= tapeBit(tapeName)
+                    mask |= child.tapeMask()
+            self._tapeMask = mask
+        return self._tapeMask
+
+    def expand(self) -> State:
+        """
+        The equivalent of this node (and everything under it) as Seqs and
+        Unis of literals.  See TrieState.ndQuery() for when it's needed.
+        """
+        if self._expanded is None:
+            alternatives: List[State] = []
+            if self.final is not None:
+                alternatives.append(LiteralState(self.final, ""))
+            for tapeEdges in self.edges.values():
+                for segments, child in tapeEdges.values():
+                    alternatives.append(_expandEdge(segments, child))
+            self._expanded = Uni(*alternatives)
+        return self._expanded
+
+def _expandEdge(segments: Segments, child: TrieNode) -> State:
+    literals: List[State] = [LiteralState(tapeName, text) for tapeName, text in segments]
+    if child.edges:
+        literals.append(child.expand())
+    return Seq(*literals)
+
+
+class TrieState(State):
+    """ Trie State
+
+    A union of literal rows (like a lexicon: Uni(Lit("text", "hamx'id"),
+    Lit("text", "hamx'ida"), ...), or rows of literals on several tapes, like
+    Seq(Lit("text", "hamx'id"), Lit("gloss", "eat"))), made into a trie (see
+    Trie()).  Querying a union of literals queries every one of them, and
+    every one that matches is a separate successor, even though most of them
+    share their first few symbols with many others; a trie matches a prefix
+    that rows share just once, and its successor is the one node where they
+    diverge.  So the frontier holds one state per live node of the trie,
+    rather than one per live row, and a constrained query (see
+    Tape.constrain()) goes straight to the edges it can match.
+
+    The successor of a symbol part-way along an edge is the rest of the
+    edge's text, as literals, followed by the TrieState of the node it leads
+    to; at the end of a row, it's the empty literal, just as it would be in a
+    union.
+
+    Rows can have symbols on several tapes, which the trie keeps in row
+    order, but a ConcatState lets a later tape match before an earlier one
+    (see ConcatState).  When the query's tape can't match the tape that an
+    edge starts on (which only happens within a JoinState), the edge falls
+    back to the equivalent Seqs and Unis (see TrieNode.expand()), so that it
+    behaves exactly like the rows it came from.
+    """
+    __slots__ = ("node",)
+
+    def __init__(self, node: TrieNode) -> None:
+        self.node = node
+        super().__init__()
+
+    @property
+    def id(self) -> str:
+        return f"Trie({id(self.node):x})"
+
+    def _key(self) -> Tuple:
+        return (self.node,)
+
     def accepting(self, symbolStack: CounterStack) -> bool:
-        return self.child1.accepting(symbolStack) or self.child2.accepting(symbolStack)
+        return self.node.final is not None
+
+    def _computeTapeMask(self) -> int:
+        # Queried on another tape, a trie gives back the union of its rows
+        # (see ndQuery()), which is no different from the trie itself
+        return self.node.tapeMask()
+
+    def _collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
+        toVisit: List[TrieNode] = [self.node]
+        visited: Set[int] = {id(self.node)}
+        while toVisit:
+            node: TrieNode = toVisit.pop()
+            for tapeEdges in node.edges.values():
+                for segments, child in tapeEdges.values():
+                    for tapeName, text in segments:
+                        tapes.addToVocab(tapeName, text)
+                    if id(child) not in visited:
+                        visited.add(id(child))
+                        toVisit.append(child)
+
+    def _firstTokens(self, tape: Tape, symbolStack: CounterStack) -> Optional[FirstTokens]:
+        node: TrieNode = self.node
+        if node.final is not None and tape.matchTape(node.final) is None:
+            return None
+        if len(node.edges) == 0:
+            return (None, [])
+        if len(node.edges) > 1:
+            return None
+        for tapeName, tapeEdges in node.edges.items():
+            matchedTape: Optional[Tape] = tape.matchTape(tapeName)
+            if matchedTape is None:
+                return None
+            return (tapeName, [matchedTape.tokenize(tapeName, symbol)[0] for symbol in tapeEdges])
+        return None
 
     def ndQuery(self,
                 tape: Tape, 
                 target: Token, 
                 symbolStack: CounterStack) -> Gen[Tuple[Tape, Token, bool, State]]:
-        yield from self.child1.dQuery(tape, target, symbolStack)
-        yield from self.child2.dQuery(tape, target, symbolStack)
+        node: TrieNode = self.node
+        if node.final is not None and tape.matchTape(node.final) is None:
+            yield (tape, target, False, LiteralState(node.final, ""))
+
+        for tapeName, tapeEdges in node.edges.items():
+            matchedTape: Optional[Tape] = tape.matchTape(tapeName)
+            if matchedTape is None:
+                for segments, child in tapeEdges.values():
+                    yield from _expandEdge(segments, child).dQuery(tape, target, symbolStack)
+                continue
+
+            # Look up the symbols the query can match, if there are fewer
+            # of them than edges
+            symbols: Iterable[str] = tapeEdges
+            constraint: Optional[Token] = matchedTape.constrain(target)
+            if constraint is not None:
+                candidates: List[str] = matchedTape.fromBits(tapeName, constraint.bits)
+                if len(candidates) < len(tapeEdges):
+                    symbols = candidates
+            for symbol in symbols:
+                edge: Optional[TrieEdge] = tapeEdges.get(symbol)
+                if edge is None:
+                    continue
+                result: Token = matchedTape.match(matchedTape.tokenize(tapeName, symbol)[0], target)
+                if result.isEmpty():
+                    continue
+                yield (matchedTape, result, True, _trieSuccessor(*edge))
+
+def _trieSuccessor(segments: Segments, child: TrieNode) -> State:
+    """ What's left of an edge once its first symbol is matched """
+    rest: List[State] = []
+    tapeName, text = segments[0]
+    if len(text) > 1:
+        rest.append(LiteralState(tapeName, text, 1))
+    for tapeName, text in segments[1:]:
+        rest.append(LiteralState(tapeName, text))
+    if child.edges:
+        rest.append(TrieState(child))
+    elif len(rest) == 0:
+        rest.append(LiteralState(tapeName, ""))
+    return Seq(*rest)
+
+def _literalSegments(state: State) -> Optional[List[Tuple[str, str]]]:
+    """
+    The (tapeName, text) segments of a row made only of literals (a literal,
+    or a concatenation of them), or None if it isn't one.
+    """
+    if isinstance(state, LiteralState):
+        return [(state.tapeName, state.text[state.pos:])]
+    if not isinstance(state, ConcatState):
+        return None
+    segments: List[Tuple[str, str]] = []
+    for child in state.children:
+        childSegments: Optional[List[Tuple[str, str]]] = _literalSegments(child)
+        if childSegments is None:
+            return None
+        segments.extend(childSegments)
+    return segments
+
+# A literal row as its coded steps (see Trie()), the tape it ends on, and its
+# segments
+TrieRow = Tuple[str, str, Segments]
+
+def _trieNode(rows: List[TrieRow],
+              steps: List[Step],
+              lo: int,
+              hi: int,
+              depth: int,
+              register: Dict[Tuple, TrieNode]) -> TrieNode:
+    """
+    The node for rows[lo:hi], which all have the same first depth steps
+    (coded as the characters of the steps' indices in steps).
+    The rows are sorted, so the ones that end here come first, and each
+    edge's rows are next to each other, and share as much as the first and
+    last of them do.
+
+    Nodes with the same edges to the same nodes are the same node (the
+    register has each one by its edges), so rows that end alike share
+    their ends too, like the stems of a lexicon that all end in one of the
+    same few syllables.  That's the usual way of minimizing a trie as it's
+    built from sorted rows, except that edges here are whole runs of
+    symbols, so only runs that match exactly are shared.
+    """
+    final: Optional[str] = None
+    while lo < hi and len(rows[lo][0]) == depth:
+        final = rows[lo][1]
+        lo += 1
+    edges: Dict[str, Dict[str, TrieEdge]] = {}
+    signature: List[Tuple] = [(final,)]
+    while lo < hi:
+        first: str = rows[lo][0]
+        step: str = first[depth]
+        # The rows with this step are rows[lo:end]; there can be thousands
+        # of them, so look for the end rather than going through them all
+        end: int = lo + 1
+        top: int = hi
+        while end < top:
+            middle: int = (end + top) // 2
+            if rows[middle][0][depth] == step:
+                end = middle + 1
+            else:
+                top = middle
+        # The edge runs for as long as the rows agree (to the end, if it's
+        # just the one row)
+        last: str = rows[end - 1][0]
+        length: int = depth + 1 if end > lo + 1 else len(first)
+        while length < len(first) and length < len(last) and first[length] == last[length]:
+            length += 1
+        child: TrieNode = _trieNode(rows, steps, lo, end, length, register)
+        segments: Segments = _sliceSegments(rows[lo][2], depth, length)
+        tapeName, symbol = steps[ord(step)]
+        edges.setdefault(tapeName, {})[symbol] = (segments, child)
+        signature.append((segments, id(child)))
+        lo = end
+    key: Tuple = tuple(signature)
+    node: Optional[TrieNode] = register.get(key)
+    if node is None:
+        node = register[key] = TrieNode(final, edges)
+    return node
+
+def _sliceSegments(segments: Segments, start: int, end: int) -> Segments:
+    """ The segments of steps start to end of a row with these segments """
+    sliced: List[Tuple[str, str]] = []
+    offset: int = 0
+    for tapeName, text in segments:
+        if offset + len(text) > start and offset < end:
+            sliced.append((tapeName, text[max(start - offset, 0):end - offset]))
+        offset += len(text)
+    return tuple(sliced)
 
 
 Gen_T = TypeVar('Gen_T')
 
+class InputTrie:
+    """
+    A trie of tokenized inputs, for State.parseBatch().  Each node has a
+    child for each token that continues some input, and remembers the input
+    that ends there, if any.  next is the union of the children's tokens.
+    """
+    def __init__(self) -> None:
+        self.children: List[Tuple[Token, InputTrie]] = []
+        self._childIndex: Dict[Hashable, InputTrie] = {}
+        self.string: Optional[str] = None
+        self.next: Optional[Token] = None
+
+    def add(self, tokens: List[Token], string: str) -> None:
+        node: InputTrie = self
+        for token in tokens:
+            child: Optional[InputTrie] = node._childIndex.get(token.bits)
+            if child is None:
+                child = InputTrie()
+                node._childIndex[token.bits] = child
+                node.children.append((token, child))
+                node.next = token if node.next is None else node.next.or_(token)
+            node = child
+        node.string = string
+
+
+def _noToken(tapes: TapeCollection, tapeName: str) -> Token:
+    """ A token matching nothing on the tape tapeName of tapes """
+    tape: Optional[Tape] = tapes.matchTape(tapeName)
+    assert isinstance(tape, StringTape)
+    return Token(tape.backend.empty(tape.width))
+
+def _unionOf(states: List[State]) -> State:
+    """
+    Make one state out of alternative states; see _makeDisjoint().
+
+    Alternatives that are themselves unions are spliced in, and alternatives
+    equal to earlier ones are left out, since they'd do exactly the same
+    thing.  Otherwise, in an ambiguous grammar, unions of unions of the same
+    few states would keep nesting, and successor states would get bigger
+    (and slower to query) with every character, rather than staying the size
+    of the alternatives that are actually still live.
+    """
+    if len(states) == 1:
+        return states[0]
+    children: Dict[State, None] = {}
+    for state in states:
+        if type(state) is UnionState:
+            for child in state.children:
+                children[child] = None
+        else:
+            children[state] = None
+    if len(children) == 1:
+        return next(iter(children))
+    return UnionState(*children)
+
+def _makeDisjoint(results: List[Tuple[Tape, Token, bool, State]]) -> List[Tuple[Tape, Token, bool, State]]:
+    """
+    Combine the results of an ndQuery() so that no two of them overlap; see
+    State.dQuery().
+
+    Comparing every result with every other would be quadratic, and a big
+    union can give thousands of results.  But results on different tapes
+    never overlap, so we go tape by tape.  (Results with different weights
+    are kept apart too, even if they overlap, since each path has to keep
+    its own weight; see WeightedToken.)  Results with exactly the same token
+    (like all the words starting with "a") are combined straight away; and
+    then, if what's left is disjoint, which we can tell with a running OR of
+    the tokens, we're done.  Only if not do we have to split the tokens up,
+    and then we do it by partition refinement: each symbol goes with the
+    set of tokens it's in, and symbols that are in the same tokens end up in
+    the same result.  That's linear in the total number of symbols in the
+    tokens.
+
+    The results (and each result's alternatives) stay in the order they
+    were first given; results that match nothing are dropped.
+    """
+    results = [r for r in results if r[0].numTapes == 0 or not r[1].isEmpty()]
+    if len(results) < 2:
+        return results
+
+    # (tape, [(bits, token, matched, states)]) for each tapeName, and each
+    # result that doesn't touch a tape on its own
+    groups: List[Tuple[Tape, List[List]]] = []
+    groupsByTape: Dict[Tuple[str, float], List[List]] = {}
+    bucketsByTape: Dict[Tuple[str, float], Dict[Hashable, List]] = {}
+    for tape, token, matched, nextState in results:
+        if tape.numTapes == 0:
+            groups.append((tape, [[token.bits, token, matched, [nextState]]]))
+            continue
+        groupKey: Tuple[str, float] = (tape.tapeName, token.weight)
+        buckets: Optional[Dict[Hashable, List]] = bucketsByTape.get(groupKey)
+        if buckets is None:
+            buckets = bucketsByTape[groupKey] = {}
+            groupsByTape[groupKey] = []
+            groups.append((tape, groupsByTape[groupKey]))
+        bucket: Optional[List] = buckets.get(token.bits)
+        if bucket is None:
+            bucket = buckets[token.bits] = [token.bits, token, matched, [nextState]]
+            groupsByTape[groupKey].append(bucket)
+        else:
+            bucket[2] = bucket[2] or matched
+            bucket[3].append(nextState)
+
+    disjoint: List[Tuple[Tape, Token, bool, State]] = []
+    for tape, group in groups:
+        if len(group) > 1 and not _areDisjoint(group):
+            group = _refine(tape, group)
+        for _, token, matched, states in group:
+            disjoint.append((tape, token, matched, _unionOf(states)))
+    return disjoint
+
+def _areDisjoint(group: List[List]) -> bool:
+    seen: Bits = group[0][0]
+    for bucket in group[1:]:
+        if seen & bucket[0]:
+            return False
+        seen = seen | bucket[0]
+    return True
+
+def _refine(tape: Tape, group: List[List]) -> List[List]:
+    """
+    Split overlapping (bits, token, matched, states) buckets into disjoint ones,
+    each with the states of all the buckets it was part of.
+    """
+    base: Tape = tape.base
+    if not isinstance(base, StringTape):
+        return _refinePairwise(group)
+    backend: TokenBackend = base.backend
+    width: int = base.width
+
+    # Which buckets each symbol is in; then the symbols that are in the same
+    # buckets make up one new bucket
+    signatures: Dict[int, List[int]] = {}
+    for i, (bits, _, _, _) in enumerate(group):
+        for symbol in backend.indices(bits, width):
+            signature: Optional[List[int]] = signatures.get(symbol)
+            if signature is None:
+                signatures[symbol] = [i]
+            else:
+                signature.append(i)
+    parts: Dict[Tuple[int, ...], List[int]] = {}
+    for symbol, signature in signatures.items():
+        parts.setdefault(tuple(signature), []).append(symbol)
+
+    refined: List[List] = []
+    for signature, symbols in sorted(parts.items()):
+        bits: Bits = backend.empty(width)
+        for symbol in symbols:
+            bits = bits | backend.singleton(width, symbol)
+        states: List[State] = []
+        for i in signature:
+            states.extend(group[i][3])
+        refined.append([bits, group[0][1].withBits(bits), 
+                        any(group[i][2] for i in signature), states])
+    return refined
+
+def _refinePairwise(group: List[List]) -> List[List]:
+    """ _refine(), for tapes whose symbols we can't get at; quadratic """
+    combined: List[List] = []
+    for bits, token, matched, states in group:
+        newCombined: List[List] = []
+        for otherBits, otherToken, otherMatched, otherStates in combined:
+            intersection: Token = token.withBits(token.bits & otherToken.bits)
+            if not intersection.isEmpty():
+                newCombined.append([intersection.bits, intersection, matched or otherMatched,
+                                    otherStates + states])
+            token = token.andNot(intersection)
+            otherToken = otherToken.andNot(intersection)
+            if not otherToken.isEmpty():
+                newCombined.append([otherToken.bits, otherToken, otherMatched, otherStates])
+        combined = newCombined
+        if not token.isEmpty():
+            combined.append([token.bits, token, matched, states])
+    return combined
+
+
+Frontier_T = TypeVar('Frontier_T', bound=Hashable)
+
+def mergeFrontier(queue: List[Tuple[MultiTapeOutput, Frontier_T]]) -> List[Tuple[MultiTapeOutput, Frontier_T]]:
+    """
+    Merge the entries of a generation frontier that are in the same state.
+    (Or whatever the entries are keyed on; parse() pairs each state with how
+    far along the input it is.)
+
+    Two paths that have arrived at the same state will do exactly the same
+    things from here on, so there's no reason to query that state twice; we
+    keep one entry for it whose output is the merger of the paths' outputs
+    (see MultiTapeOutput.merge()).  This bounds the size of the frontier by
+    the number of distinct states rather than the number of distinct paths,
+    which matters for grammars like a union of stems followed by a union of
+    suffixes, where every stem ends up in the same suffix state.
+
+    Entries keep the order in which their states were first seen.
+    """
+    if len(queue) < 2:
+        return queue
+    outputsByState: Dict[Frontier_T, List[MultiTapeOutput]] = {}
+    for output, state in queue:
+        outputs: Optional[List[MultiTapeOutput]] = outputsByState.get(state)
+        if outputs is None:
+            outputsByState[state] = [output]
+        else:
+            outputs.append(output)
+    if len(outputsByState) == len(queue):
+        return queue
+    return [(MultiTapeOutput.merge(outputs), state)
+            for state, outputs in outputsByState.items()]
+
+
 def iterPriorityUnion(iter1: Gen[Gen_T], iter2: Gen[Gen_T]) -> Gen[Gen_T]:
     """
     Convenience function that takes two generators, and yields from the second
@@ -563,6 +2041,8 @@ class JoinState(BinaryState):
     Because the ordinary union of these would lead to the same states twice, we
     use the priority union instead.
     """
+    __slots__ = ()
+
     def ndQueryLeft(self,
                     tape: Tape,
                     target: Token,
@@ -575,6 +2055,12 @@ class JoinState(BinaryState):
                 # c1 contained a ProjectionState that hides the original tape;
                 # move on without asking c2 to match anything.
                 yield (c1tape, c1target, c1matched, JoinState(c1next, c2))
+
+            if _ignores(c2, c1tape, symbolStack, c1target):
+                # c2 has nothing to do with the tape c1 matched on (see
+                # State.tapeMask), so it would just give itself back
+                yield (c1tape, c1target, c1matched, JoinState(c1next, c2))
+                continue
             
             for c2tape, c2target, c2matched, c2next in c2.dQuery(c1tape, c1target, symbolStack):
                 yield (c2tape, c2target, c1matched or c2matched, JoinState(c1next, c2next))
@@ -583,6 +2069,27 @@ class JoinState(BinaryState):
                 tape: Tape, 
                 target: Token, 
                 symbolStack: CounterStack) -> Gen[Tuple[Tape, Token, bool, State]]:
+        if not tape.restricted:
+            yield from self._queryJoin(tape, target, symbolStack)
+            return
+        # Whether the left semijoin matches anything decides which semijoin we
+        # take, so the children can't be asked with the restriction; it only
+        # applies to what the join matches (see RestrictedTapes)
+        for resultTape, resultTarget, matched, nextState in \
+                self._queryJoin(tape.unrestricted, target, symbolStack):
+            if matched:
+                view: Optional[Tape] = tape.matchTape(resultTape.tapeName)
+                if view is not None:
+                    resultTarget = view.narrow(resultTarget)
+                    if resultTarget.isEmpty():
+                        continue
+            yield (resultTape, resultTarget, matched, nextState)
+
+    def _queryJoin(self,
+                   tape: Tape,
+                   target: Token,
+                   symbolStack: CounterStack) -> Gen[Tuple[Tape, Token, bool, State]]:
+        """ The priority union of the left and right semijoins """
         leftJoin: Gen[Tuple[Tape, Token, bool, State]]
         rightJoin: Gen[Tuple[Tape, Token, bool, State]]
         leftJoin = self.ndQueryLeft(tape, target, self.child1, self.child2, symbolStack)
@@ -590,6 +2097,411 @@ class JoinState(BinaryState):
         yield from iterPriorityUnion(leftJoin, rightJoin)
 
 
+class EmbedState(State):
+    """
+    An EmbedState refers to a grammar by name, in a SymbolTable, rather than
+    containing it, so that a grammar that's used in many places (say, a verb
+    stem used by every row of a paradigm) is only stored once, and so that
+    grammars can refer to themselves.
+
+    The symbol is only looked up when it's needed, so the table can be filled
+    in after the grammar is constructed (as it has to be, for recursion).
+    Querying an EmbedState queries the grammar it refers to, and wraps each
+    successor in an EmbedState of the same name, so we can keep track of how
+    deeply a symbol is embedded within itself: each EmbedState adds its
+    symbol to the symbolStack before passing the query on, and if the symbol
+    is already in there maxRecursion times, the EmbedState matches nothing.
+
+    Since what the EmbedState asks the grammar is just what it was asked
+    (plus its symbol), every EmbedState of a symbol asks the same questions,
+    and with a TransitionCache (see State.compile()) the answers are only
+    worked out once.  Likewise, its vocab is only collected once per
+    collection, however many times it's embedded (see _collectVocab()), and
+    if the grammar is compiled, its collection is reused.
+
+    An EmbedState that hasn't matched anything yet is compared and hashed by
+    its symbol (and table) alone, never by the grammar the symbol stands
+    for: a recursive grammar contains EmbedStates of itself, so comparing
+    those by their grammars would never end.  Once it's under way, it's
+    compared by the state it's in within the grammar, which only contains
+    other EmbedStates that haven't started.  (How deep it's embedded is in
+    the structure, since each successor is wrapped in an EmbedState of its
+    own.)
+    """
+    __slots__ = ("symbolName", "symbolTable", "_child")
+
+    def __init__(self, symbolName: str, symbolTable: SymbolTable, 
+                 child: Optional[State] = None) -> None:
+        self.symbolName = symbolName
+        self.symbolTable = symbolTable
+        self._child = child
+        super().__init__()
+
+    @property
+    def id(self) -> str:
+        child: Optional[State] = self._progress()
+        if child is None:
+            return f"Embed({self.symbolName})"
+        return f"Embed({self.symbolName},{child.id})"
+
+    def _key(self) -> Tuple:
+        child: Optional[State] = self._progress()
+        if child is None:
+            return (self.symbolName, id(self.symbolTable))
+        return (self.symbolName, id(self.symbolTable), child)
+
+    def _progress(self) -> Optional[State]:
+        """
+        The state we're in within the embedded grammar, or None if we're
+        still at its start
+        """
+        if self._child is None or self._child is self.symbolTable.get(self.symbolName):
+            return None
+        return self._child
+
+    def getChild(self) -> State:
+        """ The state we're in within the embedded grammar """
+        if self._child is not None:
+            return self._child
+        child: Optional[State] = self.symbolTable.get(self.symbolName)
+        if child is None:
+            raise StateError(f"Undefined symbol: {self.symbolName}")
+        return child
+
+    def _collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
+        # stateStack is shared by the whole collection, so each symbol is 
+        # only collected once, and recursion stops there too
+        if self.symbolName in stateStack:
+            return
+        stateStack.append(self.symbolName)
+        self.getChild().collectVocab(tapes, stateStack)
+
+    def _computeTapeMask(self) -> int:
+        return self.getChild().tapeMask
+
+    def accepting(self, symbolStack: CounterStack) -> bool:
+        if symbolStack.exceedsMax(self.symbolName):
+            return False
+        return self.getChild().accepting(symbolStack.add(self.symbolName))
+
+    def acceptingWeight(self, symbolStack: CounterStack) -> Optional[float]:
+        if symbolStack.exceedsMax(self.symbolName):
+            return None
+        return self.getChild().acceptingWeight(symbolStack.add(self.symbolName))
+
+    def ndQuery(self,
+                tape: Tape, 
+                target: Token, 
+                symbolStack: CounterStack) -> Gen[Tuple[Tape, Token, bool, State]]:
+        if symbolStack.exceedsMax(self.symbolName):
+            return
+        symbolStack = symbolStack.add(self.symbolName)
+        for childTape, childTarget, childMatched, childNext in \
+                self.getChild().dQuery(tape, target, symbolStack):
+            yield (childTape, childTarget, childMatched, 
+                   EmbedState(self.symbolName, self.symbolTable, childNext))
+
+
+class WeightState(State):
+    """
+    A WeightState gives its child a weight: a cost for taking it, like the
+    negative log of its probability, so that (say) Uni(Weight(A, 0.1),
+    Weight(B, 2.3)) prefers A to B.  See State.generateBest().
+
+    The weight is put on the first token the child matches (see
+    WeightedToken), and from then on we're just in the child's successor,
+    so it's only paid once.  If the child is accepted without matching
+    anything (say it's a weighted Empty()), the weight is paid then instead:
+    it's part of the state's acceptingWeight(), which is what a
+    concatenation that goes on past the state, or generateBest() when it
+    stops there, adds to the path.
+    """
+    __slots__ = ("child", "weight")
+
+    def __init__(self, child: State, weight: float) -> None:
+        if weight < 0:
+            raise StateError(f"Weights can't be negative: {weight}")
+        self.child = child
+        self.weight = weight
+        super().__init__()
+
+    @property
+    def id(self) -> str:
+        return f"Weight({self.child.id},{self.weight})"
+
+    def _key(self) -> Tuple:
+        return (self.child, self.weight)
+
+    def _collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
+        self.child.collectVocab(tapes, stateStack)
+
+    def _computeTapeMask(self) -> int:
+        return self.child.tapeMask
+
+    def accepting(self, symbolStack: CounterStack) -> bool:
+        return self.child.accepting(symbolStack)
+
+    def acceptingWeight(self, symbolStack: CounterStack) -> Optional[float]:
+        weight: Optional[float] = self.child.acceptingWeight(symbolStack)
+        return None if weight is None else weight + self.weight
+
+    def ndQuery(self,
+                tape: Tape, 
+                target: Token, 
+                symbolStack: CounterStack) -> Gen[Tuple[Tape, Token, bool, State]]:
+        for childTape, childTarget, childMatched, childNext in \
+                self.child.dQuery(tape, target, symbolStack):
+            if childMatched:
+                yield (childTape, childTarget.addWeight(self.weight), True, childNext)
+            else:
+                yield (childTape, childTarget, False, WeightState(childNext, self.weight))
+
+
+class DfaTable:
+    """
+    The transitions of a minimal deterministic automaton on one tape; see
+    DfaState.  States are numbered, and the edges of state i are edges
+    starts[i] to starts[i+1], in order of their symbols: labels[e] is the
+    symbol of edge e, and targets[e] the state it leads to.  (Symbols are
+    single characters, so the labels are all one string, and finding a
+    state's edge for a symbol is just str.find().)  finals[i] is 1 if state
+    i is accepting, and defaults[i], if there is one, is where the symbols i
+    has no edge for go; that's what a dot becomes.  symbols are all the
+    symbols of the grammar the table was made from; they're what its dots
+    match, so they're its vocabulary, even if no edge has them.
+    """
+    __slots__ = ("tapeName", "starts", "labels", "targets", "finals", "defaults", "symbols")
+
+    def __init__(self,
+                 tapeName: str,
+                 starts: array,
+                 labels: str,
+                 targets: array,
+                 finals: bytes,
+                 defaults: Dict[int, int],
+                 symbols: str) -> None:
+        self.tapeName = tapeName
+        self.starts = starts
+        self.labels = labels
+        self.targets = targets
+        self.finals = finals
+        self.defaults = defaults
+        self.symbols = symbols
+
+    @property
+    def numStates(self) -> int:
+        return len(self.finals)
+
+
+class DfaState(State):
+    """ DFA State
+
+    A state of a minimal deterministic automaton on one tape (see Dfa()).  A
+    subgrammar on one tape, like a list of stems or a paradigm of suffixes,
+    can be worked out ahead of time into a table of numbered states and
+    their transitions (see DfaTable), in which states that would behave the
+    same are merged into one.  Then each state of the subgrammar is just
+    the table and a number: there's no tree of states to build for each
+    successor, or to hash and compare, and all the paths that get to the
+    same state, however they got there, can be merged (see mergeFrontier()).
+    Like a literal, it ignores queries on other tapes.
+    """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: DfaTable, index: int) -> None:
+        self.table = table
+        self.index = index
+        super().__init__()
+
+    @property
+    def id(self) -> str:
+        return f"Dfa({id(self.table):x},{self.index})"
+
+    def _key(self) -> Tuple:
+        return (self.table, self.index)
+
+    def accepting(self, symbolStack: CounterStack) -> bool:
+        return self.table.finals[self.index] == 1
+
+    def _collectVocab(self, tapes: Tape, stateStack: List[str]) -> None:
+        tapes.addToVocab(self.table.tapeName, self.table.symbols)
+
+    def _computeTapeMask(self) -> int:
+        return tapeBit(self.table.tapeName)
+
+    def _firstTokens(self, tape: Tape, symbolStack: CounterStack) -> Optional[FirstTokens]:
+        table: DfaTable = self.table
+        matchedTape: Optional[Tape] = tape.matchTape(table.tapeName)
+        if matchedTape is None or self.index in table.defaults:
+            return None
+        start: int = table.starts[self.index]
+        end: int = table.starts[self.index + 1]
+        if start == end:
+            return (None, [])
+        return (table.tapeName, [matchedTape.tokenize(table.tapeName, symbol)[0]
+                                 for symbol in table.labels[start:end]])
+
+    def ndQuery(self,
+                tape: Tape, 
+                target: Token, 
+                symbolStack: CounterStack) -> Gen[Tuple[Tape, Token, bool, State]]:
+        table: DfaTable = self.table
+        tapeName: str = table.tapeName
+        matchedTape: Optional[Tape] = tape.matchTape(tapeName)
+        if matchedTape is None:
+            yield (tape, target, False, self)
+            return
+
+        start: int = table.starts[self.index]
+        end: int = table.starts[self.index + 1]
+        default: Optional[int] = table.defaults.get(self.index)
+        # What leads to each state, so that each gets one result
+        tokens: Dict[int, Token] = {}
+
+        def add(nextIndex: int, token: Token) -> None:
+            found: Optional[Token] = tokens.get(nextIndex)
+            tokens[nextIndex] = token if found is None else found.or_(token)
+
+        # Look up the symbols the query can match, if there are fewer of
+        # them than edges (or if there's a default, which covers anything)
+        candidates: Optional[List[str]] = None
+        constraint: Optional[Token] = matchedTape.constrain(target)
+        if constraint is not None:
+            candidates = matchedTape.fromBits(tapeName, constraint.bits)
+            if default is None and len(candidates) >= end - start:
+                candidates = None
+        if candidates is None:
+            others: Token = matchedTape.any()
+            for edge in range(start, end):
+                token: Token = matchedTape.tokenize(tapeName, table.labels[edge])[0]
+                add(table.targets[edge], token)
+                others = others.andNot(token)
+            if default is not None:
+                add(default, others)
+        else:
+            for symbol in candidates:
+                edge = table.labels.find(symbol, start, end)
+                if edge >= 0:
+                    add(table.targets[edge], matchedTape.tokenize(tapeName, symbol)[0])
+                elif default is not None:
+                    add(default, matchedTape.tokenize(tapeName, symbol)[0])
+
+        for nextIndex, token in tokens.items():
+            result: Token = matchedTape.match(token, target)
+            if not result.isEmpty():
+                yield (matchedTape, result, True, DfaState(table, nextIndex))
+
+
+def _buildDfa(grammar: State, maxRecursion: int, maxStates: int) -> DfaState:
+    """
+    Determinize grammar (see Dfa()) and minimize it as we go.  We go through
+    the grammar's states depth-first, querying each with every symbol, and
+    give each state a number once all of its successors have one: the
+    number of the first state that had the same transitions to the same
+    numbers, or else a new one.  The grammar is finite, so its states are
+    acyclic, and two states are equivalent just when their successors are,
+    so by the time we get back to the start, no two numbers are equivalent.
+    (That's the usual minimization of acyclic automata; there's no need for
+    Hopcroft's partition refinement, which is for cycles.)
+    """
+    tapes: TapeCollection = TapeCollection()
+    grammar.collectVocab(tapes, [])
+    if tapes.numTapes != 1:
+        raise StateError(f"Only grammars on one tape can be made into DFAs, "
+                         f"not on {tapes.numTapes}")
+    tapeName: str = tapes.tapeNames[0]
+    # A symbol the grammar doesn't have, so it's only matched by dots: the
+    # transition it's in is the one that all the other symbols that might
+    # come along later take too
+    other: str = chr(0xE000)
+    while tapes.inVocab(tapeName, other):
+        other = chr(ord(other) + 1)
+    tapes.addToVocab(tapeName, other)
+    tapes.freeze()
+    tape: Optional[Tape] = tapes.matchTape(tapeName)
+    assert tape is not None
+    vocab: str = "".join(symbol for symbol in tapes.fromBits(tapeName, tape.any().bits)
+                         if symbol != other)
+    anyChar: Token = tapes.any()
+    symbolStack: CounterStack = CounterStack(maxRecursion)
+
+    numbers: Dict[State, int] = {}
+    onPath: Set[State] = {grammar}
+    signatures: Dict[Tuple, int] = {}
+    # (accepting, edges, default) for each number
+    transitions: List[Tuple[bool, Tuple[Tuple[str, int], ...], int]] = []
+    # The states we're in the middle of, with their successors and how
+    # many of those have numbers
+    stack: List[List] = []
+
+    def successors(state: State) -> List[Tuple[Token, State]]:
+        results: List[Tuple[Token, State]] = []
+        for _, token, matched, nextState in state.dQuery(tapes, anyChar, symbolStack):
+            if not matched:
+                continue
+            if token.weight:
+                raise StateError("Weighted grammars can't be made into DFAs")
+            results.append((token, nextState))
+        return results
+
+    stack.append([grammar, successors(grammar), 0])
+    while stack:
+        state, results, done = stack[-1]
+        if done < len(results):
+            stack[-1][2] += 1
+            nextState: State = results[done][1]
+            if nextState in numbers:
+                continue
+            if nextState in onPath:
+                raise StateError("Only finite grammars can be made into DFAs")
+            if len(numbers) + len(stack) >= maxStates:
+                raise StateError(f"The DFA would have more than {maxStates} states")
+            onPath.add(nextState)
+            stack.append([nextState, successors(nextState), 0])
+            continue
+
+        stack.pop()
+        onPath.discard(state)
+        edges: Dict[str, int] = {}
+        default: int = -1
+        for token, successor in results:
+            symbols: List[str] = tapes.fromBits(tapeName, token.bits)
+            if other in symbols:
+                default = numbers[successor]
+            else:
+                for symbol in symbols:
+                    edges[symbol] = numbers[successor]
+        signature: Tuple[bool, Tuple[Tuple[str, int], ...], int] = (
+            state.accepting(symbolStack),
+            tuple(sorted((symbol, n) for symbol, n in edges.items() if n != default)),
+            default)
+        number: Optional[int] = signatures.get(signature)
+        if number is None:
+            number = signatures[signature] = len(transitions)
+            transitions.append(signature)
+        numbers[state] = number
+
+    starts: array = array("l", [0])
+    labels: List[str] = []
+    targets: array = array("l")
+    defaults: Dict[int, int] = {}
+    for number, (_, stateEdges, default) in enumerate(transitions):
+        for symbol, nextNumber in stateEdges:
+            labels.append(symbol)
+            targets.append(nextNumber)
+        starts.append(len(targets))
+        if default >= 0:
+            defaults[number] = default
+    finals: bytes = bytes(1 if accepting else 0 for accepting, _, _ in transitions)
+    table: DfaTable = DfaTable(tapeName, starts, "".join(labels), targets, finals, defaults, vocab)
+    return DfaState(table, numbers[grammar])
+
+
+def parse(grammar: State, inputs: StringDict, maxResults: Optional[int] = None) -> List[StringDict]:
+    """ Get (up to maxResults of) the parses of inputs in grammar; see State.parse() """
+    return list(grammar.parse(inputs, maxResults))
+
+
 SymbolTable = Dict[str, State]
 
 
@@ -608,18 +2520,94 @@ def Seq(*children: State) -> State:
         raise StateError("Sequences must have at least 1 child")
     if len(children) == 1:
         return children[0]
-    return ConcatState(children[0], Seq(*children[1:]))
+    return ConcatState(*_flatten(ConcatState, children))
 
 def Uni(*children: State) -> State:
     if len(children) == 0:
         raise StateError("Unions must have at least 1 child")
     if len(children) == 1:
         return children[0]
-    return UnionState(children[0], Uni(*children[1:]))
+    return UnionState(*_flatten(UnionState, children))
+
+def Trie(*rows: State) -> State:
+    """
+    The union of rows, with the rows made only of literals (on one tape or
+    several) made into a trie; see TrieState.  Other rows, and rows that end
+    in an empty literal on a tape of their own, are left in the union as they
+    are, after the trie.
+    """
+    if len(rows) == 0:
+        raise StateError("Tries must have at least 1 row")
+    literalRows: List[Tuple[str, Segments]] = []
+    others: List[State] = []
+    for row in rows:
+        segments: Optional[List[Tuple[str, str]]] = _literalSegments(row)
+        if segments:
+            # a row ending in an empty literal still has that literal's
+            # tape, which a trie can't keep unless a step ends on it
+            lastTape: str = segments[-1][0]
+            segments = [segment for segment in segments if segment[1]]
+            if segments and segments[-1][0] != lastTape:
+                segments = None
+        if not segments:
+            others.append(row)
+            continue
+        literalRows.append((segments[-1][0], tuple(segments)))
+    if len(literalRows) == 0:
+        return Uni(*others)
+
+    # A lexicon has millions of steps, so rather than make each of them a
+    # tuple, each is coded as a character, in the same order as the steps,
+    # and each row's steps are a string of them
+    alphabets: Dict[str, Set[str]] = {}
+    for _, segments in literalRows:
+        for tapeName, text in segments:
+            alphabets.setdefault(tapeName, set()).update(text)
+    steps: List[Step] = sorted((tapeName, symbol) for tapeName, alphabet in alphabets.items()
+                               for symbol in alphabet)
+    codes: Dict[str, Dict[int, str]] = {tapeName: {} for tapeName in alphabets}
+    for i, (tapeName, symbol) in enumerate(steps):
+        codes[tapeName][ord(symbol)] = chr(i)
+    codedRows: List[TrieRow] = [
+        ("".join(text.translate(codes[tapeName]) for tapeName, text in segments), final, segments)
+        for final, segments in literalRows]
+    codedRows.sort()
+    return Uni(TrieState(_trieNode(codedRows, steps, 0, len(codedRows), 0, {})), *others)
+
+def Dfa(child: State, maxRecursion: int = 4, maxStates: int = 1_000_000) -> State:
+    """
+    child, made into a minimal deterministic automaton; see DfaState.  child
+    has to be on one tape, unweighted and finite: its recursion is cut off
+    at maxRecursion, as it is when it's queried.
+
+    @param child The grammar to make into a DFA
+    @param [maxRecursion] The most times child can recurse
+    @param [maxStates] The most states child can have (before they're
+                merged) before we give up
+    @returns the start state of the DFA
+    """
+    return _buildDfa(child, maxRecursion, maxStates)
+
+def _flatten(cls: type, children: Tuple[State, ...]) -> List[State]:
+    """ Splice the children of any children of class cls into children """
+    flattened: List[State] = []
+    for child in children:
+        if type(child) is cls:
+            assert isinstance(child, NaryState)
+            flattened.extend(child.children)
+        else:
+            flattened.append(child)
+    return flattened
 
 def Join(child1: State, child2: State) -> State:
     return JoinState(child1, child2)
 
+def Embed(symbolName: str, symbolTable: SymbolTable) -> State:
+    return EmbedState(symbolName, symbolTable)
+
+def Weight(child: State, weight: float) -> State:
+    return WeightState(child, weight)
+
 def Any(tier: str) -> State:
     return AnyCharState(tier)
 
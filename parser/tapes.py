@@ -1,9 +1,12 @@
 from __future__ import annotations
 
-from .util import StringDict, Gen, BitSet
+from .util import StringDict, Gen, BitSet, Bits
+from .cache import TransitionCache
 
-from typing import Final, Optional, List, Dict
+from typing import Final, Optional, List, Dict, Tuple
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from itertools import product
 
 """ Outputs
 
@@ -47,14 +50,61 @@ class SingleTapeOutput:
             raise TapeError(f"Incompatible tapes: {tape.tapeName}, {self._tape.tapeName}")
         return SingleTapeOutput(tape, token, self)
 
+    def getChoices(self) -> List[List[str]]:
+        """
+        Return, for each token on this tape (oldest first), the list of
+        strings it could stand for.  This walks back through the trie with a
+        loop rather than recursion, so long outputs don't hit Python's
+        recursion limit.
+        """
+        choices: List[List[str]] = []
+        output: Optional[SingleTapeOutput] = self
+        while output is not None:
+            tape: Tape = output._tape
+            choices.append(tape.fromBits(tape.tapeName, output._token.bits))
+            output = output._prev
+        choices.reverse()
+        return choices
+
     def getStrings(self) -> Gen[str]:
-        prevStrings: List[str] = [""]
-        if self._prev is not None:
-            prevStrings = list(self._prev.getStrings())
-        
-        for s in prevStrings:
-            for c in self._tape.fromBits(self._tape.tapeName, self._token.bits):
-                yield s + c
+        yield from expandChoices(self.getChoices())
+
+
+def expandChoices(choices: List[List[str]]) -> Gen[str]:
+    """
+    Yield every string made by picking one alternative from each position of
+    choices, in order.
+
+    Most positions only have one alternative (anything but a dot matches a
+    single character), so runs of those are joined up front and each
+    resulting string is built by extending a shared prefix, rather than
+    concatenating the whole thing from scratch each time.
+    """
+    segments: List[List[str]] = []
+    run: List[str] = []
+    for alternatives in choices:
+        if len(alternatives) == 1:
+            run.append(alternatives[0])
+            continue
+        if len(alternatives) == 0:
+            return
+        if run:
+            segments.append(["".join(run)])
+            run = []
+        segments.append(alternatives)
+    if run:
+        segments.append(["".join(run)])
+
+    # Depth-first through the segments with an explicit stack of
+    # (number of segments consumed, string so far).
+    stack: List[Tuple[int, str]] = [(0, "")]
+    while stack:
+        position, prefix = stack.pop()
+        if position == len(segments):
+            yield prefix
+            continue
+        for alternative in reversed(segments[position]):
+            stack.append((position + 1, prefix + alternative))
 
 class MultiTapeOutput:
     """
@@ -65,42 +115,91 @@ class MultiTapeOutput:
     <text,b>), you return a new MultiTapeOutput that now points to a new
     SingleTapeOutput corresponding to "text" -- the new one with "b" added --
     and keep all the old pointers the same.
+
+    When several paths through the grammar end up in the same state, their
+    outputs are merged (see merge()) into a MultiTapeOutput whose prefix is
+    the tuple of the original outputs; anything added after that is kept in
+    fresh SingleTapeOutputs, and gets appended to each alternative prefix
+    when we finally turn the outputs into strings.
     """
-    def __init__(self):
+    def __init__(self, prefix: Tuple[MultiTapeOutput, ...] = ()) -> None:
         self.singleTapeOutputs: Dict[str, SingleTapeOutput] = {}
+        self.prefix: Tuple[MultiTapeOutput, ...] = prefix
+
+    @staticmethod
+    def merge(outputs: List[MultiTapeOutput]) -> MultiTapeOutput:
+        """ Return an output representing all of the given alternatives. """
+        if len(outputs) == 1:
+            return outputs[0]
+        return MultiTapeOutput(tuple(outputs))
 
     def add(self, tape: Tape, token: Token) -> MultiTapeOutput:
         if tape.numTapes == 0:
             return self
 
-        result: MultiTapeOutput = MultiTapeOutput()
+        result: MultiTapeOutput = MultiTapeOutput(self.prefix)
         result.singleTapeOutputs.update(self.singleTapeOutputs)
         prev: Optional[SingleTapeOutput] = self.singleTapeOutputs.get(tape.tapeName)
         result.singleTapeOutputs[tape.tapeName] = SingleTapeOutput(tape, token, prev)
         return result
 
-    def toStrings(self) -> List[StringDict]:
-        """ Return a join of the outputs for the individual tapes.
+    def toStrings(self) -> Gen[StringDict]:
+        """ Yield a join of the outputs for the individual tapes.
             Example: With tapes named tape1, tape2, tape3, whose outputs are
                 tape1: foobar, foobaz
                 tape2: a, b
                 tape3: 3333
-            Return the list:
-            [ {'tape1': 'foobar', 'tape2': 'a', 'tape3': '3333'},
-              {'tape1': 'foobaz', 'tape2': 'b', 'tape3': '3333'},
-              {'tape1': 'foobar', 'tape2': 'a', 'tape3': '3333'},
-              {'tape1': 'foobaz', 'tape2': 'b', 'tape3': '3333'} ]
+            Yield:
+              {'tape1': 'foobar', 'tape2': 'a', 'tape3': '3333'}
+              {'tape1': 'foobar', 'tape2': 'b', 'tape3': '3333'}
+              {'tape1': 'foobaz', 'tape2': 'a', 'tape3': '3333'}
+              {'tape1': 'foobaz', 'tape2': 'b', 'tape3': '3333'}
+
+            If there's a prefix, each of its alternatives' results has the
+            strings above appended to it.  
+
+            Results are produced one at a time, so the caller can stop
+            whenever it likes, and nothing here recurses, however long the
+            outputs or however many times they've been merged.
         """
-        results: List[StringDict] = [{}]
-        for tapeName, tape in self.singleTapeOutputs.items():
-            newResults: List[StringDict] = []
-            for s in tape.getStrings():
-                for result in results:
-                    newResult: StringDict = result.copy()
-                    newResult[tapeName] = s
-                    newResults.append(newResult)
-            results = newResults
-        return results
+        # Each way of choosing among the prefix alternatives, all the way back
+        # to an output with no prefix, is a chain of outputs; find the chains
+        # depth-first with an explicit stack of (output, link), where link is
+        # a linked list (output, link) of the outputs that come after it.
+        stack: List[Tuple[MultiTapeOutput, Optional[Tuple]]] = [(self, None)]
+        while stack:
+            output, link = stack.pop()
+            if output.prefix:
+                for alternative in reversed(output.prefix):
+                    stack.append((alternative, (output, link)))
+                continue
+            chain: List[MultiTapeOutput] = [output]
+            while link is not None:
+                chain.append(link[0])
+                link = link[1]
+            yield from MultiTapeOutput._chainToStrings(chain)
+
+    @staticmethod
+    def _chainToStrings(chain: List[MultiTapeOutput]) -> Gen[StringDict]:
+        """ Yield the results of one chain of outputs, oldest first. """
+        choicesByTape: Dict[str, List[List[str]]] = {}
+        for output in chain:
+            for tapeName, tapeOutput in output.singleTapeOutputs.items():
+                choicesByTape.setdefault(tapeName, []).extend(tapeOutput.getChoices())
+
+        tapeNames: List[str] = list(choicesByTape.keys())
+        if not tapeNames:
+            yield {}
+            return
+        # The last tape varies fastest, so only its strings need to be
+        # expanded lazily; the others are needed over and over.
+        stringsByTape: List[List[str]] = [list(expandChoices(choicesByTape[t]))
+                                          for t in tapeNames[:-1]]
+        for combination in product(*stringsByTape):
+            for lastString in expandChoices(choicesByTape[tapeNames[-1]]):
+                result: StringDict = dict(zip(tapeNames, combination))
+                result[tapeNames[-1]] = lastString
+                yield result
 
 
 class TapeError(Exception):
@@ -113,6 +212,21 @@ class TapeError(Exception):
         self.msg = msg
 
 
+ALL_TAPES: Final[int] = -1
+_tapeBits: Dict[str, int] = {}
+
+def tapeBit(tapeName: str) -> int:
+    """
+    The bit that stands for the tape called tapeName in tape masks (see
+    Tape.tapeMask), given out in the order names are first asked about.
+    Bits only mean anything within one process, so masks are never pickled.
+    """
+    bit: Optional[int] = _tapeBits.get(tapeName)
+    if bit is None:
+        bit = _tapeBits[tapeName] = 1 << len(_tapeBits)
+    return bit
+
+
 class Tape(ABC):
     """
     Tape: Abstract Base Class for all tape classes
@@ -130,6 +244,14 @@ class Tape(ABC):
     def __init__(self, tapeName: str, numTapes: int) -> None:
         self._tapeName = tapeName
         self._numTapes = numTapes
+        self.transitions: Optional[TransitionCache] = None
+
+    def __getstate__(self) -> Dict:
+        # Transition caches can be big, and are easy enough to rebuild, so
+        # they stay behind when tapes are pickled.
+        state: Dict = self.__dict__.copy()
+        state["transitions"] = None
+        return state
 
     @property
     def tapeName(self) -> str:
@@ -139,6 +261,17 @@ class Tape(ABC):
     def numTapes(self) -> int:
         return self._numTapes
 
+    @property
+    def tapeMask(self) -> int:
+        """
+        The tapes that matchTape() can match, as a mask of their tapeBit()s;
+        ALL_TAPES if it might match any of them (or if we can't tell, as with
+        a RenamedTape, whose names aren't the names states know it by).
+        States compare this with their own tapeMask to see whether a query
+        can have anything to do with them.
+        """
+        return ALL_TAPES
+
     def add(self, str1: str, str2: str) -> List[str]:
         raise NotImplementedError
 
@@ -148,51 +281,312 @@ class Tape(ABC):
     def any(self) -> Token:
         raise NotImplementedError
 
-    def plus(self, tapeName: str, other: BitSet) -> Gen[Tape]:
+    def plus(self, tapeName: str, other: Bits) -> Gen[Tape]:
+        raise NotImplementedError
+
+    def times(self, tapeName: str, other: Bits) -> Gen[Tape]:
         raise NotImplementedError
 
-    def times(self, tapeName: str, other: BitSet) -> Gen[Tape]:
+    def tokenize(self, tapeName: str, string: str, cache: bool = True) -> List[Token]:
+        """
+        The tokens of string's symbols.  The tokens of a grammar's literals
+        are kept, since they're asked for again and again (see
+        StringTape.tokenize()); strings that come and go, like the inputs
+        of parse(), should be tokenized with cache=False, so that they
+        don't pile up.
+        """
+        raise NotImplementedError
+
+    def addToVocab(self, tapeName: str, string: str) -> None:
         raise NotImplementedError
 
-    def tokenize(self, tapeName: str, string: str) -> List[Token]:
+    def inVocab(self, tapeName: str, string: str) -> bool:
+        """ Whether every symbol of string is already in the tape's vocab """
         raise NotImplementedError
 
+    def includeVocab(self, other: TapeCollection) -> None:
+        """ Add all of the vocab of another collection to this one """
+        for tapeName, tape in other._tapes.items():
+            assert isinstance(tape, StringTape)
+            for symbol in tape.indexToStr.values():
+                self.addToVocab(tapeName, symbol)
+
+    def fixWidth(self) -> None:
+        """
+        Stop the width of tokens from growing; called after vocab collection,
+        before any tokens are made.
+        """
+        pass
+
+    def freeze(self) -> None:
+        """
+        Fix the width and refuse any new vocabulary from now on.
+        """
+        self.fixWidth()
+
+    @property
+    def frozen(self) -> bool:
+        return False
+
+    @property
+    def base(self) -> Tape:
+        """
+        The tape underneath any views of it (see RestrictedTapes), which is
+        what decides what tokens mean.
+        """
+        return self
+
+    @property
+    def restricted(self) -> bool:
+        """ Whether matches on this tape are narrowed (see RestrictedTapes) """
+        return False
+
+    @property
+    def unrestricted(self) -> Tape:
+        """ This tape, without any narrowing of its matches (see RestrictedTapes) """
+        return self
+
+    def narrow(self, token: Token) -> Token:
+        """ token, narrowed as a match on this tape would be """
+        return token
+
+    def constrain(self, target: Token) -> Optional[Token]:
+        """
+        What a match of target on this tape can possibly be; None if it could
+        be anything.  (States can use this to skip children that can't match.)
+        """
+        return None
+
     @abstractmethod
     def matchTape(self, tapeName: str) -> Optional[Tape]:
         pass
 
     @abstractmethod
-    def toBits(self, tapeName: str, char: str) -> BitSet:
+    def toBits(self, tapeName: str, char: str) -> Bits:
         pass
 
     @abstractmethod
-    def fromBits(self, tapeName: str, bits: BitSet) -> List[str]:
+    def fromBits(self, tapeName: str, bits: Bits) -> List[str]:
         pass
 
 class Token:
     """ Token
     
     This encapsulates a token, so that parsers need not necessarily know how,
-    exactly, a token is implemented. Right now we only have one kind of token,
-    strings implemented as BitSets, but eventually this should be an abstract
-    class with (e.g.) StringToken, maybe FlagToken, ProbToken and/or LogToken
-    (for handling weights), etc.
+    exactly, a token is implemented. Right now tokens are strings implemented
+    as bit vectors, optionally with a weight (see WeightedToken); eventually
+    this might be an abstract class with (e.g.) StringToken, maybe FlagToken,
+    etc.
+
+    The bits themselves are either BitSets or plain Python ints, depending on
+    the TokenBackend that created them (see below); all a Token needs from its
+    bits is &, ~ and truth-testing, which both of them provide.  Tokens are
+    the innermost objects of the query loop, so they're kept as small as
+    possible.
+
+    A token can also have a weight (see WeightedToken); plain tokens weigh
+    nothing.
     """
-    def __init__(self, bits: BitSet) -> None:
+    __slots__ = ("bits",)
+
+    weight: float = 0.0
+
+    def __init__(self, bits: Bits) -> None:
         self.bits = bits
 
+    def __repr__(self) -> str:
+        return f"Token({self.bits!r})"
+
     def and_(self, other: Token) -> Token:
+        weight: float = self.weight + other.weight
+        if weight:
+            return WeightedToken(self.bits & other.bits, weight)
         return Token(self.bits & other.bits)
-    
+
+    def or_(self, other: Token) -> Token:
+        return self.withBits(self.bits | other.bits)
+
     def andNot(self, other: Token) -> Token:
-        return Token(self.bits & ~other.bits)
+        return self.withBits(self.bits & ~other.bits)
+
+    def withBits(self, bits: Bits) -> Token:
+        """ A token with other bits, but the same weight """
+        return Token(bits)
+
+    def addWeight(self, weight: float) -> Token:
+        """ A token with the same bits, weighing weight more """
+        if weight == 0:
+            return self
+        return WeightedToken(self.bits, self.weight + weight)
     
     def isEmpty(self) -> bool:
-        return not self.bits.any()
+        return not self.bits
+
+
+class WeightedToken(Token):
+    """ Weighted Token
+
+    A token that costs something to match, e.g. the negative log of the
+    probability of taking the branch of the grammar it's on.  When a token is
+    matched against another (as when a join asks one of its children to match
+    what the other did), their weights add up, so a path's weight is the sum
+    of the weights of its tokens.  (See WeightState and State.generate().)
+    """
+    __slots__ = ("weight",)
+
+    def __init__(self, bits: Bits, weight: float) -> None:
+        self.bits = bits
+        self.weight = weight
+
+    def __repr__(self) -> str:
+        return f"WeightedToken({self.bits!r}, {self.weight!r})"
+
+    def withBits(self, bits: Bits) -> Token:
+        return WeightedToken(bits, self.weight)
+
+
+class TokenBackend(ABC):
+    """ Token Backend
+
+    A TokenBackend decides how the bits inside Tokens are represented: it
+    makes the bits for a tape's "any" and "no" characters and for individual
+    symbols, and reads symbol indices back out of bits.  Tapes ask their
+    backend for bits rather than constructing them directly, so the
+    representation can be chosen at runtime (see setTokenBackend()).
+
+    Each backend also holds interned anyChar/noChar Tokens, so the query loop
+    never has to allocate them.  Since different tapes have different widths
+    (see StringTape.fixWidth()), anyChar can't be any particular tape's "any"
+    token; it's the query target that means "whatever this tape has", and
+    tapes recognize it by identity in match().
+    """
+    name: str = ""
+
+    def __init__(self) -> None:
+        self.anyChar: Final[Token] = Token(self.universal())
+        self.noChar: Final[Token] = Token(self.empty(0))
+
+    def __reduce__(self) -> Tuple:
+        # Backends are singletons (tapes rely on the identity of anyChar), so
+        # they're pickled by name and unpickle to the existing instance.
+        return (_getTokenBackendByName, (self.name,))
+
+    @abstractmethod
+    def universal(self) -> Bits:
+        """ The bits of anyChar """
+        pass
+
+    @abstractmethod
+    def empty(self, width: int) -> Bits:
+        pass
+
+    @abstractmethod
+    def full(self, width: int) -> Bits:
+        pass
+
+    @abstractmethod
+    def singleton(self, width: int, index: int) -> Bits:
+        pass
+
+    @abstractmethod
+    def indices(self, bits: Bits, width: int) -> List[int]:
+        pass
+
+
+class IntTokenBackend(TokenBackend):
+    """ Tokens whose bits are plain Python ints
+
+    An int is an immutable bit vector that CPython operates on a machine word
+    at a time, so &, ~ and truth-testing are single operations with no
+    wrapper objects in between.  Ints also don't have a width: ~x is
+    "everything but x" regardless of how many symbols a tape has, so the
+    interned anyChar is just -1 (all bits set).
+    """
+    name = "int"
+
+    def universal(self) -> Bits:
+        return -1
+
+    def empty(self, width: int) -> Bits:
+        return 0
+
+    def full(self, width: int) -> Bits:
+        return (1 << width) - 1
 
-MAX_NUM_CHARS: Final[int] = 32
-ANY_CHAR: Final[Token] = Token(~BitSet(MAX_NUM_CHARS))
-NO_CHAR: Final[Token] = Token(BitSet())
+    def singleton(self, width: int, index: int) -> Bits:
+        return 1 << index
+
+    def indices(self, bits: Bits, width: int) -> List[int]:
+        assert isinstance(bits, int)
+        bits &= (1 << width) - 1
+        result: List[int] = []
+        while bits:
+            lowest: int = bits & -bits
+            result.append(lowest.bit_length() - 1)
+            bits ^= lowest
+        return result
+
+
+class BitSetTokenBackend(TokenBackend):
+    """ Tokens whose bits are BitSets (i.e., bitarrays)
+
+    This was the original representation.  Every operation allocates a new
+    bitarray plus the BitSet wrapping it, so it's slower than the int backend,
+    but it's kept around for comparison.
+
+    BitSets of different lengths can't be combined, so all the tokens on a
+    tape have to be created after its width is fixed.  The anyChar here is a
+    one-bit placeholder; it's only ever intersected with itself, since
+    match() short-circuits it.
+    """
+    name = "bitarray"
+
+    def universal(self) -> Bits:
+        return ~BitSet(1)
+
+    def empty(self, width: int) -> Bits:
+        return BitSet(width)
+
+    def full(self, width: int) -> Bits:
+        return ~BitSet(width)
+
+    def singleton(self, width: int, index: int) -> Bits:
+        result: BitSet = BitSet(width)
+        result[index] = 1
+        return result
+
+    def indices(self, bits: Bits, width: int) -> List[int]:
+        assert isinstance(bits, BitSet)
+        return [i for i in range(min(len(bits), width)) if bits[i]]
+
+
+TOKEN_BACKENDS: Final[Dict[str, TokenBackend]] = {
+    IntTokenBackend.name: IntTokenBackend(),
+    BitSetTokenBackend.name: BitSetTokenBackend(),
+}
+
+_tokenBackend: TokenBackend = TOKEN_BACKENDS["int"]
+
+def getTokenBackend() -> TokenBackend:
+    """ Return the TokenBackend that newly-created tapes will use. """
+    return _tokenBackend
+
+def setTokenBackend(name: str) -> None:
+    """
+    Choose the TokenBackend ("int" or "bitarray") for tapes created from now
+    on.  Tapes keep the backend they were created with, so this doesn't
+    affect grammars that are already mid-generation.
+    """
+    global _tokenBackend
+    if name not in TOKEN_BACKENDS:
+        raise TapeError(f"Unknown token backend: {name}")
+    _tokenBackend = TOKEN_BACKENDS[name]
+
+def _getTokenBackendByName(name: str) -> TokenBackend:
+    return TOKEN_BACKENDS[name]
+
+ANY_CHAR: Final[Token] = TOKEN_BACKENDS["int"].anyChar
+NO_CHAR: Final[Token] = TOKEN_BACKENDS["int"].noChar
 
 class StringTape(Tape):
     """ String tape class implementation
@@ -200,22 +594,38 @@ class StringTape(Tape):
     A tape containing strings; the basic kind of tape and (right now) the only
     one we really use. (Besides a TapeCollection, which implements Tape but is
     really used for a different situation.)
+
+    Each symbol registered on the tape gets the next bit index, so the width
+    of the tape's tokens is just the size of its vocabulary.  Vocab is
+    collected from the whole grammar before any querying happens, and then
+    the width is fixed (see fixWidth()), so that every token on the tape is
+    the same size and no bit operation ever has to resize anything.
+
+    The vocabulary (strToIndex/indexToStr) belongs to this tape alone; tapes
+    only share one if it's explicitly passed in, as append() does.
     """
     def __init__(self,
                  tapeName: str, 
                  current: Optional[Token] = None,
                  prev: Optional[StringTape] = None,
-                 strToIndex: Dict[str, int] = {},
-                 indexToStr: Dict[int, str] = {}) -> None:
+                 strToIndex: Optional[Dict[str, int]] = None,
+                 indexToStr: Optional[Dict[int, str]] = None,
+                 backend: Optional[TokenBackend] = None) -> None:
         super().__init__(tapeName, 1)
         self.current = current
         self.prev = prev
-        self.strToIndex = strToIndex
-        self.indexToStr = indexToStr
+        self.strToIndex: Dict[str, int] = {} if strToIndex is None else strToIndex
+        self.indexToStr: Dict[int, str] = {} if indexToStr is None else indexToStr
+        self.backend: TokenBackend = backend or getTokenBackend()
+        self._width: Optional[int] = None
+        self._any: Optional[Token] = None
+        self._frozen: bool = False
+        self._tokenCache: Dict[str, List[Token]] = {}
+        self._symbolTokens: Dict[str, Token] = {}
 
     def append(self, token: Token) -> StringTape:
         return StringTape(self.tapeName, token, self,
-                          self.strToIndex, self.indexToStr)
+                          self.strToIndex, self.indexToStr, self.backend)
 
     def getStrings(self) -> Gen[str]:
         prevStrings: List[str]
@@ -232,61 +642,133 @@ class StringTape(Tape):
     def matchTape(self, tapeName: str) -> Optional[Tape]:
         return self if tapeName == self.tapeName else None
 
+    @property
+    def tapeMask(self) -> int:
+        return tapeBit(self.tapeName)
+
+    @property
+    def width(self) -> int:
+        """
+        The number of bits in this tape's tokens.  Until fixWidth() is called
+        this grows along with the vocabulary.
+        """
+        if self._width is None:
+            return len(self.strToIndex)
+        return self._width
+
+    def fixWidth(self) -> None:
+        if self._width is not None:
+            return
+        self._width = len(self.strToIndex)
+        self._any = Token(self.backend.full(self._width))
+
+    def freeze(self) -> None:
+        self.fixWidth()
+        self._frozen = True
+
+    @property
+    def frozen(self) -> bool:
+        return self._frozen
+
     def any(self) -> Token:
-        # return Token(~BitSet(len(self.strToIndex)))
-        return Token(~BitSet(MAX_NUM_CHARS))
+        if self._any is not None:
+            return self._any
+        return Token(self.backend.full(self.width))
 
     def add(self, str1: str, str2: str) -> List[str]:
         return [str1 + str2]
 
     def match(self, str1: Token, str2: Token) -> Token:
+        if str2 is self.backend.anyChar:
+            return str1
         return str1.and_(str2)
 
-    def tokenize(self, tapeName: str, string: str) -> List[Token]:
+    def constrain(self, target: Token) -> Optional[Token]:
+        if target is self.backend.anyChar or target is self._any:
+            return None
+        return target
+
+    def split(self, string: str) -> List[str]:
+        """ Split a string into the symbols of this tape's vocabulary. """
+        return list(string)
+
+    def addToVocab(self, tapeName: str, string: str) -> None:
         if tapeName != self.tapeName:
             raise TapeError(f"Trying to add a character from tape {tapeName} \
                               to tape {self.tapeName}")
-        
-        results: List[Token] = []
-        for c in string:
-            index: Optional[int] = self.strToIndex.get(c)
-            if index is None:
-                index = self.registerToken(c)
-            newToken: Token = Token(self.toBits(tapeName, c))
-            results.append(newToken)
-        return results
+
+        for symbol in self.split(string):
+            if symbol not in self.strToIndex:
+                self.registerToken(symbol)
+
+    def extend(self) -> StringTape:
+        """
+        Make a new, unfixed tape whose vocab starts out as a copy of this
+        one's, with the same indices, so that more can be added to it without
+        changing this one.
+        """
+        return StringTape(self.tapeName, strToIndex=dict(self.strToIndex),
+                          indexToStr=dict(self.indexToStr), backend=self.backend)
+
+    def inVocab(self, tapeName: str, string: str) -> bool:
+        return tapeName == self.tapeName and \
+               all(symbol in self.strToIndex for symbol in self.split(string))
+
+    def tokenize(self, tapeName: str, string: str, cache: bool = True) -> List[Token]:
+        tokens: Optional[List[Token]] = self._tokenCache.get(string)
+        if tokens is not None and tapeName == self.tapeName:
+            return tokens
+        self.addToVocab(tapeName, string)
+        if self._width is None:
+            return [Token(self.toBits(tapeName, c)) for c in self.split(string)]
+        # Once the width is fixed, tokens can't go stale, so it's safe to
+        # hand out the same ones every time we're asked, and to make just one
+        # token for each symbol, shared by every string it's in.  (There are
+        # only so many symbols, but there's no end of strings, so strings are
+        # only kept if cache is set.)
+        tokens = []
+        for c in self.split(string):
+            token: Optional[Token] = self._symbolTokens.get(c)
+            if token is None:
+                token = self._symbolTokens[c] = Token(self.toBits(tapeName, c))
+            tokens.append(token)
+        if cache:
+            self._tokenCache[string] = tokens
+        return tokens
 
     def registerToken(self, token: str) -> int:
+        if self._frozen:
+            raise TapeError(f"Cannot add {token} to tape {self.tapeName}; \
+                              its vocabulary is frozen")
         index: Final[int] = len(self.strToIndex)
+        if self._width is not None and index >= self._width:
+            raise TapeError(f"Cannot add {token} to tape {self.tapeName}; \
+                              its width is fixed at {self._width} symbols")
         self.strToIndex[token] = index
         self.indexToStr[index] = token
         return index
 
-    def toBits(self, tapeName: str, char: str) -> BitSet:
+    def toBits(self, tapeName: str, char: str) -> Bits:
         if tapeName != self.tapeName:
             raise TapeError(f"Trying to get bits on tape {tapeName} \
                               from tape ${self.tapeName}")
         
-        # result: BitSet = BitSet(len(self.strToIndex))
-        result: BitSet = BitSet(MAX_NUM_CHARS)
         index: Final[Optional[int]] = self.strToIndex.get(char)
         if index is None:
-            return result
-        result[index] = 1
-        return result
+            return self.backend.empty(self.width)
+        return self.backend.singleton(self.width, index)
     
-    def fromBits(self, tapeName: str, bits: BitSet) -> List[str]:
+    def fromBits(self, tapeName: str, bits: Bits) -> List[str]:
         if tapeName != self.tapeName:
             raise TapeError(f"Trying to get bits on tape {tapeName} \
                               from tape ${self.tapeName}")
 
         result: List[str] = []
-        for i in range(len(bits)):
-            if bits[i]:
-                char: Optional[str] = self.indexToStr.get(i)
-                if char is None:
-                    break
-                result.append(char)
+        for i in self.backend.indices(bits, self.width):
+            char: Optional[str] = self.indexToStr.get(i)
+            if char is None:
+                raise TapeError(f"No symbol with index {i} on tape {self.tapeName}")
+            result.append(char)
         return result
 
 class FlagTape(StringTape):
@@ -304,14 +786,8 @@ class FlagTape(StringTape):
             return [newResult]
         return []
 
-    def tokenize(self, tapeName: str, string: str) -> List[Token]:
-        if tapeName != self.tapeName:
-            raise TapeError(f"Trying to add a character from tape {tapeName} \
-                              to tape {self.tapeName}")
-
-        if (string not in self.strToIndex):
-            self.registerToken(string)
-        return [Token(self.toBits(tapeName, string))]
+    def split(self, string: str) -> List[str]:
+        return [string]
     
 class TapeCollection(Tape):
     """ Collection of Tapes
@@ -327,13 +803,44 @@ class TapeCollection(Tape):
     objects, and when we matchTape("text"), we return the StringTape
     corresponding to "text".  That's why we need an object that collects all of
     them, so we can return the appropriate one when it's needed.)
+
+    Since each tape keeps its own vocabulary, a TapeCollection is also the
+    symbol registry for a grammar: everything that grammar knows about
+    symbols lives here and nowhere else, so it goes away with the grammar.
+    Once a grammar is compiled (see State.compile()), its collection is frozen
+    so that nothing can grow it further.
+
+    A collection can also carry a TransitionCache, shared by all its tapes, in
+    which queries made with those tapes are remembered.  (Tokens only mean
+    something relative to the collection they came from, so the collection is
+    the natural owner of the cache.)
     """
-    def __init__(self) -> None:
+    # The most restricted views of the collection to keep; see restrict()
+    MAX_VIEWS: Final[int] = 1024
+
+    def __init__(self, backend: Optional[TokenBackend] = None) -> None:
         self._tapes: Dict[str, Tape] = {}
+        self._frozen: bool = False
+        self.backend: TokenBackend = backend or getTokenBackend()
+        self.transitions: Optional[TransitionCache] = None
+        self._views: OrderedDict[Tuple, RestrictedTapes] = OrderedDict()
+        self._origin: Optional[TapeCollection] = None
+
+    def __getstate__(self) -> Dict:
+        state: Dict = super().__getstate__()
+        state["_views"] = OrderedDict()
+        return state
 
     @property
     def numTapes(self) -> int:
         return len(self._tapes)
+
+    @property
+    def tapeNames(self) -> List[str]:
+        return list(self._tapes)
+
+    def any(self) -> Token:
+        return self.backend.anyChar
     
     def addTape(self, tape: Tape) -> None:
         self._tapes[tape.tapeName] = tape
@@ -344,20 +851,143 @@ class TapeCollection(Tape):
             return "__NO_TAPE__"
         return "__ANY_TAPE__"
 
-    def tokenize(self, tapeName: str, string: str) -> List[Token]:
+    def tokenize(self, tapeName: str, string: str, cache: bool = True) -> List[Token]:
+        if tapeName not in self._tapes:
+            self._addStringTape(tapeName)
+        return self._tapes[tapeName].tokenize(tapeName, string, cache)
+
+    def addToVocab(self, tapeName: str, string: str) -> None:
         if tapeName not in self._tapes:
-            self._tapes[tapeName] = StringTape(tapeName)
-        return self._tapes[tapeName].tokenize(tapeName, string)
+            self._addStringTape(tapeName)
+        tape: Tape = self._tapes[tapeName]
+        if tape.frozen and not self._frozen and not tape.inVocab(tapeName, string):
+            # A tape borrowed from a compiled grammar (see includeVocab());
+            # extend it rather than changing the grammar's.
+            assert isinstance(tape, StringTape)
+            tape = tape.extend()
+            self._tapes[tapeName] = tape
+        tape.addToVocab(tapeName, string)
+
+    def inVocab(self, tapeName: str, string: str) -> bool:
+        return tapeName in self._tapes and self._tapes[tapeName].inVocab(tapeName, string)
+
+    def includeVocab(self, other: TapeCollection) -> None:
+        """
+        Add all of the vocab of another collection (usually that of a compiled
+        grammar) to this one.  Where we don't have a tape yet, we just borrow
+        the other collection's tape, so everything the other tape has already
+        tokenized and cached is reused; it gets replaced with an extended
+        copy only if something new is added to it.  (Likewise if we have a
+        tape but it has nothing the other's doesn't.)  Otherwise the other's
+        symbols go first, so they keep the same indices.
+
+        This has to happen during vocab collection, before any tokens are
+        made with our tapes.
+        """
+        if other.backend is not self.backend:
+            super().includeVocab(other)
+            return
+        for tapeName, tape in other._tapes.items():
+            mine: Optional[Tape] = self._tapes.get(tapeName)
+            if mine is None:
+                self._tapes[tapeName] = tape
+            elif mine is not tape:
+                assert isinstance(tape, StringTape) and isinstance(mine, StringTape)
+                if all(symbol in tape.strToIndex for symbol in mine.indexToStr.values()):
+                    self._tapes[tapeName] = tape
+                    continue
+                merged: StringTape = tape.extend()
+                for symbol in mine.indexToStr.values():
+                    merged.addToVocab(tapeName, symbol)
+                self._tapes[tapeName] = merged
+
+    def extend(self) -> TapeCollection:
+        """
+        Make a new, unfrozen collection whose vocab starts out as this one's
+        (borrowing its tapes, see includeVocab()), so that more can be added
+        to it without changing this one.
+        """
+        tapes: TapeCollection = TapeCollection(self.backend)
+        tapes.includeVocab(self)
+        tapes._origin = self.origin
+        return tapes
+
+    @property
+    def origin(self) -> TapeCollection:
+        """
+        The collection this one was extended from (see extend()), or itself.
+        Every symbol of the origin means the same here, so whatever is worked
+        out about a grammar in terms of its symbols (like a UnionIndex) holds
+        for both.
+        """
+        return self if self._origin is None else self._origin
+
+    def _addStringTape(self, tapeName: str) -> None:
+        if self._frozen:
+            raise TapeError(f"Cannot add tape {tapeName}; the tape collection is frozen")
+        tape: StringTape = StringTape(tapeName, backend=self.backend)
+        tape.transitions = self.transitions
+        self._tapes[tapeName] = tape
+
+    def restrict(self, restrictions: Dict[str, Token]) -> RestrictedTapes:
+        """
+        A view of this collection in which whatever is matched on each tape
+        in restrictions is also narrowed to the given token; see
+        RestrictedTapes.  If the collection has a TransitionCache, views are
+        kept, so asking for the same restrictions again gives the same view,
+        and queries made with it can be found in the cache.  But parseBatch()
+        restricts with whatever its inputs can go on with, which has no end
+        of combinations, so only the MAX_VIEWS used most recently are kept;
+        the queries made with views that are dropped just stop being found,
+        and go out of the cache in their turn.
+        """
+        if self.transitions is None:
+            return RestrictedTapes(self, restrictions)
+        key: Tuple = tuple((tapeName, token.bits) for tapeName, token in restrictions.items())
+        view: Optional[RestrictedTapes] = self._views.get(key)
+        if view is None:
+            view = RestrictedTapes(self, restrictions)
+            self._views[key] = view
+            if len(self._views) > self.MAX_VIEWS:
+                self._views.popitem(last=False)
+        else:
+            self._views.move_to_end(key)
+        return view
+
+    def cacheTransitions(self, transitions: Optional[TransitionCache]) -> None:
+        """
+        Share transitions among this collection and all of its tapes, so
+        that queries made with any of them are remembered there.  Passing
+        None turns caching off again.
+        """
+        self.transitions = transitions
+        for tape in self._tapes.values():
+            tape.transitions = transitions
+        for view in self._views.values():
+            view.cacheTransitions(transitions)
+
+    def fixWidth(self) -> None:
+        for tape in self._tapes.values():
+            tape.fixWidth()
+
+    def freeze(self) -> None:
+        for tape in self._tapes.values():
+            tape.freeze()
+        self._frozen = True
+
+    @property
+    def frozen(self) -> bool:
+        return self._frozen
 
     def matchTape(self, tapeName: str) -> Optional[Tape]:
         return self._tapes.get(tapeName)
 
-    def toBits(self, tapeName: str, char: str) -> BitSet:
+    def toBits(self, tapeName: str, char: str) -> Bits:
         if tapeName not in self._tapes:
             raise TapeError(f"Undefined tape: {tapeName}")
         return self._tapes[tapeName].toBits(tapeName, char)
 
-    def fromBits(self, tapeName: str, bits: BitSet) -> List[str]:
+    def fromBits(self, tapeName: str, bits: Bits) -> List[str]:
         if tapeName not in self._tapes:
             raise TapeError(f"Undefined tape: {tapeName}")
         return self._tapes[tapeName].fromBits(tapeName, bits)
@@ -405,6 +1035,22 @@ class RenamedTape(Tape):
     def match(self, str1: Token, str2: Token) -> Token:
         return self._child.match(str1, str2)
 
+    @property
+    def restricted(self) -> bool:
+        return self._child.restricted
+
+    @property
+    def unrestricted(self) -> Tape:
+        if not self._child.restricted:
+            return self
+        return RenamedTape(self._child.unrestricted, self._fromTape, self._toTape)
+
+    def narrow(self, token: Token) -> Token:
+        return self._child.narrow(token)
+
+    def constrain(self, target: Token) -> Optional[Token]:
+        return self._child.constrain(target)
+
     def _adjustTapeName(self, tapeName: str) -> str:
         return self._toTape if tapeName == self._fromTape else tapeName
     
@@ -415,14 +1061,183 @@ class RenamedTape(Tape):
             return None
         return RenamedTape(newChild, self._fromTape, self._toTape)
 
-    def tokenize(self, tapeName: str, string: str) -> List[Token]:
+    def tokenize(self, tapeName: str, string: str, cache: bool = True) -> List[Token]:
+        tapeName = self._adjustTapeName(tapeName)
+        return self._child.tokenize(tapeName, string, cache)
+
+    def addToVocab(self, tapeName: str, string: str) -> None:
+        tapeName = self._adjustTapeName(tapeName)
+        self._child.addToVocab(tapeName, string)
+
+    def inVocab(self, tapeName: str, string: str) -> bool:
         tapeName = self._adjustTapeName(tapeName)
-        return self._child.tokenize(tapeName, string)
+        return self._child.inVocab(tapeName, string)
 
-    def toBits(self, tapeName: str, char: str) -> BitSet:
+    def fixWidth(self) -> None:
+        self._child.fixWidth()
+
+    def freeze(self) -> None:
+        self._child.freeze()
+
+    @property
+    def frozen(self) -> bool:
+        return self._child.frozen
+
+    def toBits(self, tapeName: str, char: str) -> Bits:
         tapeName = self._adjustTapeName(tapeName)
         return self._child.toBits(tapeName, char)
 
-    def fromBits(self, tapeName: str, bits: BitSet) -> List[str]:
+    def fromBits(self, tapeName: str, bits: Bits) -> List[str]:
         tapeName = self._adjustTapeName(tapeName)
-        return self._child.fromBits(tapeName, bits)
\ No newline at end of file
+        return self._child.fromBits(tapeName, bits)
+
+class RestrictedTape(Tape):
+    """
+    A view of a tape in which every match is also narrowed to a particular
+    token; see RestrictedTapes.
+    """
+    def __init__(self, child: Tape, restriction: Token) -> None:
+        super().__init__(child.tapeName, child.numTapes)
+        self._child = child
+        self.restriction: Final[Token] = restriction
+
+    @property
+    def base(self) -> Tape:
+        return self._child.base
+
+    @property
+    def restricted(self) -> bool:
+        return True
+
+    def any(self) -> Token:
+        return self._child.any()
+
+    def add(self, str1: str, str2: str) -> List[str]:
+        return self._child.add(str1, str2)
+
+    @property
+    def unrestricted(self) -> Tape:
+        return self._child
+
+    def match(self, str1: Token, str2: Token) -> Token:
+        return self.narrow(self._child.match(str1, str2))
+
+    def narrow(self, token: Token) -> Token:
+        return token.and_(self.restriction)
+
+    def constrain(self, target: Token) -> Optional[Token]:
+        constraint: Optional[Token] = self._child.constrain(target)
+        if constraint is None:
+            return self.restriction
+        return constraint.and_(self.restriction)
+
+    def matchTape(self, tapeName: str) -> Optional[Tape]:
+        return self if tapeName == self.tapeName else None
+
+    @property
+    def tapeMask(self) -> int:
+        return tapeBit(self.tapeName)
+
+    def tokenize(self, tapeName: str, string: str, cache: bool = True) -> List[Token]:
+        return self._child.tokenize(tapeName, string, cache)
+
+    def addToVocab(self, tapeName: str, string: str) -> None:
+        self._child.addToVocab(tapeName, string)
+
+    def inVocab(self, tapeName: str, string: str) -> bool:
+        return self._child.inVocab(tapeName, string)
+
+    @property
+    def frozen(self) -> bool:
+        return self._child.frozen
+
+    def toBits(self, tapeName: str, char: str) -> Bits:
+        return self._child.toBits(tapeName, char)
+
+    def fromBits(self, tapeName: str, bits: Bits) -> List[str]:
+        return self._child.fromBits(tapeName, bits)
+
+
+class RestrictedTapes(Tape):
+    """ Restricted view of a TapeCollection
+
+    When we parse, we know what the next character on each input tape has to
+    be.  Rather than query the grammar for everything and throw away what
+    doesn't agree with the input, we query it with one of these: a free query,
+    like any other, except that on the input tapes, matchTape() gives a
+    RestrictedTape whose matches are narrowed to the next character(s).  The
+    traversal is exactly the same (so results come in the same order as
+    generate() would give them), but states that know what they're going to
+    match (like a big UnionState, see UnionState.ndQuery()) can ask constrain()
+    and not bother with children that can't.
+
+    The one place that isn't true is a JoinState: which of its semijoins it
+    takes depends on whether the first matches anything at all, even things
+    the restriction would throw away.  So joins query their children with the
+    unrestricted tapes, and narrow what they match afterwards.
+
+    Get these from TapeCollection.restrict(), which keeps them, rather than
+    constructing them directly.
+    """
+    def __init__(self, child: TapeCollection, restrictions: Dict[str, Token]) -> None:
+        super().__init__(child.tapeName, child.numTapes)
+        self._child = child
+        self._restricted: Dict[str, RestrictedTape] = {}
+        for tapeName, token in restrictions.items():
+            tape: Optional[Tape] = child.matchTape(tapeName)
+            if tape is not None:
+                self._restricted[tapeName] = RestrictedTape(tape, token)
+        self.cacheTransitions(child.transitions)
+
+    def cacheTransitions(self, transitions: Optional[TransitionCache]) -> None:
+        self.transitions = transitions
+        for tape in self._restricted.values():
+            tape.transitions = transitions
+
+    @property
+    def tapeName(self) -> str:
+        return self._child.tapeName
+
+    @property
+    def numTapes(self) -> int:
+        return self._child.numTapes
+
+    @property
+    def base(self) -> Tape:
+        return self._child.base
+
+    @property
+    def restricted(self) -> bool:
+        return True
+
+    @property
+    def unrestricted(self) -> Tape:
+        return self._child
+
+    def any(self) -> Token:
+        return self._child.any()
+
+    def matchTape(self, tapeName: str) -> Optional[Tape]:
+        tape: Optional[RestrictedTape] = self._restricted.get(tapeName)
+        if tape is not None:
+            return tape
+        return self._child.matchTape(tapeName)
+
+    def tokenize(self, tapeName: str, string: str, cache: bool = True) -> List[Token]:
+        return self._child.tokenize(tapeName, string, cache)
+
+    def addToVocab(self, tapeName: str, string: str) -> None:
+        self._child.addToVocab(tapeName, string)
+
+    def inVocab(self, tapeName: str, string: str) -> bool:
+        return self._child.inVocab(tapeName, string)
+
+    @property
+    def frozen(self) -> bool:
+        return self._child.frozen
+
+    def toBits(self, tapeName: str, char: str) -> Bits:
+        return self._child.toBits(tapeName, char)
+
+    def fromBits(self, tapeName: str, bits: Bits) -> List[str]:
+        return self._child.fromBits(tapeName, bits)
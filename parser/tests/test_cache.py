@@ -0,0 +1,93 @@
+import pytest
+import random
+
+from ..cache import TransitionCache
+from ..stateMachine import State, Seq, Uni, Join, Any
+from ..tapes import TapeCollection, getTokenBackend, setTokenBackend
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import List
+
+
+def test_lru_eviction() -> None:
+    cache: TransitionCache[int] = TransitionCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)      # evicts "b", the least recently used
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_intern() -> None:
+    cache: TransitionCache[int] = TransitionCache(10)
+    first: State = text("hello")
+    second: State = text("hello")
+    assert cache.intern(first) is first
+    assert cache.intern(second) is first
+    assert cache.intern(text("goodbye")) is not first
+
+
+def test_cache_size_must_be_positive() -> None:
+    with pytest.raises(ValueError):
+        TransitionCache(0)
+
+
+@pytest.mark.parametrize("backend", ["int", "bitarray"])
+@pytest.mark.parametrize("grammar, expected_results", [
+    # 1. Alt text:hello|text:goodbye
+    (lambda: Uni(text("hello"), text("goodbye")), 
+        ({'text': 'hello'}, 
+         {'text': 'goodbye'})),
+    # 2. Two tapes: (t1:ab|t1:cb)+t2:x
+    (lambda: Seq(Uni(t1("ab"), t1("cb")), t2("x")), 
+        ({'t1': 'ab', 't2': 'x'}, 
+         {'t1': 'cb', 't2': 'x'})),
+    # 3. Joining text:hello & text:h.llo
+    (lambda: Join(text("hello"), Seq(text("h"), Any("text"), text("llo"))), 
+        ({'text': 'hello'},)),
+])
+def test_cached_generate(backend: str, grammar, expected_results) -> None:
+    previous: str = getTokenBackend().name
+    setTokenBackend(backend)
+    try:
+        state: State = grammar()
+        tapes: TapeCollection = state.compile(cacheSize=1000)
+        assert tapes.transitions is not None
+        for _ in range(3):
+            outputs: List[StringDict] = list(state.generate())
+            checkNumOutputs(outputs, len(expected_results))
+            checkOutputs(outputs, expected_results)
+        assert tapes.transitions.hits > 0
+    finally:
+        setTokenBackend(previous)
+
+
+def test_cache_stays_bounded() -> None:
+    state: State = Uni(*(text(word) for word in ["abc", "abd", "bcd", "cde", "def"]))
+    tapes: TapeCollection = state.compile(cacheSize=3)
+    for _ in range(2):
+        outputs: List[StringDict] = list(state.generate())
+        checkNumOutputs(outputs, 5)
+    assert len(tapes.transitions) <= 3
+
+
+def test_views_stay_bounded(monkeypatch) -> None:
+    # Each node of parseBatch()'s input trie restricts the tapes with what
+    # its inputs can go on with, so different chunks of inputs make lots of
+    # different views
+    monkeypatch.setattr(TapeCollection, "MAX_VIEWS", 8)
+    words: List[str] = [a + b for a in "abcdefgh" for b in "abcdefgh"]
+    state: State = Uni(*(Seq(t1(word), t2(word.upper())) for word in words))
+    tapes: TapeCollection = state.compile(cacheSize=1000)
+    inputs: List[str] = random.Random(0).sample(words, 64) + ["a", "hhh"]
+    expected = list(Uni(*(Seq(t1(word), t2(word.upper())) for word in words))
+                    .parseBatch(inputs, tapeName="t1"))
+    for _ in range(2):
+        assert list(state.parseBatch(inputs, tapeName="t1", chunkSize=5)) == expected
+        assert len(tapes._views) <= 8
+    assert tapes.transitions.hits > 0
@@ -0,0 +1,53 @@
+import pytest
+
+from ..stateMachine import CounterStack
+
+from typing import List
+
+
+def test_add() -> None:
+    empty: CounterStack = CounterStack(2)
+    stack: CounterStack = empty.add("verb").add("noun").add("verb")
+    assert stack.get("verb") == 2
+    assert stack.get("noun") == 1
+    assert stack.get("adj") == 0
+    assert stack.exceedsMax("verb")
+    assert not stack.exceedsMax("noun")
+    # add() doesn't change the stack it's given
+    assert empty.get("verb") == 0
+    assert empty.add("verb").get("verb") == 1
+
+
+def test_shared() -> None:
+    stack: CounterStack = CounterStack()
+    assert stack.add("verb") is stack.add("verb")
+    assert stack.add("verb").add("noun") is stack.add("verb").add("noun")
+
+
+@pytest.mark.parametrize("keys1, keys2, equal", [
+    ([], [], True),
+    (["verb"], ["verb"], True),
+    (["verb", "noun"], ["noun", "verb"], True),
+    (["verb", "verb", "noun"], ["verb", "noun", "verb"], True),
+    (["verb"], ["noun"], False),
+    (["verb", "verb"], ["verb"], False),
+])
+def test_equality(keys1: List[str], keys2: List[str], equal: bool) -> None:
+    stack1: CounterStack = CounterStack()
+    stack2: CounterStack = CounterStack()
+    for key in keys1:
+        stack1 = stack1.add(key)
+    for key in keys2:
+        stack2 = stack2.add(key)
+    assert (stack1 == stack2) == equal
+    assert (stack1.toString() == stack2.toString()) == equal
+    if equal:
+        assert hash(stack1) == hash(stack2)
+
+
+def test_deep() -> None:
+    stack: CounterStack = CounterStack(float("inf"))
+    for i in range(100000):
+        stack = stack.add(f"symbol{i % 10}")
+    assert stack.get("symbol3") == 10000
+    assert len({stack, CounterStack(float("inf"))}) == 2
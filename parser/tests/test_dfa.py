@@ -0,0 +1,101 @@
+import pickle
+import pytest
+
+from ..stateMachine import State, StateError, DfaState, SymbolTable, TrieState, Dfa, \
+                           Seq, Uni, Trie, Join, Any, Embed, Empty, Weight
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import Callable, List
+
+
+def embedded() -> State:
+    symbols: SymbolTable = {"STEM": Uni(text("help"), text("yelp"))}
+    return Seq(Embed("STEM", symbols), Uni(Empty(), text("s")), Embed("STEM", symbols))
+
+GRAMMARS: List[Callable[[], State]] = [
+    lambda: text("hello"),
+    lambda: Uni(text("help"), text("hello"), text("yelp"), text("")),
+    lambda: Seq(Uni(text("help"), text("yelp"), text("kelp")), Uni(text("s"), text("ed"), Empty())),
+    lambda: Seq(text("a"), Any("text"), text("b")),
+    lambda: Uni(Seq(text("a"), Any("text")), text("ab"), Seq(Any("text"), text("c"))),
+    lambda: Trie(*(text(f"{c}{v}p") for c in "ptk" for v in "aiu")),
+    embedded,
+    # Nothing but dots
+    lambda: Any("text"),
+    lambda: Seq(Any("text"), Any("text")),
+]
+
+@pytest.mark.parametrize("makeGrammar", GRAMMARS)
+def test_generate(makeGrammar: Callable[[], State]) -> None:
+    expected: List[StringDict] = list(makeGrammar().generate())
+    outputs: List[StringDict] = list(Dfa(makeGrammar()).generate())
+    checkNumOutputs(outputs, len(expected))
+    checkOutputs(outputs, tuple(expected))
+
+
+@pytest.mark.parametrize("makeGrammar", GRAMMARS)
+@pytest.mark.parametrize("inputs", [
+    {"text": "help"}, {"text": "helps"}, {"text": "hel"}, {"text": ""}, {"text": "azb"},
+    {"text": "ab"}, {"text": "xc"}, {"text": "kip"}, {"text": "helpyelp"}, {"t2": "x"},
+])
+def test_parse(makeGrammar: Callable[[], State], inputs: StringDict) -> None:
+    expected: List[StringDict] = list(makeGrammar().parse(inputs))
+    outputs: List[StringDict] = list(Dfa(makeGrammar()).parse(inputs))
+    checkNumOutputs(outputs, len(expected))
+    checkOutputs(outputs, tuple(expected))
+
+
+@pytest.mark.parametrize("makeGrammar", GRAMMARS)
+@pytest.mark.parametrize("other", [Seq(t2("x"), text("helps")), Seq(text("a"), Any("text")),
+                                   text("aéb")])
+def test_join(makeGrammar: Callable[[], State], other: State) -> None:
+    # Symbols the DFA has never seen still match its dots
+    for join in [lambda g: Join(other, g), lambda g: Join(g, other)]:
+        expected: List[StringDict] = list(join(makeGrammar()).generate())
+        outputs: List[StringDict] = list(join(Dfa(makeGrammar())).generate())
+        checkNumOutputs(outputs, len(expected))
+        checkOutputs(outputs, tuple(expected))
+
+
+@pytest.mark.parametrize("grammar, numStates", [
+    (Uni(text("help"), text("hello"), text("yelp")), 9),
+    # The stems share "elp", and everything ends in the same state
+    (Seq(Uni(text("help"), text("yelp"), text("kelp")), Uni(text("s"), text("ed"), Empty())), 7),
+    (Seq(text("a"), Any("text"), text("b")), 4),
+    (Trie(*(text(f"{c}{v}p") for c in "ptk" for v in "aiu")), 4),
+    (Any("text"), 2),
+])
+def test_minimal(grammar: State, numStates: int) -> None:
+    dfa: State = Dfa(grammar)
+    assert isinstance(dfa, DfaState)
+    assert dfa.table.numStates == numStates
+
+
+def test_trie_sharing() -> None:
+    # Every stem ends in the same two codas, so after the onsets and vowels,
+    # the stems all lead to the same node
+    trie: State = Trie(*(text(f"{c}{v}{coda}") for c in "ptk" for v in "aiu"
+                                               for coda in ["m", "x'"]))
+    assert isinstance(trie, TrieState)
+    children = {id(child) for tapeEdges in trie.node.edges.values()
+                          for _, child in tapeEdges.values()}
+    assert len(children) == 1
+
+
+@pytest.mark.parametrize("makeGrammar, error", [
+    (lambda: Seq(t1("a"), t2("b")), "one tape"),
+    (lambda: Empty(), "one tape"),
+    (lambda: Uni(Weight(text("a"), 1.0), text("b")), "Weighted"),
+    (lambda: Uni(*(text(str(i * i)) for i in range(1000))), "states"),
+])
+def test_errors(makeGrammar: Callable[[], State], error: str) -> None:
+    with pytest.raises(StateError, match=error):
+        Dfa(makeGrammar(), maxStates=100)
+
+
+def test_pickle() -> None:
+    grammar: State = Dfa(Seq(Uni(text("help"), text("yelp")), Any("text")))
+    copy: State = pickle.loads(pickle.dumps(grammar))
+    assert list(copy.parse({"text": "yelpz"})) == list(grammar.parse({"text": "yelpz"}))
+    checkOutputs(list(copy.parse({"text": "helps"})), ({"text": "helps"},))
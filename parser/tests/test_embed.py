@@ -0,0 +1,132 @@
+import pytest
+
+from ..stateMachine import State, EmbedState, LiteralState, StateError, SymbolTable, \
+                           Seq, Uni, Join, Embed, Empty, Dfa
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import Callable, List
+
+
+def test_embed() -> None:
+    symbols: SymbolTable = {}
+    symbols["STEM"] = Uni(t1("run"), t1("walk"))
+    grammar: State = Seq(Embed("STEM", symbols), t1("s"), t2("3SG"))
+    outputs: List[StringDict] = list(grammar.generate())
+    checkOutputs(outputs, ({"t1": "runs", "t2": "3SG"}, {"t1": "walks", "t2": "3SG"}))
+    checkOutputs(list(grammar.parse({"t1": "walks"})), ({"t1": "walks", "t2": "3SG"},))
+
+
+def test_lazy_lookup() -> None:
+    # Symbols can be defined after they're used...
+    symbols: SymbolTable = {}
+    grammar: State = Seq(t1("un"), Embed("STEM", symbols))
+    symbols["STEM"] = t1("do")
+    checkOutputs(list(grammar.generate()), ({"t1": "undo"},))
+    # ...but they have to be defined by the time they're needed
+    with pytest.raises(StateError):
+        list(Embed("VERB", symbols).generate())
+
+
+@pytest.mark.parametrize("maxRecursion", [1, 2, 4])
+def test_recursion(maxRecursion: int) -> None:
+    # S -> a S b | ""
+    symbols: SymbolTable = {}
+    symbols["S"] = Uni(Empty(), Seq(t1("a"), Embed("S", symbols), t1("b")))
+    grammar: State = Embed("S", symbols)
+    outputs: List[StringDict] = list(grammar.generate(maxRecursion))
+    checkOutputs(outputs, tuple({"t1": "a" * n + "b" * n} if n else {}
+                                for n in range(maxRecursion)))
+    checkOutputs(list(grammar.parse({"t1": "aabb"}, maxRecursion=4)), 
+                 ({"t1": "aabb"},))
+    checkNumOutputs(list(grammar.parse({"t1": "aab"}, maxRecursion=4)), 0)
+
+
+def ambiguous() -> State:
+    # S -> a | a S | S a, so every string of a's has several derivations
+    symbols: SymbolTable = {}
+    symbols["S"] = Uni(t1("a"), Seq(t1("a"), Embed("S", symbols)), 
+                       Seq(Embed("S", symbols), t1("a")))
+    return Embed("S", symbols)
+
+def compiled() -> State:
+    grammar: State = ambiguous()
+    grammar.compile(cacheSize=100)
+    return grammar
+
+# Each of these compares or hashes the states of the grammar, which contain
+# EmbedStates of the grammar itself
+@pytest.mark.parametrize("run", [
+    lambda: ambiguous().generate(),
+    lambda: ambiguous().generate(mergeStates=True),
+    lambda: compiled().generate(),
+    lambda: compiled().generate(mergeStates=True),
+    lambda: ambiguous().generate(strategy="iddfs"),
+    lambda: Dfa(ambiguous()).generate(),
+    lambda: (output for n in range(1, 6) for output in ambiguous().parse({"t1": "a" * n})),
+    lambda: (output for n in range(1, 6) for output in compiled().parse({"t1": "a" * n})),
+])
+def test_ambiguous_recursion(run: Callable[[], List[StringDict]]) -> None:
+    outputs: List[StringDict] = list(run())
+    checkNumOutputs(outputs, 4)
+    checkOutputs(outputs, tuple({"t1": "a" * n} for n in range(1, 5)))
+
+
+def test_recursive_equality() -> None:
+    grammar: State = ambiguous()
+    assert isinstance(grammar, EmbedState)
+    inner: State = grammar.getChild().children[1].children[1]
+    assert grammar == inner and hash(grammar) == hash(inner)
+    # Once it's under way, it's compared by where it is
+    assert grammar != EmbedState("S", grammar.symbolTable, t1(""))
+    assert EmbedState("S", grammar.symbolTable, grammar.getChild()) == grammar
+
+
+def test_shared(monkeypatch) -> None:
+    # A stem used by many rows is stored once, and its vocab is collected once
+    symbols: SymbolTable = {"STEM": Uni(t1("kan"), t1("tar"))}
+    rows: List[State] = [Seq(Embed("STEM", symbols), t1(suffix), t2(f"{i}"))
+                         for i, suffix in enumerate(["a", "e", "i", "o", "u"] * 8)]
+    grammar: State = Uni(*rows)
+    embeds: List[State] = [row.children[0] for row in rows]
+    assert all(isinstance(e, EmbedState) and e.getChild() is symbols["STEM"] for e in embeds)
+    
+    collected: List[str] = []
+    original = LiteralState._collectVocab
+    def _collectVocab(self, tapes, stateStack) -> None:
+        collected.append(self.text)
+        original(self, tapes, stateStack)
+    monkeypatch.setattr(LiteralState, "_collectVocab", _collectVocab)
+    grammar.compile()
+    assert collected.count("kan") == 1
+
+    checkOutputs(list(grammar.parse({"t1": "tare"})), ({"t1": "tare", "t2": "1"},
+                                                       {"t1": "tare", "t2": "6"},
+                                                       {"t1": "tare", "t2": "11"},
+                                                       {"t1": "tare", "t2": "16"},
+                                                       {"t1": "tare", "t2": "21"},
+                                                       {"t1": "tare", "t2": "26"},
+                                                       {"t1": "tare", "t2": "31"},
+                                                       {"t1": "tare", "t2": "36"}))
+
+
+def test_shared_transitions() -> None:
+    symbols: SymbolTable = {"STEM": Uni(*(t1(w) for w in ["kan", "kar", "tar"]))}
+    grammar: State = Uni(*(Seq(Embed("STEM", symbols), t1(suffix)) for suffix in "aeiou"))
+    tapes = grammar.compile(cacheSize=1000)
+    assert tapes.transitions is not None
+    checkNumOutputs(list(grammar.generate()), 15)
+    # Every row asks STEM the same things, so only the first asks for real
+    assert tapes.transitions.hits > tapes.transitions.misses / 2
+
+
+def test_embed_compiled() -> None:
+    # Embedding a compiled grammar reuses its vocab
+    symbols: SymbolTable = {"STEM": Uni(t1("kan"), t1("tar"))}
+    stemTapes = symbols["STEM"].compile()
+    grammar: State = Seq(Embed("STEM", symbols), t1("s"))
+    tapes = grammar.compile()
+    assert tapes.matchTape("t1") is not stemTapes.matchTape("t1")
+    checkOutputs(list(grammar.generate()), ({"t1": "kans"}, {"t1": "tars"}))
+    grammar = Join(Embed("STEM", symbols), t1("kan"))
+    assert grammar.compile().matchTape("t1") is stemTapes.matchTape("t1")
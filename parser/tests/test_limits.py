@@ -0,0 +1,55 @@
+import pytest
+
+from ..stateMachine import State, Seq, Uni, Any
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import List, Optional
+
+
+def ambiguous(n: int) -> State:
+    """ 2**n outputs, none of which are finished before step n """
+    return Seq(*(Uni(t1("a"), t1("b")) for _ in range(n)))
+
+
+@pytest.mark.parametrize("maxResults, expected", [
+    (None, 8), (0, 0), (1, 1), (3, 3), (8, 8), (100, 8),
+])
+def test_max_results(maxResults: Optional[int], expected: int) -> None:
+    outputs: List[StringDict] = list(ambiguous(3).generate(maxResults=maxResults))
+    checkNumOutputs(outputs, expected)
+    allOutputs: List[StringDict] = list(ambiguous(3).generate())
+    assert outputs == allOutputs[:expected]
+
+
+def test_zero_results() -> None:
+    grammar: State = Seq(t1("a"), Uni(*(t2(str(i)) for i in range(10))))
+    assert list(grammar.generate(maxResults=0)) == []
+    assert list(grammar.generate(strategy="dfs", maxResults=0)) == []
+    assert list(grammar.generateBest(maxResults=0)) == []
+    assert list(grammar.parse({"t1": "a"}, maxResults=0)) == []
+    assert list(grammar.parseBatch(["a", "b"], tapeName="t1", maxResults=0)) == [("a", []), ("b", [])]
+
+
+def test_max_results_merged() -> None:
+    # When paths are merged, the results are expanded one by one
+    outputs: List[StringDict] = list(ambiguous(12).generate(mergeStates=True, maxResults=2))
+    checkNumOutputs(outputs, 2)
+
+
+@pytest.mark.parametrize("maxFrontier", [1, 2, 5, 100])
+def test_max_frontier(maxFrontier: int) -> None:
+    frontierSizes: List[int] = []
+    grammar: State = ambiguous(20)
+    outputs: List[StringDict] = list(grammar.generate(frontierSizes=frontierSizes, 
+                                                      maxFrontier=maxFrontier, 
+                                                      maxResults=1))
+    checkOutputs(outputs, ({"t1": "a" * 20},))
+    assert max(frontierSizes) <= maxFrontier
+
+
+def test_max_frontier_keeps_results() -> None:
+    # With a frontier wide enough, nothing is lost
+    grammar: State = Uni(Seq(t1("ab"), t2("c")), Seq(t1("a"), Any("t2")), t2("xyz"))
+    allOutputs: List[StringDict] = list(grammar.generate())
+    assert list(grammar.generate(maxFrontier=10)) == allOutputs
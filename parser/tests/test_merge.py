@@ -0,0 +1,61 @@
+import pytest
+
+from ..stateMachine import State, Seq, Uni, Join, Any
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, unrelated, checkNumOutputs, checkOutputs
+
+from typing import List, Tuple
+
+
+def test_structural_equality() -> None:
+    assert text("hello") == text("hello")
+    assert hash(text("hello")) == hash(text("hello"))
+    assert text("hello") != text("hell")
+    assert text("hello") != t1("hello")
+    assert Seq(text("a"), text("b")) == Seq(text("a"), text("b"))
+    assert Seq(text("a"), text("b")) != Uni(text("a"), text("b"))
+    assert Any("text") == Any("text")
+
+
+@pytest.mark.parametrize("grammar, expected_results", [
+    # 1. Alt text:hello|text:goodbye
+    (Uni(text("hello"), text("goodbye")), 
+        ({'text': 'hello'}, 
+         {'text': 'goodbye'})),
+    # 2. Stems sharing suffixes: (text:ab|text:cb)+(text:x|text:y)
+    (Seq(Uni(text("ab"), text("cb")), Uni(text("x"), text("y"))), 
+        ({'text': 'abx'}, 
+         {'text': 'aby'},
+         {'text': 'cbx'},
+         {'text': 'cby'})),
+    # 3. Stems on two tapes merging into one suffix state
+    (Seq(Uni(Seq(t1("ab"), t2("A")), Seq(t1("cb"), t2("C"))), t1("x"), t2("X")), 
+        ({'t1': 'abx', 't2': 'AX'}, 
+         {'t1': 'cbx', 't2': 'CX'})),
+    # 4. Joining text:hello & text:h.llo
+    (Join(text("hello"), Seq(text("h"), Any("text"), text('llo'))), 
+        ({'text': 'hello'},)),
+    # 5. Joining unrelated-tier alts in same direction (duplicate outputs)
+    (Join(Uni(text("hello"), unrelated("foo")), Uni(text("hello"), unrelated("foo"))), 
+        ({'text': 'hello'},
+         {'unrelated': 'foo'},
+         {'text': 'hello', 'unrelated': 'foo'},
+         {'text': 'hello', 'unrelated': 'foo'})),
+])
+
+def test_merge_states(grammar: State, expected_results: Tuple[StringDict]) -> None:
+    outputs: List[StringDict] = list(grammar.generate(mergeStates=True))
+    checkNumOutputs(outputs, len(expected_results))
+    checkOutputs(outputs, expected_results)
+
+
+def test_merged_frontier_is_smaller() -> None:
+    stems: List[State] = [text(f"stem{i:02}") for i in range(20)]
+    grammar: State = Seq(Uni(*stems), Uni(text("an"), text("ux")))
+    unmerged: List[int] = []
+    merged: List[int] = []
+    expected: List[StringDict] = list(grammar.generate(frontierSizes=unmerged))
+    outputs: List[StringDict] = list(grammar.generate(mergeStates=True, frontierSizes=merged))
+    checkNumOutputs(outputs, len(expected))
+    checkOutputs(outputs, tuple(expected))
+    assert max(merged) < max(unmerged)
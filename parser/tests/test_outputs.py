@@ -0,0 +1,49 @@
+import pytest
+
+from ..stateMachine import State, Seq, Uni, Join, Any
+from ..tapes import expandChoices
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from itertools import islice
+from typing import List
+
+
+@pytest.mark.parametrize("choices, expected", [
+    ([], [""]),
+    ([["a"], ["b"], ["c"]], ["abc"]),
+    ([["a"], ["b", "c"], ["d"]], ["abd", "acd"]),
+    ([["a", "b"], ["c", "d"]], ["ac", "ad", "bc", "bd"]),
+    ([["a"], [], ["b"]], []),
+])
+
+def test_expand_choices(choices: List[List[str]], expected: List[str]) -> None:
+    assert list(expandChoices(choices)) == expected
+
+
+def test_long_output() -> None:
+    # Long enough that recursing once per character would blow the stack
+    sentence: str = "the quick brown fox jumps over the lazy dog " * 100
+    grammar: State = Seq(t1(sentence), t2(sentence.upper()))
+    outputs: List[StringDict] = list(grammar.generate(maxChars=10000))
+    checkOutputs(outputs, ({'t1': sentence, 't2': sentence.upper()},))
+    outputs = list(grammar.generate(maxChars=10000, mergeStates=True))
+    checkOutputs(outputs, ({'t1': sentence, 't2': sentence.upper()},))
+
+
+def test_dots_cross_product() -> None:
+    grammar: State = Join(Seq(Any("t1"), Any("t2")), Uni(Seq(t1("a"), t2("x")),
+                                                         Seq(t1("b"), t2("y"))))
+    outputs: List[StringDict] = list(grammar.generate())
+    checkNumOutputs(outputs, 2)
+    checkOutputs(outputs, ({'t1': 'a', 't2': 'x'}, {'t1': 'b', 't2': 'y'}))
+
+
+def test_outputs_are_lazy() -> None:
+    # Five dots over a 26-letter alphabet is nearly 12 million outputs from a
+    # single path; taking the first few shouldn't expand them all.
+    alphabet: str = "abcdefghijklmnopqrstuvwxyz"
+    grammar: State = Uni(text(alphabet), Seq(*(Any("text") for _ in range(5))))
+    outputs: List[StringDict] = list(islice(grammar.generate(), 3))
+    checkNumOutputs(outputs, 3)
+    assert all(len(o['text']) == 5 for o in outputs)
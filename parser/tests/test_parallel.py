@@ -0,0 +1,59 @@
+import pickle
+import pytest
+
+from ..parallel import parallelParse, parallelGenerate
+from ..stateMachine import State, Seq, Uni, Join, Any
+from ..tapes import getTokenBackend, setTokenBackend
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import List
+
+
+def makeGrammar() -> State:
+    return Seq(Uni(Seq(t1("ab"), t2("A")), Seq(t1("cb"), t2("C"))), 
+               Uni(Seq(t1("x"), t2("-X")), Seq(t1(""), t2("-0"))))
+
+INPUTS: List[str] = ["abx", "ab", "cb", "zz", "abx", "", "cbx", "a"] * 3
+
+
+@pytest.mark.parametrize("backend", ["int", "bitarray"])
+def test_pickle_compiled(backend: str) -> None:
+    previous: str = getTokenBackend().name
+    setTokenBackend(backend)
+    try:
+        grammar: State = makeGrammar()
+        grammar.compile(cacheSize=100)
+        expected: List[StringDict] = list(grammar.generate())
+        copy: State = pickle.loads(pickle.dumps(grammar))
+        assert copy == grammar
+        assert copy.compile().transitions is None
+        assert copy.compile().backend is getTokenBackend()
+        outputs: List[StringDict] = list(copy.generate())
+        checkNumOutputs(outputs, len(expected))
+        checkOutputs(outputs, tuple(expected))
+    finally:
+        setTokenBackend(previous)
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_parallel_parse(ordered: bool) -> None:
+    grammar: State = makeGrammar()
+    expected = list(grammar.parseBatch(INPUTS, tapeName="t1"))
+    results = list(parallelParse(grammar, INPUTS, tapeName="t1", numWorkers=2,
+                                 chunkSize=3, maxInFlight=2, ordered=ordered))
+    if ordered:
+        assert results == expected
+    else:
+        assert sorted(results, key=repr) == sorted(expected, key=repr)
+
+
+def test_parallel_generate() -> None:
+    grammar: State = makeGrammar()
+    queries: List[State] = [t1("abx"), Seq(Any("t1"), t1("b")), t2("C-X")]
+    results = list(parallelGenerate(grammar, queries, numWorkers=2, chunkSize=1))
+    assert [query for query, _ in results] == queries
+    for query, outputs in results:
+        expected: List[StringDict] = list(Join(query, grammar).generate())
+        checkNumOutputs(outputs, len(expected))
+        checkOutputs(outputs, tuple(expected))
@@ -0,0 +1,134 @@
+import pytest
+
+from ..stateMachine import State, Seq, Uni, Join, Any, parse
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, t3, unrelated, checkNumOutputs, checkOutputs
+
+from itertools import product
+from typing import List
+
+
+def filteredGenerate(grammar: State, inputs: StringDict) -> List[StringDict]:
+    """ What parse() should give, done the slow way """
+    return [o for o in grammar.generate() 
+            if all(o.get(tape, "") == string for tape, string in inputs.items())]
+
+
+GRAMMARS: List[State] = [
+    # 1. Alt text:hello|text:help
+    Uni(text("hello"), text("help")),
+    # 2. Stems with glosses, glosses before and after the text
+    Uni(Seq(t1("ab"), t2("X")), Seq(t2("Y"), t1("ab"), t2("Z")), Seq(t1("ac"), t2("W"))),
+    # 3. Stems and suffixes
+    Seq(Uni(Seq(t1("ab"), t2("A")), Seq(t1("cb"), t2("C"))), 
+        Uni(Seq(t1("x"), t2("-X")), Seq(t1(""), t2("-0")))),
+]
+
+@pytest.mark.parametrize("grammar", GRAMMARS)
+@pytest.mark.parametrize("inputs", [
+    {"text": "hello"},
+    {"text": "hell"},
+    {"t1": "ab"},
+    {"t1": "abx"},
+    {"t1": "hello"},
+    {"t1": "hxllo"},
+    {"t1": "ab", "t2": "YZ"},
+    {"t2": "AX"},
+    {"t2": "A-X"},
+    {"t1": ""},
+])
+def test_parse_matches_filtered_generate(grammar: State, inputs: StringDict) -> None:
+    outputs: List[StringDict] = list(grammar.parse(inputs))
+    expected: List[StringDict] = filteredGenerate(grammar, inputs)
+    checkNumOutputs(outputs, len(expected))
+    checkOutputs(outputs, tuple(expected))
+
+
+@pytest.mark.parametrize("grammar, inputs", [
+    # Whether a join's left semijoin matches anything decides which semijoin
+    # it takes, even if what it matches doesn't agree with the input
+    (Join(Uni(t2(""), Join(t1("bb"), t2("a"))), t1("a")), {"t1": "a"}),
+    (Join(Uni(Seq(t3("dd"), t3("b")), t2("dd"), t2("d")), Seq(t3("d"), t2("d"), t1("cc"))),
+     {"t1": "cc", "t2": "d"}),
+    # ...including in a union big enough to be indexed
+    (Join(Uni(*(Seq(t1(c), t2(c)) for c in "efghijklmnopqrst"),
+              Seq(t3("dd"), t3("b")), t2("dd"), t2("d"), t3("d")),
+          Seq(t3("d"), t2("d"), t1("cc"))),
+     {"t1": "cc", "t2": "d"}),
+])
+def test_parse_joins(grammar: State, inputs: StringDict) -> None:
+    outputs: List[StringDict] = list(grammar.parse(inputs))
+    expected: List[StringDict] = filteredGenerate(grammar, inputs)
+    checkNumOutputs(outputs, len(expected))
+    checkOutputs(outputs, tuple(expected))
+
+
+def test_parse_dot() -> None:
+    # The dot matches input characters that the grammar never mentions
+    grammar: State = Seq(t1("h"), Any("t1"), t1("llo"), t2("greeting"))
+    checkOutputs(parse(grammar, {"t1": "hello"}), ({"t1": "hello", "t2": "greeting"},))
+    checkOutputs(parse(grammar, {"t1": "hxllo"}), ({"t1": "hxllo", "t2": "greeting"},))
+    checkNumOutputs(parse(grammar, {"t1": "hllo"}), 0)
+    checkNumOutputs(parse(grammar, {"t1": "hello", "t2": "greet"}), 0)
+
+
+def test_parse_examples() -> None:
+    grammar: State = Uni(Seq(t1("ab"), t2("X")), Seq(t2("Y"), t1("ab"), t2("Z")))
+    checkOutputs(parse(grammar, {"t1": "ab"}), 
+                 ({"t1": "ab", "t2": "X"}, {"t1": "ab", "t2": "YZ"}))
+    checkNumOutputs(parse(grammar, {"t1": "a"}), 0)
+    checkNumOutputs(parse(grammar, {"t1": "abc"}), 0)
+    checkNumOutputs(parse(grammar, {"unrelated": "foo"}), 0)
+
+
+def test_max_results() -> None:
+    grammar: State = Seq(t1("a"), Uni(*(t2(str(i)) for i in range(10))))
+    checkNumOutputs(parse(grammar, {"t1": "a"}), 10)
+    checkNumOutputs(parse(grammar, {"t1": "a"}, maxResults=3), 3)
+
+
+def test_parse_compiled() -> None:
+    grammar: State = Uni(Seq(text("hello"), unrelated("greeting")), 
+                         Seq(text("h"), Any("text"), text("y"), unrelated("other")))
+    tapes = grammar.compile(cacheSize=1000)
+    for _ in range(2):
+        checkOutputs(parse(grammar, {"text": "hello"}), ({"text": "hello", "unrelated": "greeting"},))
+    assert tapes.transitions.hits > 0
+    # "hay" has a symbol the compiled grammar has never seen, so it's parsed
+    # with a collection of its own, and the dot can still match it.
+    checkOutputs(parse(grammar, {"text": "hay"}), ({"text": "hay", "unrelated": "other"},))
+    assert grammar.compile().matchTape("text").width == 5
+
+
+def test_inputs_not_cached() -> None:
+    # Only the grammar's own literals keep their tokens; parsing lots of
+    # different words mustn't make the compiled grammar any bigger
+    grammar: State = Seq(Uni(*(t1(w) for w in ["ab", "ba", "abc"])), t2("x"))
+    tape = grammar.compile().matchTape("t1")
+    list(grammar.parse({"t1": "ab"}))
+    numCached: int = len(tape._tokenCache)
+    words: List[str] = ["".join(w) for w in product("abc", repeat=5)]
+    for word in words:
+        list(grammar.parse({"t1": word}))
+    list(grammar.parseBatch(words, tapeName="t1"))
+    assert len(tape._tokenCache) == numCached
+
+
+BATCH: List[str] = ["abx", "ab", "cb", "zz", "abx", "", "cbx", "a", "abxx"]
+
+@pytest.mark.parametrize("grammar", GRAMMARS)
+@pytest.mark.parametrize("chunkSize", [1, 4, 100])
+def test_parse_batch(grammar: State, chunkSize: int) -> None:
+    results = list(grammar.parseBatch(BATCH, tapeName="t1", chunkSize=chunkSize))
+    assert [string for string, _ in results] == BATCH
+    for string, outputs in results:
+        expected: List[StringDict] = list(grammar.parse({"t1": string}))
+        checkNumOutputs(outputs, len(expected))
+        checkOutputs(outputs, tuple(expected))
+
+
+def test_parse_batch_max_results() -> None:
+    grammar: State = Uni(Seq(t1("a"), Uni(*(t2(str(i)) for i in range(10)))), t1("b"))
+    results = dict(grammar.parseBatch(["a", "b"], tapeName="t1", maxResults=3))
+    checkNumOutputs(results["a"], 3)
+    checkNumOutputs(results["b"], 1)
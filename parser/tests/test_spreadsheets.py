@@ -0,0 +1,177 @@
+import csv
+import io
+import pickle
+import pytest
+
+from ..spreadsheets import SheetCompiler, SheetReport, SheetError, loadSheets, loadGrammar
+from ..stateMachine import State, TrieState, UnionState, Embed
+from ..util import StringDict
+from .utils_for_tests import checkOutputs
+
+from typing import List, Tuple
+
+
+# The sheet in old/tests/test.csv
+LEXICON: str = """\
+"","","","",""
+ROOT,gloss,surf,"",""
+,eat,hamx'id,"",""
+"",know,qotlal,"",""
+"","","","",""
+SUFFIX,surf,gloss,"",""
+"",an,-1SG,"",""
+"",as,-2SG,"",""
+"",ux,-3SG.MED,"",""
+"",i,-3SG.PL,"",""
+"","","","",""
+WORD,var,var,"",""
+"",ROOT,SUFFIX,"",""
+"""
+
+def rows(sheet: str) -> List[List[str]]:
+    return list(csv.reader(io.StringIO(sheet)))
+
+
+def test_lexicon() -> None:
+    compiler: SheetCompiler = SheetCompiler()
+    report: SheetReport = compiler.loadRows("lexicon", rows(LEXICON))
+    assert report.symbols == ["ROOT", "SUFFIX", "WORD"]
+    assert report.numRows == 10
+    assert report.errors == []
+    outputs: List[StringDict] = list(Embed("WORD", compiler.symbolTable).generate())
+    checkOutputs(outputs, tuple({"gloss": stem + suffix, "surf": surf + ending}
+                                for stem, surf in [("eat", "hamx'id"), ("know", "qotlal")]
+                                for suffix, ending in [("-1SG", "an"), ("-2SG", "as"),
+                                                       ("-3SG.MED", "ux"), ("-3SG.PL", "i")]))
+    # A symbol is one flat union of its rows
+    suffix: State = compiler.symbolTable["SUFFIX"]
+    assert isinstance(suffix, UnionState) and len(suffix.children) == 4
+
+
+def test_symbols_across_sheets(tmp_path) -> None:
+    # A var can name a symbol from a later sheet
+    (tmp_path / "words.csv").write_text("WORD,var,surf\n,STEM,s\n", encoding="utf-8")
+    (tmp_path / "stems.csv").write_text("STEM,surf\n,run\n,walk\n", encoding="utf-8")
+    symbols, reports = loadSheets([str(tmp_path / "words.csv"), str(tmp_path / "stems.csv")])
+    assert [(r.sheetName, r.symbols) for r in reports] == [("words", ["WORD"]),
+                                                           ("stems", ["STEM"])]
+    checkOutputs(list(Embed("WORD", symbols).generate()),
+                 ({"surf": "runs"}, {"surf": "walks"}))
+
+
+def test_shared_cells() -> None:
+    compiler: SheetCompiler = SheetCompiler()
+    compiler.loadRows("nouns", rows("NOUN,surf,gloss\n,cat,N\n,dog,N\n,hat,N\n"))
+    glosses: List[State] = [row.children[1] for row in compiler.symbolTable["NOUN"].children]
+    assert glosses[0] is glosses[1] is glosses[2]
+
+
+def test_comments() -> None:
+    compiler: SheetCompiler = SheetCompiler()
+    report: SheetReport = compiler.loadRows("sheet", rows(
+        "# a comment\nSTEM,surf\n#,not\n,run\n\n,walk\n"))
+    assert report.numRows == 3
+    checkOutputs(list(Embed("STEM", compiler.symbolTable).generate()),
+                 ({"surf": "run"}, {"surf": "walk"}))
+
+
+@pytest.mark.parametrize("sheet, symbols, errors", [
+    (",run\nSTEM,surf\n,walk\n", ["STEM"], [(0, None)]),             # no symbol yet
+    ("STEM,surf\n,run,s\n,walk\n", ["STEM"], [(1, 2)]),              # no header
+    ("STEM,surf\nSUFFIX,surf\n,s\n", ["SUFFIX"], [(0, None)]),       # no rows
+    ("STEM,surf\n,run\nSTEM,surf\n,walk\n", ["STEM"], [(2, None)]),  # redefined
+])
+def test_errors(sheet: str, symbols: List[str], errors: List[Tuple]) -> None:
+    report: SheetReport = SheetCompiler().loadRows("sheet", rows(sheet))
+    assert report.symbols == symbols
+    assert [(e.row, e.col) for e in report.errors] == errors
+    assert all(isinstance(e, SheetError) and e.sheetName == "sheet" for e in report.errors)
+
+
+@pytest.mark.parametrize("traceMemory", [False, True])
+def test_report(traceMemory: bool) -> None:
+    sheet: str = "STEM,surf\n" + "".join(f",w{i}\n" for i in range(1000))
+    report: SheetReport = SheetCompiler(traceMemory=traceMemory).loadRows("sheet", rows(sheet))
+    assert report.numRows == 1001
+    assert report.seconds > 0
+    if traceMemory:
+        assert report.retainedBytes is not None and report.peakBytes is not None
+        assert 0 < report.retainedBytes <= report.peakBytes
+    else:
+        assert report.retainedBytes is None and report.peakBytes is None
+
+
+def writeSheets(tmp_path, stems: List[str]) -> List[str]:
+    (tmp_path / "words.csv").write_text("WORD,var,surf,gloss\n,STEM,s,-3SG\n,STEM,,\n",
+                                        encoding="utf-8")
+    (tmp_path / "stems.csv").write_text("STEM,surf\n" + "".join(f",{s}\n" for s in stems),
+                                        encoding="utf-8")
+    return [str(tmp_path / "words.csv"), str(tmp_path / "stems.csv")]
+
+def test_grammar_file(tmp_path, monkeypatch) -> None:
+    stems: List[str] = [f"{c}{v}p" for c in "ptkmns" for v in "aeiou"]
+    filenames: List[str] = writeSheets(tmp_path, stems)
+    grammar, reports = loadGrammar(filenames, "WORD")
+    assert (tmp_path / "words.grammar").exists()
+    expected: List[StringDict] = list(grammar.parse({"surf": "taps"}))
+    checkOutputs(expected, ({"surf": "taps", "gloss": "-3SG"},))
+
+    # The second time, nothing is loaded or compiled
+    def fail(*args) -> None:
+        raise AssertionError("The sheets shouldn't be loaded again")
+    monkeypatch.setattr(SheetCompiler, "loadFile", fail)
+    saved, savedReports = loadGrammar(filenames, "WORD")
+    assert [r.symbols for r in savedReports] == [r.symbols for r in reports]
+    assert saved.compile().frozen
+    assert list(saved.parse({"surf": "taps"})) == expected
+    monkeypatch.undo()
+
+    # A change to a sheet, or a different root, means compiling again
+    writeSheets(tmp_path, stems + ["zap"])
+    changed, _ = loadGrammar(filenames, "WORD")
+    checkOutputs(list(changed.parse({"surf": "zaps"})), ({"surf": "zaps", "gloss": "-3SG"},))
+    stem, _ = loadGrammar(filenames, "STEM")
+    checkOutputs(list(stem.parse({"surf": "zap"})), ({"surf": "zap"},))
+
+    # So does a broken file
+    (tmp_path / "words.grammar").write_bytes(b"not a grammar")
+    broken, _ = loadGrammar(filenames, "WORD", str(tmp_path / "words.grammar"))
+    assert list(broken.parse({"surf": "taps"})) == expected
+
+
+def test_prepare() -> None:
+    compiler: SheetCompiler = SheetCompiler(tries=False)
+    compiler.loadRows("sheet", rows("WORD,var,surf\n,STEM,s\n" +
+                                    "STEM,surf\n" + "".join(f",w{i}\n" for i in range(20)) +
+                                    "OTHER,surf\n" + "".join(f",x{i}\n" for i in range(20))))
+    assert sorted(compiler.reachable("WORD")) == ["STEM", "WORD"]
+    grammar: State = Embed("WORD", compiler.symbolTable)
+    tapes = grammar.compile()
+    compiler.prepare(tapes, "WORD")
+    # STEM is indexed, and the index survives pickling; OTHER can't be,
+    # since its symbols aren't in the grammar's vocabulary
+    assert tapes in compiler.symbolTable["STEM"]._indices
+    assert not compiler.symbolTable["OTHER"]._indices
+    copy: State = pickle.loads(pickle.dumps(grammar))
+    assert copy.compile() in copy.symbolTable["STEM"]._indices
+    checkOutputs(list(copy.parse({"surf": "w7s"})), ({"surf": "w7s"},))
+
+
+@pytest.mark.parametrize("tries", [False, True])
+def test_tries(tries: bool) -> None:
+    stems: str = "".join(f",w{i},G{i % 3}\n" for i in range(20))
+    compiler: SheetCompiler = SheetCompiler(tries=tries)
+    compiler.loadRows("sheet", rows("WORD,var,surf\n,STEM,s\n,STEM,\n" +
+                                    "STEM,surf,gloss,var\n" + stems + ",x,,OTHER\n" +
+                                    "OTHER,surf\n,y\n"))
+    # The literal rows of a big stanza are a trie, and the rest a union
+    stem: State = compiler.symbolTable["STEM"]
+    assert isinstance(stem, UnionState) and len(stem.children) == (2 if tries else 21)
+    assert isinstance(stem.children[0], TrieState) == tries
+    # Either way, the symbols are reported, and what they use is known
+    assert compiler.reports[0].symbols == ["WORD", "STEM", "OTHER"]
+    assert sorted(compiler.reachable("WORD")) == ["OTHER", "STEM", "WORD"]
+    grammar: State = Embed("WORD", compiler.symbolTable)
+    checkOutputs(list(grammar.parse({"surf": "w17s"})), ({"surf": "w17s", "gloss": "G2"},))
+    checkOutputs(list(grammar.parse({"surf": "xys"})), ({"surf": "xys"},))
+    assert len(list(grammar.parse({"gloss": "G0"}))) == 14
@@ -0,0 +1,62 @@
+import pytest
+
+from ..stateMachine import State, StateError, SymbolTable, Seq, Uni, Join, Any, Embed, Empty
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import Callable, List
+
+
+def recursive() -> State:
+    symbols: SymbolTable = {}
+    symbols["S"] = Uni(Empty(), Seq(t1("a"), Embed("S", symbols), t1("b")))
+    return Embed("S", symbols)
+
+GRAMMARS: List[Callable[[], State]] = [
+    lambda: text("hello"),
+    lambda: Empty(),
+    lambda: Uni(text("hello"), text("help"), text("world")),
+    lambda: Seq(Uni(t1("a"), t1("ab"), t1("")), Uni(t2("x"), Seq(t1("c"), t2("yy")))),
+    lambda: Uni(Seq(t1("ab"), t2("c")), Seq(t1("a"), Any("t2")), t2("xyz")),
+    lambda: Join(Uni(text("hello"), t2("foo")), Uni(text("hello"), t2("foo"))),
+    lambda: Seq(*(Uni(t1("a"), t1("aa"), Seq(t1("a"), t1("a"))) for _ in range(4))),
+    recursive,
+]
+
+@pytest.mark.parametrize("makeGrammar", GRAMMARS)
+@pytest.mark.parametrize("strategy", ["dfs", "iddfs"])
+def test_strategies(makeGrammar: Callable[[], State], strategy: str) -> None:
+    expected: List[StringDict] = list(makeGrammar().generate())
+    outputs: List[StringDict] = list(makeGrammar().generate(strategy=strategy))
+    checkNumOutputs(outputs, len(expected))
+    checkOutputs(outputs, tuple(expected))
+
+
+@pytest.mark.parametrize("maxChars", [0, 1, 2, 3, 5])
+@pytest.mark.parametrize("strategy", ["dfs", "iddfs"])
+def test_strategies_max_chars(maxChars: int, strategy: str) -> None:
+    grammar: State = Uni(Empty(), t1("a"), t1("ab"), t1("abc"), Seq(t1("ab"), t2("cde")))
+    expected: List[StringDict] = list(grammar.generate(maxChars=maxChars))
+    outputs: List[StringDict] = list(grammar.generate(maxChars=maxChars, strategy=strategy))
+    checkNumOutputs(outputs, len(expected))
+    checkOutputs(outputs, tuple(expected))
+
+
+def test_iddfs_order() -> None:
+    # Iterative deepening gives shorter results first, like breadth-first
+    grammar: State = Uni(t1("abcd"), t1("ab"), Seq(t1("a"), Uni(t1("bce"), t1("c"))))
+    outputs: List[StringDict] = list(grammar.generate(strategy="iddfs"))
+    assert [len(o["t1"]) for o in outputs] == [2, 2, 4, 4]
+    assert [len(o["t1"]) for o in grammar.generate(strategy="dfs")] != [2, 2, 4, 4]
+
+
+def test_dfs_first_result() -> None:
+    # Depth-first gets to a result without going through every stem
+    grammar: State = Seq(Uni(*(t1(f"{i:04d}") for i in range(1000))), t2("x"))
+    outputs: List[StringDict] = list(grammar.generate(strategy="dfs", maxResults=1))
+    checkNumOutputs(outputs, 1)
+
+
+def test_unknown_strategy() -> None:
+    with pytest.raises(StateError):
+        list(text("hello").generate(strategy="random"))
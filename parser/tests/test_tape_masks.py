@@ -0,0 +1,109 @@
+import pickle
+import pytest
+
+from .. import stateMachine
+from ..stateMachine import State, SymbolTable, ConcatState, UnionState, \
+                           Seq, Uni, Trie, Dfa, Join, Any, Embed, Empty, Weight
+from ..tapes import ALL_TAPES, tapeBit
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, t3, checkOutputs
+
+from typing import Callable, List, Optional, Set, Tuple
+
+
+def recursive() -> State:
+    symbols: SymbolTable = {}
+    symbols["S"] = Uni(t1("a"), Seq(t1("b"), Embed("S", symbols)))
+    return Embed("S", symbols)
+
+def tapesOf(grammar: State) -> Optional[Set[str]]:
+    """ The tapes in grammar's tapeMask, or None for all of them """
+    if grammar.tapeMask == ALL_TAPES:
+        return None
+    return {name for name in ["t1", "t2", "t3", "text"] if grammar.tapeMask & tapeBit(name)}
+
+@pytest.mark.parametrize("grammar, tapes", [
+    (t1("a"), {"t1"}),
+    (Any("t2"), {"t2"}),
+    (Seq(t1("a"), t2("b"), Weight(t1("c"), 1.0)), {"t1", "t2"}),
+    (Uni(t1("a"), Seq(t2("b"), t3("c"))), {"t1", "t2", "t3"}),
+    (Join(t1("a"), Seq(t1("a"), t2("b"))), {"t1", "t2"}),
+    (Embed("X", {"X": Seq(t1("a"), t3("c"))}), {"t1", "t3"}),
+    (Trie(*(Seq(t1(w), t2(w.upper())) for w in ["ab", "ac", "b"])), {"t1", "t2"}),
+    (Dfa(Uni(text("help"), text("yelp"))), {"text"}),
+    # Nothing on any tape passes an empty grammar by, so it has to be asked
+    (Empty(), None),
+    (Seq(t1("a"), Uni(Empty(), t2("b"))), None),
+    (recursive(), None),
+])
+def test_masks(grammar: State, tapes: Optional[Set[str]]) -> None:
+    grammar.compile()
+    assert tapesOf(grammar) == tapes
+
+
+JOINS: List[Callable[[], State]] = [
+    lambda: Join(Seq(t2("x"), t1("ab")), Seq(Uni(t1("ab"), t1("a")), Uni(t2("x"), t2("y")))),
+    lambda: Join(t3("c"), Seq(Uni(*(Seq(t1(f"w{i}"), t2(f"g{i}")) for i in range(20))), t3("c"))),
+    lambda: Join(Seq(t2("g1"), t1("w1")), Uni(*(Seq(t1(f"w{i}"), t2(f"g{i}")) for i in range(20)))),
+    lambda: Join(Seq(t2("b"), Any("t1")), Seq(t1("a"), Uni(Empty(), t2("b")), Any("t1"))),
+    lambda: Join(Seq(t2("b"), t1("aa")), Seq(recursive(), t2("b"))),
+    lambda: Join(t3("c"), Seq(Trie(*(Seq(t1(w), t2(w.upper())) for w in ["ab", "ac"])), t3("c"))),
+]
+
+@pytest.mark.parametrize("makeGrammar", JOINS)
+@pytest.mark.parametrize("maxRecursion", [0, 4])
+def test_joins(makeGrammar: Callable[[], State], maxRecursion: int, monkeypatch) -> None:
+    outputs: List[StringDict] = list(makeGrammar().generate(maxRecursion=maxRecursion))
+    monkeypatch.setattr(stateMachine, "_ignores", lambda *args: False)
+    expected: List[StringDict] = list(makeGrammar().generate(maxRecursion=maxRecursion))
+    assert len(outputs) == len(expected)
+    checkOutputs(outputs, tuple(expected))
+
+
+def test_skips_children(monkeypatch) -> None:
+    queried: List[Tuple[State, str]] = []
+    original = UnionState.ndQuery
+    def ndQuery(self, tape, *args):
+        queried.append((self, tape.tapeName))
+        return original(self, tape, *args)
+    monkeypatch.setattr(UnionState, "ndQuery", ndQuery)
+
+    # Once the query has matched on t3, the lexicon is asked about t3, but
+    # its rows (on t1 and t2) don't need to be
+    rows: State = Uni(*(Seq(t1(f"w{i}"), t2(f"g{i}")) for i in range(100)))
+    grammar: State = Join(Seq(t3("c"), t1("w7")), Seq(rows, Uni(t3("c"), t3("d"))))
+    checkOutputs(list(grammar.generate()), ({"t1": "w7", "t2": "g7", "t3": "c"},))
+    assert (rows, "t1") in queried and (rows, "t3") not in queried
+
+    queried.clear()
+    monkeypatch.setattr(stateMachine, "_ignores", lambda *args: False)
+    grammar = Join(Seq(t3("c"), t1("w7")), Seq(rows, Uni(t3("c"), t3("d"))))
+    checkOutputs(list(grammar.generate()), ({"t1": "w7", "t2": "g7", "t3": "c"},))
+    assert (rows, "t3") in queried
+
+
+def test_index_past_other_tapes(monkeypatch) -> None:
+    queried: List[State] = []
+    original = ConcatState.ndQuery
+    def ndQuery(self, *args):
+        queried.append(self)
+        return original(self, *args)
+    monkeypatch.setattr(ConcatState, "ndQuery", ndQuery)
+
+    # Asked about t2 first, the rows are indexed by what they have on t2, so
+    # only the 11 whose t2 starts with "7" get queried
+    rows: State = Uni(*(Seq(t1(f"w{i}"), t2(f"{i}g")) for i in range(100)))
+    grammar: State = Join(Seq(t2("7g"), t1("w7")), rows)
+    checkOutputs(list(grammar.generate()), ({"t1": "w7", "t2": "7g"},))
+    assert len([q for q in queried if q in rows.children]) == 11
+
+
+def test_pickle() -> None:
+    grammar: State = Seq(Uni(*(Seq(t1(f"w{i}"), t2(f"g{i}")) for i in range(20))), t3("c"))
+    grammar.compile()
+    assert grammar._tapeMask is not None
+    copy: State = pickle.loads(pickle.dumps(grammar))
+    assert copy._tapeMask is None
+    assert tapesOf(copy) == {"t1", "t2", "t3"}
+    query: State = Seq(t3("c"), t2("g3"))
+    assert list(Join(query, copy).generate()) == list(Join(query, grammar).generate())
@@ -0,0 +1,93 @@
+import pytest
+
+from ..stateMachine import State, LiteralState, Seq, Uni, Join
+from ..tapes import TapeCollection, TapeError
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import List
+
+
+def test_collections_dont_share_vocab() -> None:
+    tapes1: TapeCollection = TapeCollection()
+    tapes2: TapeCollection = TapeCollection()
+    tapes1.addToVocab("text", "hello")
+    tapes2.addToVocab("text", "goodbye")
+    tapes1.addToVocab("gloss", "greeting")
+    assert tapes1.matchTape("text").width == 4
+    assert tapes2.matchTape("text").width == 6
+    assert tapes1.matchTape("gloss").width == 6
+    assert tapes2.matchTape("gloss") is None
+
+
+def test_compile_freezes() -> None:
+    grammar: State = Seq(t1("hello"), t2("world"))
+    tapes: TapeCollection = grammar.compile()
+    assert tapes.frozen
+    assert grammar.compile() is tapes
+    tapes.tokenize("t1", "hello")
+    with pytest.raises(TapeError):
+        tapes.tokenize("t1", "goodbye")
+    with pytest.raises(TapeError):
+        tapes.addToVocab("t3", "hi")
+
+
+def test_compiled_generate() -> None:
+    grammar: State = Uni(text("hello"), text("goodbye"))
+    grammar.compile()
+    for _ in range(2):
+        outputs: List[StringDict] = list(grammar.generate())
+        checkNumOutputs(outputs, 2)
+        checkOutputs(outputs, ({'text': 'hello'}, {'text': 'goodbye'}))
+
+
+def test_compiled_grammar_in_join() -> None:
+    # The query has symbols the compiled grammar has never seen; the join
+    # collects its own vocabulary rather than growing the grammar's.
+    grammar: State = Uni(text("hello"), text("goodbye"))
+    grammar.compile()
+    outputs: List[StringDict] = list(Join(text("goodbye"), grammar).generate())
+    checkOutputs(outputs, ({'text': 'goodbye'},))
+    outputs = list(Join(text("welcome"), grammar).generate())
+    checkNumOutputs(outputs, 0)
+    assert grammar.compile().matchTape("text").width == 8
+
+
+def test_vocab_collected_once(monkeypatch) -> None:
+    calls: List[str] = []
+    original = LiteralState._collectVocab
+    def countingCollectVocab(self, tapes, stateStack) -> None:
+        calls.append(self.text)
+        original(self, tapes, stateStack)
+    monkeypatch.setattr(LiteralState, "_collectVocab", countingCollectVocab)
+
+    grammar: State = Uni(text("hello"), text("goodbye"))
+    for _ in range(3):
+        checkNumOutputs(list(grammar.generate()), 2)
+    checkNumOutputs(list(grammar.parse({"text": "hello"})), 1)
+    assert sorted(calls) == ["goodbye", "hello"]
+    
+    # Joining with a query only collects the query's vocab
+    calls.clear()
+    checkNumOutputs(list(Join(text("hello"), grammar).generate()), 1)
+    checkNumOutputs(list(Join(text("howdy"), grammar).generate()), 0)
+    assert calls == ["hello", "howdy"]
+
+
+def test_join_borrows_tapes() -> None:
+    grammar: State = Seq(t1("hello"), t2("world"))
+    tapes: TapeCollection = grammar.compile()
+
+    # Nothing new: the join uses the grammar's own tapes
+    joinTapes: TapeCollection = Join(t1("hello"), grammar).compile()
+    assert joinTapes.matchTape("t1") is tapes.matchTape("t1")
+    assert joinTapes.matchTape("t2") is tapes.matchTape("t2")
+
+    # Something new on t1: t1 is extended, keeping the grammar's indices
+    joinTapes = Join(t1("yellow"), grammar).compile()
+    assert joinTapes.matchTape("t1") is not tapes.matchTape("t1")
+    assert joinTapes.matchTape("t2") is tapes.matchTape("t2")
+    for symbol in "helo":
+        assert joinTapes.toBits("t1", symbol) == tapes.toBits("t1", symbol)
+    assert tapes.matchTape("t1").width == 4
+    assert joinTapes.matchTape("t1").width == 6
@@ -0,0 +1,85 @@
+import pytest
+
+from ..stateMachine import State, Seq, Uni, Join, Any
+from ..tapes import Tape, Token, TOKEN_BACKENDS, TapeCollection, \
+                    getTokenBackend, setTokenBackend
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import Callable, List, Tuple, Iterator
+
+
+@pytest.fixture(params=sorted(TOKEN_BACKENDS))
+def backend(request) -> Iterator[str]:
+    """ Run the test once under each token backend, restoring the default. """
+    oldBackend: str = getTokenBackend().name
+    setTokenBackend(request.param)
+    yield request.param
+    setTokenBackend(oldBackend)
+
+
+# Grammars are compiled the first time they're queried, with whatever backend
+# is current then, so each backend needs grammars of its own.
+@pytest.mark.parametrize("grammar, expected_results", [
+    # 1. Literal text:hello
+    (lambda: text("hello"), 
+        ({'text': 'hello'},)),
+    # 2. Sequence with alt: (text:hello|text:goodbye)+text:world
+    (lambda: Seq(Uni(text("hello"), text("goodbye")), text("world")), 
+        ({'text': 'helloworld'}, 
+         {'text': 'goodbyeworld'})),
+    # 3. Joining text:hello & text:h.llo
+    (lambda: Join(text("hello"), Seq(text("h"), Any("text"), text('llo'))), 
+        ({'text': 'hello'},)),
+    # 4. Joining t1:hello+t1:kitty & (t1:hello+t2:goodbye)+(t1:kitty+t2:world)
+    (lambda: Join(Seq(t1("hello"), t1("kitty")), Seq(Seq(t1("hello"), t2("goodbye")), Seq(t1("kitty"), t2("world")))), 
+        ({'t1': 'hellokitty', 't2': 'goodbyeworld'},)),
+    # 5. Joining (text:hello|text:goodbye) & (text:goodbye|text:welcome)
+    (lambda: Join(Uni(text("hello"), text("goodbye")), Uni(text("goodbye"), text("welcome"))), 
+        ({'text': 'goodbye'},)),
+])
+
+def test_backends(backend: str, grammar: Callable[[], State], expected_results: Tuple[StringDict]) -> None:
+    state: State = grammar()
+    outputs: List[StringDict] = list(state.generate())
+    checkNumOutputs(outputs, len(expected_results))
+    checkOutputs(outputs, expected_results)
+    assert state.compile().backend is getTokenBackend()
+
+
+def test_token_ops(backend: str) -> None:
+    tapes: TapeCollection = TapeCollection()
+    tapes.addToVocab("text", "hello")
+    tapes.fixWidth()
+    h, e, l, _, o = tapes.tokenize("text", "hello")
+    hOrE: Token = Token(h.bits | e.bits)
+    assert not hOrE.and_(h).isEmpty()
+    assert hOrE.and_(l).isEmpty()
+    assert hOrE.andNot(h).and_(h).isEmpty()
+    assert not hOrE.andNot(h).and_(e).isEmpty()
+    assert tapes.fromBits("text", hOrE.bits) == ["h", "e"]
+    textTape: Tape = tapes.matchTape("text")
+    assert textTape.match(o, tapes.any()) is o
+    assert tapes.fromBits("text", textTape.any().and_(o).bits) == ["o"]
+    assert tapes.fromBits("text", textTape.any().bits) == ["h", "e", "l", "o"]
+
+
+def test_interned_constants(backend: str) -> None:
+    assert TapeCollection().any() is TapeCollection().any()
+    assert TapeCollection().any() is getTokenBackend().anyChar
+    assert getTokenBackend().noChar.isEmpty()
+
+
+def test_large_vocab(backend: str) -> None:
+    # More than 32 distinct symbols on one tape, plus a dot that has to be
+    # able to match any of them.
+    words: List[str] = ["".join(chr(0x100 + i*10 + j) for j in range(10))
+                        for i in range(20)]
+    grammar: State = Uni(*(text(w) for w in words))
+    outputs: List[StringDict] = list(grammar.generate())
+    checkOutputs(outputs, tuple({'text': w} for w in words))
+
+    lastWord: str = words[-1]
+    dotted: State = Seq(text(lastWord[:5]), Any("text"), text(lastWord[6:]))
+    outputs = list(Join(grammar, dotted).generate())
+    checkOutputs(outputs, ({'text': lastWord},))
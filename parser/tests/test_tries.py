@@ -0,0 +1,97 @@
+import pickle
+import pytest
+
+from ..stateMachine import CounterStack, State, StateError, TrieState, UnionState, \
+                           Seq, Uni, Trie, Join, Any, Empty, Weight
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import Callable, List
+
+
+ROWS: List[Callable[[], List[State]]] = [
+    lambda: [text("hello"), text("help"), text("world")],
+    lambda: [text("hamx'id"), text("hamx'ida"), text("hax"), text("h")],
+    lambda: [text("a"), text("ab"), text("abc"), text("")],
+    lambda: [Seq(t1("hamx'id"), t2("eat")), Seq(t1("qotlal"), t2("know")),
+             Seq(t1("qo"), t2("know")), Seq(t1("qo"), t2("knew"))],
+    lambda: [Seq(t1("ab"), t2("c")), Seq(t1("a"), t2("c"), t1("b")), Seq(t2("c"), t1("ab"))],
+    # Empty literals; the last literal of a row keeps its tape in a join
+    lambda: [Seq(t2("bc"), t1(""))],
+    lambda: [Seq(t2("bc"), t1("")), t2("x")],
+    lambda: [Seq(t1(""), t2("bc")), Seq(t2("b"), t1(""), t2("c")), Seq(t2("bc"), t2("")),
+             Seq(t1("c"), t2(""))],
+    # Rows that aren't literals stay as they are
+    lambda: [t1("ab"), Seq(t1("a"), Any("t2")), Empty(), Weight(t1("ac"), 1.0)],
+]
+
+@pytest.mark.parametrize("makeRows", ROWS)
+def test_generate(makeRows: Callable[[], List[State]]) -> None:
+    expected: List[StringDict] = list(Uni(*makeRows()).generate())
+    outputs: List[StringDict] = list(Trie(*makeRows()).generate())
+    checkNumOutputs(outputs, len(expected))
+    checkOutputs(outputs, tuple(expected))
+
+
+@pytest.mark.parametrize("makeRows", ROWS)
+@pytest.mark.parametrize("inputs", [
+    {"text": "hamx'ida"}, {"text": "help"}, {"text": "ab"}, {"text": "hel"},
+    {"t1": "qo"}, {"t1": "ab"}, {"t2": "know"}, {"t2": "c"}, {"t1": "a", "t2": "c"},
+])
+def test_parse(makeRows: Callable[[], List[State]], inputs: StringDict) -> None:
+    expected: List[StringDict] = list(Uni(*makeRows()).parse(inputs))
+    outputs: List[StringDict] = list(Trie(*makeRows()).parse(inputs))
+    checkNumOutputs(outputs, len(expected))
+    checkOutputs(outputs, tuple(expected))
+
+
+@pytest.mark.parametrize("makeRows", ROWS)
+@pytest.mark.parametrize("other", [t2("know"), Seq(t2("kn"), Any("t2"), Any("t2")),
+                                   Seq(t2("c"), t1("ab")), t1("qo"), t1("c")])
+def test_join(makeRows: Callable[[], List[State]], other: State) -> None:
+    # Joins can ask about a later tape first, e.g. about the gloss of a row
+    # before its text
+    for join in [lambda rows: Join(other, rows), lambda rows: Join(rows, other)]:
+        expected: List[StringDict] = list(join(Uni(*makeRows())).generate())
+        outputs: List[StringDict] = list(join(Trie(*makeRows())).generate())
+        checkNumOutputs(outputs, len(expected))
+        checkOutputs(outputs, tuple(expected))
+
+
+def test_structure() -> None:
+    grammar: State = Trie(text("hamx'id"), text("hamx'ida"), text("hax"), Any("text"))
+    assert isinstance(grammar, UnionState)
+    trie: State = grammar.children[0]
+    assert isinstance(trie, TrieState)
+    # One edge from the root, "ha", and two from there, "mx'id" and "x"
+    [[(segments, node)]] = [list(edges.values()) for edges in trie.node.edges.values()]
+    assert segments == (("text", "ha"),)
+    assert sorted(s for edges in node.edges.values() for s, _ in edges.values()) == \
+           [(("text", "mx'id"),), (("text", "x"),)]
+    assert isinstance(Trie(text("a"), text("b")), TrieState)
+    with pytest.raises(StateError):
+        Trie()
+
+
+def test_successors() -> None:
+    # The stems share "stem", so after "s" there's one state left to query,
+    # rather than a union of every stem
+    stems: List[str] = [f"stem{i:03d}" for i in range(500)]
+    grammar: State = Trie(*(text(s) for s in stems))
+    tapes = grammar.compile()
+    [(_, _, _, successor)] = list(grammar.dQuery(tapes, tapes.any(), CounterStack()))
+    assert not isinstance(successor, UnionState)
+    [(_, _, _, unionSuccessor)] = list(Uni(*(text(s) for s in stems)).dQuery(
+        tapes, tapes.any(), CounterStack()))
+    assert isinstance(unionSuccessor, UnionState) and len(unionSuccessor.children) == 500
+    outputs: List[StringDict] = list(Seq(grammar, Uni(text("an"), text("as"))).generate())
+    checkNumOutputs(outputs, 1000)
+
+
+def test_pickle() -> None:
+    grammar: State = Trie(*(Seq(t1(f"w{i}"), t2(f"g{i % 3}")) for i in range(20)))
+    expected: List[StringDict] = list(grammar.parse({"t1": "w17"}))
+    checkOutputs(expected, ({"t1": "w17", "t2": "g2"},))
+    copy: State = pickle.loads(pickle.dumps(grammar))
+    assert list(copy.parse({"t1": "w17"})) == expected
+    assert list(copy.parse({"t2": "g0"})) == list(grammar.parse({"t2": "g0"}))
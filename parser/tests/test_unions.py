@@ -0,0 +1,196 @@
+import pytest
+import sys
+
+from .. import stateMachine
+from ..stateMachine import State, ConcatState, UnionState, CounterStack, Seq, Uni, Join, \
+                           Any, Empty, _refine, _refinePairwise
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import Callable, FrozenSet, List, Set, Tuple
+
+
+def test_flat_construction() -> None:
+    grammar: State = Uni(text("a"), Uni(text("b"), text("c")), text("d"))
+    assert isinstance(grammar, UnionState)
+    assert len(grammar.children) == 4
+    grammar = Seq(text("a"), Seq(text("b"), text("c")), text("d"))
+    assert isinstance(grammar, ConcatState)
+    assert len(grammar.children) == 4
+
+
+def test_large_union() -> None:
+    # Far more alternatives than the recursion limit
+    words: List[str] = [f"{i:05d}" for i in range(5000)]
+    grammar: State = Uni(*(Seq(t1(w), t2(w[::-1])) for w in words))
+    checkOutputs(list(grammar.parse({"t1": "01234"})), ({"t1": "01234", "t2": "43210"},))
+    checkNumOutputs(list(grammar.parse({"t1": "0123"})), 0)
+    outputs: List[StringDict] = list(grammar.generate(mergeStates=True))
+    checkNumOutputs(outputs, len(words))
+
+
+def test_long_sequence() -> None:
+    grammar: State = Seq(*(text(str(i % 10)) for i in range(3000)))
+    outputs: List[StringDict] = list(grammar.generate(maxChars=5000))
+    checkOutputs(outputs, ({"text": "0123456789" * 300},))
+
+
+def test_longer_than_recursion_limit(monkeypatch) -> None:
+    n: int = sys.getrecursionlimit() + 100
+    # Every empty literal is accepting, so each query goes past all of them
+    grammar: State = Seq(*([t1("")] * n + [t1("a")]))
+    checkOutputs(list(grammar.generate()), ({"t1": "a"},))
+    checkOutputs(list(grammar.parse({"t1": "a"})), ({"t1": "a"},))
+    # Queried on t2, every child gives itself back unmatched, and we go on
+    # to the next (when they aren't just passed over; see _ignores())
+    monkeypatch.setattr(stateMachine, "_ignores", lambda *args: False)
+    grammar = Seq(*(t1(str(i % 10)) for i in range(n)), t2("b"))
+    outputs: List[StringDict] = list(Join(t2("b"), grammar).generate(maxChars=2 * n))
+    checkOutputs(outputs, ({"t1": "0123456789" * (n // 10) + "0123456789"[:n % 10], "t2": "b"},))
+
+
+@pytest.mark.parametrize("grammar, expected_results", [
+    # 1. t1:ab+t2:A+t1:x+t2:-X joined with t2:A-X; the query can get to t2's
+    # second literal before the grammar has finished with t1's first.
+    (Join(t2("A-X"), Seq(t1("ab"), t2("A"), t1("x"), t2("-X"))), 
+        ({"t1": "abx", "t2": "A-X"},)),
+    # 2. Same, written as nested sequences, which are flattened
+    (Join(t2("A-X"), Seq(Seq(t1("ab"), t2("A")), Seq(t1("x"), t2("-X")))), 
+        ({"t1": "abx", "t2": "A-X"},)),
+])
+def test_concat_tape_order(grammar: State, expected_results) -> None:
+    outputs: List[StringDict] = list(grammar.generate())
+    checkNumOutputs(outputs, len(expected_results))
+    checkOutputs(outputs, expected_results)
+
+
+WORDS: List[str] = [f"{a}{b}{c}" for a in "abcd" for b in "xyz" for c in "pq"]
+
+INDEXED_GRAMMARS: List[Callable[[], State]] = [
+    # 1. Word list with glosses
+    lambda: Uni(*(Seq(t1(w), t2(w.upper())) for w in WORDS)),
+    # 2. Some children write to t2 first, one is a dot, one is empty
+    lambda: Uni(*(Seq(t1(w), t2(w.upper())) for w in WORDS[:12]),
+                *(Seq(t2(w.upper()), t1(w)) for w in WORDS[12:]),
+                Seq(Any("t1"), t1("zz")), Empty()),
+    # 3. Children that are unions and sequences of unions
+    lambda: Uni(*(Uni(Seq(t1(w), t2("1")), Seq(t1(w + "r"), t2("2"))) for w in WORDS),
+                Seq(Uni(t1(""), t1("b")), Uni(*(t1(w) for w in WORDS)))),
+]
+
+INDEXED_INPUTS: List[StringDict] = [
+    {"t1": "axp"}, {"t1": "dzq"}, {"t1": "bzq"}, {"t1": "bbzq"}, {"t1": "czqr"},
+    {"t1": "qzz"}, {"t1": ""}, {"t1": "axpx"}, {"t2": "BYP"}, {"t1": "cyp", "t2": "CYP"},
+    # Symbols the grammars don't have, which only a dot can match
+    {"t1": "fzz"}, {"t1": "axf"},
+]
+
+@pytest.mark.parametrize("makeGrammar", INDEXED_GRAMMARS)
+def test_union_index(makeGrammar: Callable[[], State], monkeypatch) -> None:
+    indexed: State = makeGrammar()
+    expected: List[List[StringDict]] = [list(indexed.parse(i)) for i in INDEXED_INPUTS]
+    expectedBatch = list(indexed.parseBatch((i["t1"] for i in INDEXED_INPUTS if "t2" not in i), "t1"))
+    expectedJoins = [list(Join(Seq(t1(w), Any("t2")), indexed).generate()) for w in WORDS[:3]]
+    assert any(len(e) > 0 for e in expected)
+
+    monkeypatch.setattr(UnionState, "INDEX_THRESHOLD", 10**9)
+    unindexed: State = makeGrammar()
+    for inputs, results in zip(INDEXED_INPUTS, expected):
+        assert list(unindexed.parse(inputs)) == results, f"Wrong results for {inputs}"
+    assert list(unindexed.parseBatch((i["t1"] for i in INDEXED_INPUTS if "t2" not in i), 
+                                     "t1")) == expectedBatch
+    assert [list(Join(Seq(t1(w), Any("t2")), unindexed).generate()) 
+            for w in WORDS[:3]] == expectedJoins
+
+
+def test_union_index_skips_children(monkeypatch) -> None:
+    queried: List[State] = []
+    original = ConcatState.ndQuery
+    def ndQuery(self, *args):
+        queried.append(self)
+        return original(self, *args)
+    monkeypatch.setattr(ConcatState, "ndQuery", ndQuery)
+
+    grammar: State = Uni(*(Seq(t1(w), t2(w.upper())) for w in WORDS))
+    checkOutputs(list(grammar.parse({"t1": "cyq"})), ({"t1": "cyq", "t2": "CYQ"},))
+    # At first, only the six words starting with "c" get queried
+    assert len([q for q in queried if q in grammar.children]) == 6
+    numIndexed: int = len(queried)
+
+    queried.clear()
+    monkeypatch.setattr(UnionState, "INDEX_THRESHOLD", 10**9)
+    grammar = Uni(*(Seq(t1(w), t2(w.upper())) for w in WORDS))
+    checkOutputs(list(grammar.parse({"t1": "cyq"})), ({"t1": "cyq", "t2": "CYQ"},))
+    assert numIndexed < len(queried)
+
+
+def test_union_index_shared() -> None:
+    # Inputs with symbols the grammar doesn't have get tapes of their own,
+    # but those extend the grammar's, so they can all use the same index
+    grammar: State = Uni(*(Seq(t1(w), t2(w.upper())) for w in WORDS), Seq(Any("t1"), t1("zz")))
+    for c in "EFGHIJKLMNOPQRSTUVWXYZefghijklmno0123456789!?#$%&*+=":
+        checkOutputs(list(grammar.parse({"t1": f"{c}zz"})), ({"t1": f"{c}zz"},))
+    checkOutputs(list(grammar.parse({"t1": "cyq"})), ({"t1": "cyq", "t2": "CYQ"},))
+    assert len(grammar._indices) == 1
+
+    # Unrelated tapes (here, those of joins with new symbols) each get their
+    # own, but only so many are kept
+    for c in "EFGHIJKLMN":
+        checkOutputs(list(Join(Uni(t1("cyq"), t1(f"{c}zz")), grammar).generate()), 
+                     ({"t1": "cyq", "t2": "CYQ"}, {"t1": f"{c}zz"}))
+    assert len(grammar._indices) == UnionState.MAX_INDICES
+
+
+@pytest.mark.parametrize("grammar", [
+    # 1. Disjoint
+    Uni(text("a"), text("b"), text("c")),
+    # 2. Identical
+    Uni(text("ab"), text("ac"), text("ad")),
+    # 3. Overlapping, on two tapes
+    Uni(text("ab"), Seq(Any("text"), text("d")), text("b"), t2("x"), 
+        Seq(Any("text"), t2("y")), t2("x"), text("ac")),
+])
+def test_disjoint_results(grammar: State) -> None:
+    tapes = grammar.compile()
+    results = list(grammar.dQuery(tapes, tapes.any(), CounterStack()))
+    seen: Set[Tuple[str, str]] = set()
+    for tape, token, matched, nextState in results:
+        for symbol in tape.fromBits(tape.tapeName, token.bits):
+            assert (tape.tapeName, symbol) not in seen
+            seen.add((tape.tapeName, symbol))
+    assert seen == {(tape.tapeName, symbol) for tape, token, _, _ in grammar.ndQuery(
+                        tapes, tapes.any(), CounterStack())
+                        for symbol in tape.fromBits(tape.tapeName, token.bits)}
+
+    # Partition refinement splits tokens up the same way comparing every pair does
+    textTape = tapes.matchTape("text")
+    group = [[token.bits, token, matched, [nextState]] for tape, token, matched, nextState 
+             in grammar.ndQuery(tapes, tapes.any(), CounterStack()) if tape is textTape]
+    def parts(refined) -> Set[Tuple[FrozenSet[str], Tuple[State, ...]]]:
+        return {(frozenset(textTape.fromBits("text", bits)), tuple(states)) 
+                for bits, _, _, states in refined}
+    assert parts(_refine(textTape, group)) == parts(_refinePairwise(group))
+
+
+def _size(state: State) -> int:
+    if isinstance(state, UnionState) or isinstance(state, ConcatState):
+        return 1 + sum(_size(child) for child in state.children)
+    return 1
+
+def test_successor_unions_stay_flat() -> None:
+    # Every copy can be matched by "a" in three ways, so without flattening
+    # the successors are unions of unions of unions...
+    grammar: State = Seq(*(Uni(text("a"), text("aa"), Seq(text("a"), text("a"))) 
+                           for _ in range(8)))
+    tapes = grammar.compile()
+    states: List[State] = [grammar]
+    for _ in range(8):
+        states = [nextState for state in states 
+                  for _, _, _, nextState in state.dQuery(tapes, tapes.any(), CounterStack())]
+        for state in states:
+            assert _size(state) < 200
+            if isinstance(state, UnionState):
+                assert not any(isinstance(child, UnionState) for child in state.children)
+                assert len(set(state.children)) == len(state.children)
+    outputs: List[StringDict] = list(grammar.generate())
+    checkOutputs(outputs, tuple({"text": "a" * n} for n in range(8, 17)))
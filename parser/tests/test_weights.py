@@ -0,0 +1,71 @@
+import pytest
+
+from ..stateMachine import State, StateError, Seq, Uni, Join, Any, Empty, Weight
+from ..tapes import Token, WeightedToken
+from ..util import StringDict
+from .utils_for_tests import text, t1, t2, checkNumOutputs, checkOutputs
+
+from typing import List, Tuple
+
+
+def test_weighted_tokens() -> None:
+    token: Token = WeightedToken(0b0110, 1.5)
+    assert token.and_(Token(0b0011)).weight == 1.5
+    assert token.and_(WeightedToken(0b0011, 2.0)).weight == 3.5
+    assert token.andNot(Token(0b0010)).weight == 1.5
+    assert Token(0b1).and_(Token(0b1)).weight == 0
+    assert Token(0b1).addWeight(0.5).weight == 0.5
+
+
+@pytest.mark.parametrize("grammar, expected", [
+    # 1. Alternatives come out lightest first
+    (Uni(Weight(text("b"), 2.0), Weight(text("a"), 1.0), text("c")),
+        [(0.0, {"text": "c"}), (1.0, {"text": "a"}), (2.0, {"text": "b"})]),
+    # 2. Lighter long results come before heavier short ones
+    (Uni(Weight(text("x"), 5.0), Weight(text("abcdefg"), 0.5)),
+        [(0.5, {"text": "abcdefg"}), (5.0, {"text": "x"})]),
+    # 3. Weights along a path add up
+    (Seq(Uni(Weight(t1("a"), 1.0), Weight(t1("b"), 3.0)), 
+         Uni(Weight(t2("x"), 1.0), Weight(t2("y"), 1.5))),
+        [(2.0, {"t1": "a", "t2": "x"}), (2.5, {"t1": "a", "t2": "y"}), 
+         (4.0, {"t1": "b", "t2": "x"}), (4.5, {"t1": "b", "t2": "y"})]),
+    # 4. Overlapping alternatives keep their own weights
+    (Uni(Weight(text("ab"), 2.0), Weight(text("ac"), 1.0), Weight(Seq(Any("text"), text("b")), 0.5)),
+        [(0.5, {"text": "ab"}), (0.5, {"text": "bb"}), (0.5, {"text": "cb"}), 
+         (1.0, {"text": "ac"}), (2.0, {"text": "ab"})]),
+    # 5. Weights on both sides of a join add up
+    (Join(Uni(Weight(text("a"), 1.0), Weight(text("b"), 0.25)), 
+          Uni(Weight(text("a"), 0.5), Weight(text("b"), 2.0))),
+        [(1.5, {"text": "a"}), (2.25, {"text": "b"})]),
+    # 6. A weighted empty alternative is paid for when it's skipped...
+    (Seq(Uni(Weight(Empty(), 5.0), Weight(t1("s"), 1.0)), t2("x")),
+        [(1.0, {"t1": "s", "t2": "x"}), (5.0, {"t2": "x"})]),
+    # 7. ... and when it's where the path stops
+    (Seq(t1("a"), Uni(Weight(t1(""), 5.0), Weight(t1("s"), 1.0))),
+        [(1.0, {"t1": "as"}), (5.0, {"t1": "a"})]),
+    # 8. ... and when it's skipped by a query on a tape it doesn't have
+    (Join(Seq(t2("b"), t1("a")), Seq(Weight(Empty(), 2.0), t1("a"))),
+        [(2.0, {"t1": "a", "t2": "b"})]),
+])
+def test_generate_best(grammar: State, expected: List[Tuple[float, StringDict]]) -> None:
+    assert list(grammar.generateBest()) == expected
+    assert list(grammar.generate(strategy="best")) == [o for _, o in expected]
+    # Breadth-first gives the same outputs, in another order
+    checkOutputs(list(grammar.generate()), tuple(o for _, o in expected))
+
+
+def test_best_stops_early() -> None:
+    # The heavy branch is never explored past its first step
+    heavy: State = Seq(*(Uni(t1("a"), t1("b")) for _ in range(30)))
+    grammar: State = Uni(Weight(heavy, 10.0), Weight(t1("light"), 1.0))
+    assert list(grammar.generateBest(maxResults=1)) == [(1.0, {"t1": "light"})]
+
+
+def test_unweighted_best() -> None:
+    grammar: State = Uni(text("abc"), text("ab"), Seq(text("a"), t2("x")))
+    assert list(grammar.generate(strategy="best")) == list(grammar.generate())
+
+
+def test_negative_weight() -> None:
+    with pytest.raises(StateError):
+        Weight(text("a"), -1.0)
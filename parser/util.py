@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import TypeVar, Generator, Dict
+from typing import TypeVar, Generator, Dict, Union
 from bitarray import bitarray
 
 # Gen[T]
@@ -34,6 +34,12 @@ class BitSet():
     def __len__(self):
         return self.bitset.__len__()
 
+    def __bool__(self):
+        return self.bitset.any()
+
+    def __hash__(self):
+        return hash((len(self.bitset), self.bitset.tobytes()))
+
     def __contains__(self, key):
         return self.bitset.__contains__(key)
 
@@ -139,3 +145,7 @@ class BitSet():
     def all(self):
         """ Return True if all bits in the BitSet are True. """
         return self.bitset.all()
+
+# The bits inside a Token: either a BitSet, or a plain Python int used as a
+# bit vector (see the TokenBackends in tapes.py).
+Bits = Union[BitSet, int]